@@ -0,0 +1,250 @@
+import glob
+import mmap
+import os
+import pathlib
+import re
+from contextlib import closing
+from functools import lru_cache
+
+from typing import Dict, FrozenSet, Iterator, List, Set, Tuple, Union
+
+from compressed_io import detect_format, iter_batches
+
+Path = Union[str, pathlib.Path]
+
+WINDOW_SIZE = 4 << 20
+SAMPLES = 64
+# The first field of every line.
+FIRST_FIELD = re.compile(rb'^[^\t\n]*', re.MULTILINE)
+
+
+def line_at(data, start: int, end: int) -> bytes:
+    """The line of `data` starting at `start`, without the newline."""
+    stop = data.find(b'\n', start, end)
+    return data[start:end if stop < 0 else stop]
+
+
+def last_line(data, start: int, end: int) -> bytes:
+    stop = end - 1 if end > start and data[end - 1:end] == b'\n' else end
+    return data[data.rfind(b'\n', start, stop) + 1:stop]
+
+
+def site(line: bytes) -> Tuple[bytes, int]:
+    """(chromosome, position) of a line, position -1 when it is not a number."""
+    fields = line.split(b'\t', 2)
+    position = fields[1].strip() if len(fields) > 1 else b''
+    return fields[0].strip(), int(position) if position.isdigit() else -1
+
+
+def candidate_lines(data, prefix: bytes, start: int, end: int) -> Iterator[bytes]:
+    """Lines of data[start:end] beginning with `prefix`, found with byte searches without splitting the lines."""
+    if data[start:start + len(prefix)] == prefix:
+        yield line_at(data, start, end)
+
+    needle = b'\n' + prefix
+    found = data.find(needle, start, end)
+
+    while found >= 0:
+        line = line_at(data, found + 1, end)
+        yield line
+        found = data.find(needle, found + 1 + len(line), end)
+
+
+def windows(data, size: int, window_size: int = WINDOW_SIZE) -> Iterator[Tuple[bytes, int, int]]:
+    """Ranges of about `window_size` bytes of `data` that hold whole lines."""
+    start = 0
+
+    while start < size:
+        end = data.find(b'\n', min(start + window_size, size) - 1)
+        end = size if end < 0 else end + 1
+        yield data, start, end
+        start = end
+
+
+class SortedCheck():
+    """Follows the sites at sampled or window boundary lines: every chromosome is contiguous and its positions do not decrease.
+
+    This only catches files that are obviously not sorted, it checks the
+    sorted files declared by the caller before scans stop early.
+    """
+
+    def __init__(self):
+        self.previous = None
+        self.seen = set()
+        self.sorted = True
+
+    def add(self, site: Tuple[bytes, int]) -> bool:
+        if self.previous is not None and site[0] == self.previous[0]:
+            self.sorted &= site[1] >= self.previous[1]
+        elif site[0] in self.seen:
+            self.sorted = False
+
+        self.seen.add(site[0])
+        self.previous = site
+
+        return self.sorted
+
+
+def looks_sorted(data, size: int) -> bool:
+    check = SortedCheck()
+
+    for sample in range(SAMPLES + 1):
+        offset = size * sample // SAMPLES
+        start = 0 if offset == 0 else data.find(b'\n', offset - 1) + 1
+
+        if offset and start <= 0:
+            break
+
+        if start < size and not check.add(site(line_at(data, start, size))):
+            return False
+
+    return True
+
+
+def scan(windows: Iterator[Tuple[bytes, int, int]], sites: List[Tuple[bytes, bytes]], sorted: bool) -> Iterator[bytes]:
+    prefixes = list(dict.fromkeys(chr + b'\t' + pos + b'\t' for chr, pos in sites))
+    # The last position of every chromosome, a sorted scan stops once it has passed all of them.
+    positions = {}
+    sorted = sorted and all(pos.isdigit() for _, pos in sites)
+
+    for chr, pos in sites:
+        positions[chr] = max(positions.get(chr, -1), int(pos) if pos.isdigit() else -1)
+
+    check = SortedCheck()
+
+    for data, start, end in windows:
+        for prefix in prefixes:
+            yield from candidate_lines(data, prefix, start, end)
+
+        if not sorted or start == end:
+            continue
+
+        first, last = site(line_at(data, start, end)), site(last_line(data, start, end))
+        sorted = check.add(first) and check.add(last)
+
+        # The window ends past the targets: later lines are on a later position or chromosome.
+        if sorted and all((last[0] == chr and last[1] > position) or (last[0] != chr and chr in check.seen)
+                          for chr, position in positions.items()):
+            return
+
+
+def scan_lines(path: Path, chr: str, pos: str, sorted: bool = False) -> Iterator[str]:
+    """The lines of a chromosome file at chr and pos, decoded only when the raw bytes match.
+
+    Plain files are memory mapped, compressed files are searched batch by
+    batch. When the file is declared position sorted, and the lines at the
+    window boundaries agree, the scan stops once it has passed the position.
+    """
+    return scan_sites(path, [(chr, pos)], sorted)
+
+
+def scan_sites(path: Path, sites: List[Tuple[str, str]], sorted: bool = False) -> Iterator[str]:
+    """The lines of a chromosome file at any of the (chr, pos) `sites`, in one pass over the file, see scan_lines."""
+    sites = [(chr.encode(), pos.encode()) for chr, pos in sites]
+
+    if detect_format(path) != 'plain':
+        batches = iter_batches(path)
+
+        try:
+            for line in scan(((batch, 0, len(batch)) for batch in batches), sites, sorted):
+                yield line.decode().rstrip('\r')
+        finally:
+            batches.close()
+
+        return
+
+    with open(path, 'rb') as f:
+        size = f.seek(0, 2)
+
+        if size == 0:
+            return
+
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            sorted = sorted and looks_sorted(data, size)
+
+            for line in scan(windows(data, size), sites, sorted):
+                yield line.decode().rstrip('\r')
+
+
+def expand_paths(spec: Path) -> List[str]:
+    """The files of a directory, the matches of a glob pattern or the file itself."""
+    spec = str(spec)
+
+    if os.path.isdir(spec):
+        return sorted(str(x) for x in pathlib.Path(spec).iterdir() if x.is_file() and not x.name.startswith('.'))
+
+    if glob.has_magic(spec):
+        return sorted(x for x in glob.glob(spec) if os.path.isfile(x))
+
+    return [spec]
+
+
+@lru_cache(maxsize=None)
+def compressed_chromosomes(path: str, size: int, mtime: int) -> FrozenSet[bytes]:
+    """Chromosomes of every line of a compressed file, which can only be read from its start; cached per file version."""
+    chromosomes = set()
+
+    with closing(iter_batches(path)) as batches:
+        for batch in batches:
+            chromosomes.update(FIRST_FIELD.findall(batch))
+
+    return frozenset(x.strip() for x in chromosomes) - {b''}
+
+
+def file_chromosomes(path: Path) -> Set[bytes]:
+    """Chromosomes of the first and last line of an uncompressed file, of every line of a compressed one."""
+    if detect_format(path) != 'plain':
+        stat = os.stat(path)
+        return set(compressed_chromosomes(str(path), stat.st_size, stat.st_mtime_ns))
+
+    with open(path, 'rb') as f:
+        first = f.readline()
+        size = f.seek(0, 2)
+        tail, length = b'', 1 << 16
+
+        # Reads a longer tail until it holds the whole last line.
+        while True:
+            start = max(0, size - length)
+            f.seek(start)
+            tail = f.read()
+            last = last_line(tail, 0, len(tail))
+
+            if start == 0 or len(last) < len(tail.rstrip(b'\n')):
+                break
+
+            length *= 4
+
+    return {site(first)[0], site(last)[0]} - {b''}
+
+
+class ChromosomeFiles():
+    """A set of chromosome files, usually one file per chromosome, and the chromosome each of them holds.
+
+    The chromosomes of an uncompressed file are read from its first and last
+    lines, compressed files are read once to list the chromosomes of all their
+    lines and are searched for each of them. Uncompressed files that hold
+    several chromosomes are searched for every query. A single file is always
+    searched.
+    """
+
+    def __init__(self, *specs: Path):
+        self.paths = [path for spec in specs for path in expand_paths(spec)]
+        self.chromosomes: Dict[str, List[str]] = {}
+        self.mixed: List[str] = []
+
+        # A single file is searched anyway, its chromosomes are not read.
+        for path in self.paths if len(self.paths) > 1 else []:
+            chromosomes = file_chromosomes(path)
+
+            # Every chromosome of a compressed file is known, only the ends of an uncompressed one.
+            if len(chromosomes) == 1 or detect_format(path) != 'plain':
+                for chr in sorted(chromosomes):
+                    self.chromosomes.setdefault(chr.decode(), []).append(path)
+            else:
+                self.mixed.append(path)
+
+    def files(self, chr: str) -> List[str]:
+        if len(self.paths) == 1:
+            return list(self.paths)
+
+        return self.chromosomes.get(chr, []) + self.mixed
@@ -0,0 +1,36 @@
+import argparse
+import importlib
+import sys
+
+# Subcommand -> (module, help). A module is only imported when its subcommand runs,
+# so pandas, matplotlib and Tk are never loaded for the commands that do not use them.
+COMMANDS = {
+    'analyse': ('filter_all', 'Family analysis: father_mother, mother_child, father_mother_child or family'),
+    'big-data': ('filter_big_data', 'Streaming father/mother comparison of large files'),
+    'meta': ('filter_meta_data', 'Allele frequency of a variant per phenotype'),
+    'cohort': ('cohort_store', 'Carriers and in-house frequencies in the cohort store'),
+    'population': ('population_index', 'Compile a population frequency table into an index'),
+    'scan': ('phenotype_scan', 'Per-phenotype frequencies of every variant of a region, written to a queryable table'),
+    'serve': ('query_service', 'Keep the metadata and chromosome indexes loaded and answer queries'),
+    'gui': ('filter_ui', 'Open the graphical interface'),
+}
+
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else list(argv)
+
+    parser = argparse.ArgumentParser(prog='ngs', description='NGS data analyser.')
+    parser.add_argument('command', choices=COMMANDS, metavar='command',
+                        help='; '.join(f'{name}: {text}' for name, (_, text) in COMMANDS.items()))
+    parser.add_argument('args', nargs=argparse.REMAINDER, help='Arguments of the command, see `ngs <command> --help`')
+
+    # Only the command name is parsed here, everything after it belongs to the command.
+    args = parser.parse_args(argv[:1])
+    module, _ = COMMANDS[args.command]
+    sys.argv[0] = f'ngs {args.command}'
+
+    return importlib.import_module(module).main(argv[1:])
+
+
+if __name__ == "__main__":
+    sys.exit(main())
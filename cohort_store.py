@@ -0,0 +1,217 @@
+import argparse
+import json
+import pathlib
+import sqlite3
+import time
+
+from typing import Any, Dict, Iterable, List, Tuple, Union
+
+Path = Union[str, pathlib.Path]
+
+# (chr, start, end, ref, alt, gene), the composite key of a variant in the store.
+Variant = Tuple[str, int, int, str, str, str]
+VARIANT_COLUMNS = ['Chr', 'Start', 'End', 'Ref', 'Alt', 'Gene.refGene']
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS samples (
+    id INTEGER PRIMARY KEY,
+    family TEXT NOT NULL,
+    member TEXT NOT NULL,
+    source TEXT NOT NULL,
+    ingested REAL NOT NULL,
+    UNIQUE (family, member)
+);
+CREATE TABLE IF NOT EXISTS variants (
+    id INTEGER PRIMARY KEY,
+    chr TEXT NOT NULL,
+    start INTEGER NOT NULL,
+    stop INTEGER NOT NULL,
+    ref TEXT NOT NULL,
+    alt TEXT NOT NULL,
+    gene TEXT NOT NULL,
+    het INTEGER NOT NULL DEFAULT 0,
+    hom INTEGER NOT NULL DEFAULT 0,
+    UNIQUE (chr, start, stop, ref, alt, gene)
+);
+CREATE INDEX IF NOT EXISTS variants_gene ON variants (gene);
+CREATE TABLE IF NOT EXISTS carriers (
+    variant INTEGER NOT NULL,
+    sample INTEGER NOT NULL,
+    zygosity TEXT NOT NULL,
+    PRIMARY KEY (variant, sample)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS carriers_sample ON carriers (sample);
+"""
+
+KEY_JOIN = "v.chr = i.chr AND v.start = i.start AND v.stop = i.stop AND v.ref = i.ref AND v.alt = i.alt AND v.gene = i.gene"
+
+
+class CohortStore():
+    """Every sample processed by the family parsers, in a local SQLite database.
+
+    Variants are indexed on their composite key and on their gene and keep
+    running het and hom carrier counts, updated whenever a sample is ingested
+    or replaced, so in-house frequencies are a single indexed lookup. A sample
+    is identified by its family and member and is only ingested again when the
+    content of its file changed. A file already stored for another family or
+    member is the same sample and is not counted twice.
+    """
+
+    def __init__(self, path: Path):
+        self.path = path
+        self.connection = sqlite3.connect(str(path))
+        self.connection.executescript(SCHEMA)
+        self.connection.execute('PRAGMA journal_mode = WAL')
+        self.connection.execute('PRAGMA synchronous = NORMAL')
+
+    def close(self):
+        self.connection.close()
+
+    def __enter__(self) -> 'CohortStore':
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def stored_as(self, family: str, member: str, source: str) -> Union[Tuple[str, str], None]:
+        """The other (family, member) the content of `source` is already stored for, if any."""
+        return self.connection.execute('SELECT family, member FROM samples WHERE source = ? AND NOT (family = ? AND member = ?)',
+                                       (source, family, member)).fetchone()
+
+    def is_ingested(self, family: str, member: str, source: str) -> bool:
+        row = self.connection.execute('SELECT source FROM samples WHERE family = ? AND member = ?', (family, member)).fetchone()
+        return row is not None and row[0] == source
+
+    def count_carriers(self, sample: int, sign: int):
+        for zygosity in ('het', 'hom'):
+            self.connection.execute(f'UPDATE variants SET {zygosity} = {zygosity} + ? '
+                                    'WHERE id IN (SELECT variant FROM carriers WHERE sample = ? AND zygosity = ?)',
+                                    (sign, sample, zygosity))
+
+    def ingest(self, family: str, member: str, source: str, chunks: Iterable[Iterable[Tuple[Any, ...]]]) -> bool:
+        """Stores the variants of a sample, given as chunks of (chr, start, end, ref, alt, gene, zygosity) rows.
+
+        `source` identifies the content the rows were read from (e.g. the hash of
+        the file); an unchanged sample is skipped and a changed one replaces its
+        previous rows and counts. A source already stored for another family or
+        member is not stored again. Returns whether the sample was ingested.
+        """
+        if self.is_ingested(family, member, source):
+            return False
+
+        with self.connection:
+            row = self.connection.execute('SELECT id FROM samples WHERE family = ? AND member = ?', (family, member)).fetchone()
+
+            if row is not None:
+                self.count_carriers(row[0], -1)
+                self.connection.execute('DELETE FROM carriers WHERE sample = ?', row)
+                self.connection.execute('DELETE FROM samples WHERE id = ?', row)
+
+            if self.stored_as(family, member, source) is not None:
+                return False
+
+            sample = self.connection.execute('INSERT INTO samples (family, member, source, ingested) VALUES (?, ?, ?, ?)',
+                                             (family, member, source, time.time())).lastrowid
+
+            self.connection.execute('CREATE TEMP TABLE IF NOT EXISTS incoming (chr TEXT, start INTEGER, stop INTEGER, ref TEXT, alt TEXT, gene TEXT, zygosity TEXT)')
+
+            for rows in chunks:
+                self.connection.execute('DELETE FROM incoming')
+                self.connection.executemany('INSERT INTO incoming VALUES (?, ?, ?, ?, ?, ?, ?)', rows)
+                self.connection.execute('INSERT OR IGNORE INTO variants (chr, start, stop, ref, alt, gene) '
+                                        'SELECT chr, start, stop, ref, alt, gene FROM incoming')
+                # A sample counts once per variant, the first of its rows sets the zygosity.
+                self.connection.execute('INSERT OR IGNORE INTO carriers (variant, sample, zygosity) '
+                                        f'SELECT v.id, ?, i.zygosity FROM incoming i JOIN variants v ON {KEY_JOIN} ORDER BY i.rowid',
+                                        (sample,))
+
+            self.count_carriers(sample, 1)
+
+        return True
+
+    def samples(self) -> int:
+        return self.connection.execute('SELECT count(*) FROM samples').fetchone()[0]
+
+    def generation(self, exclude_family: Union[str, None] = None, exclude_sources: Iterable[str] = ()) -> Tuple[int, float]:
+        """Changes whenever a sample is ingested, replaced or removed, leaving out the samples `frequencies` would leave out."""
+        sources = list(exclude_sources)
+
+        return self.connection.execute('SELECT count(*), coalesce(max(ingested), 0) FROM samples '
+                                       f'WHERE family IS NOT ? AND source NOT IN ({", ".join("?" * len(sources))})',
+                                       (exclude_family, *sources)).fetchone()
+
+    def frequencies(self, variants: Iterable[Variant], exclude_family: Union[str, None] = None,
+                    exclude_sources: Iterable[str] = ()) -> List[Tuple[int, int]]:
+        """(het, hom) carrier counts of every variant, (0, 0) for variants not in the store.
+
+        The carriers of `exclude_family` and the samples stored from
+        `exclude_sources` are left out of the counts, so a family is compared
+        with the rest of the cohort only, also when its files were stored
+        before under another family name.
+        """
+        own = ('SELECT count(*) FROM carriers c JOIN samples s ON s.id = c.sample '
+               'WHERE c.variant = v.id AND c.zygosity = {!r} AND (s.family = :family OR s.source IN (SELECT source FROM excluded))')
+
+        with self.connection:
+            self.connection.execute('CREATE TEMP TABLE IF NOT EXISTS excluded (source TEXT)')
+            self.connection.execute('DELETE FROM excluded')
+            self.connection.executemany('INSERT INTO excluded VALUES (?)', [(x,) for x in exclude_sources])
+            self.connection.execute('CREATE TEMP TABLE IF NOT EXISTS lookup (chr TEXT, start INTEGER, stop INTEGER, ref TEXT, alt TEXT, gene TEXT)')
+            self.connection.execute('DELETE FROM lookup')
+            self.connection.executemany('INSERT INTO lookup VALUES (?, ?, ?, ?, ?, ?)', variants)
+            rows = self.connection.execute(f'SELECT coalesce(v.het - ({own.format("het")}), 0), coalesce(v.hom - ({own.format("hom")}), 0) '
+                                           f'FROM lookup i LEFT JOIN variants v ON {KEY_JOIN} ORDER BY i.rowid',
+                                           {'family': exclude_family}).fetchall()
+
+        return rows
+
+    def carriers(self, chr: str, start: int, stop: int, ref: str, alt: str) -> List[Dict[str, Any]]:
+        """The families and members carrying a variant, with the gene it is annotated on."""
+        rows = self.connection.execute('SELECT s.family, s.member, c.zygosity, v.gene FROM variants v '
+                                       'JOIN carriers c ON c.variant = v.id JOIN samples s ON s.id = c.sample '
+                                       'WHERE v.chr = ? AND v.start = ? AND v.stop = ? AND v.ref = ? AND v.alt = ? '
+                                       'ORDER BY s.family, s.member', (chr, start, stop, ref, alt)).fetchall()
+
+        return [dict(zip(('family', 'member', 'zygosity', 'gene'), row)) for row in rows]
+
+    def gene_carriers(self, gene: str) -> List[Dict[str, Any]]:
+        """The families and members carrying any variant of a gene."""
+        rows = self.connection.execute('SELECT s.family, s.member, c.zygosity, v.chr, v.start, v.stop, v.ref, v.alt FROM variants v '
+                                       'JOIN carriers c ON c.variant = v.id JOIN samples s ON s.id = c.sample '
+                                       'WHERE v.gene = ? ORDER BY v.chr, v.start, s.family, s.member', (gene,)).fetchall()
+
+        return [dict(zip(('family', 'member', 'zygosity', 'chr', 'start', 'end', 'ref', 'alt'), row)) for row in rows]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Queries the cohort store written by filter_all.py --cohort-db.")
+    parser.add_argument('database', help="Path to the cohort store")
+    subparsers = parser.add_subparsers(dest='query', required=True)
+
+    variant = subparsers.add_parser('variant', help="Carriers and in-house frequency of a variant")
+    for name in ('chr', 'start', 'end', 'ref', 'alt'):
+        variant.add_argument(name)
+
+    gene = subparsers.add_parser('gene', help="Carriers of the variants of a gene")
+    gene.add_argument('gene')
+
+    subparsers.add_parser('summary', help="Number of samples in the store")
+    args = parser.parse_args(argv)
+
+    with CohortStore(args.database) as store:
+        if args.query == 'variant':
+            carriers = store.carriers(args.chr, int(args.start), int(args.end), args.ref, args.alt)
+            samples = {(x['family'], x['member']): x['zygosity'] for x in carriers}
+            result = {'samples': store.samples(),
+                      'het': sum(x == 'het' for x in samples.values()),
+                      'hom': sum(x == 'hom' for x in samples.values()),
+                      'carriers': carriers}
+        elif args.query == 'gene':
+            result = store.gene_carriers(args.gene)
+        else:
+            result = {'samples': store.samples()}
+
+    print(json.dumps(result, indent=2))
+
+if __name__ == "__main__":
+    main()
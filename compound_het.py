@@ -0,0 +1,42 @@
+import numpy as np
+import pandas as pd
+
+
+class CompoundHet():
+    """The distinct variants of every gene and which family members carry them.
+
+    Rows are reduced to (gene, variant) pairs with hash based factorization, so
+    carriers, private variants and the genes holding them are found with a
+    few linear passes instead of comparing the members of every gene.
+    """
+
+    def __init__(self, genes: np.ndarray, gene_count: int, keys: np.ndarray):
+        variants, uniques = pd.factorize(keys)
+        self.pairs, pairs = pd.factorize(genes.astype(np.int64) * max(len(uniques), 1) + variants)
+        self.count = len(pairs)
+        self.gene_count = gene_count
+        self.pair_genes = np.zeros(self.count, dtype=np.int64)
+        self.pair_genes[self.pairs] = genes
+
+    def carried(self, rows: np.ndarray) -> np.ndarray:
+        """The pairs with at least one of `rows`."""
+        return np.bincount(self.pairs[rows], minlength=self.count) > 0
+
+    def genes_with(self, pairs: np.ndarray) -> np.ndarray:
+        return np.bincount(self.pair_genes[pairs], minlength=self.gene_count) > 0
+
+    def private(self, rows: np.ndarray, others: np.ndarray) -> np.ndarray:
+        """The pairs carried by `rows` and by none of `others`."""
+        return self.carried(rows) & ~self.carried(others)
+
+    def compound(self, first: np.ndarray, second: np.ndarray) -> np.ndarray:
+        """Genes in which both members carry a variant the other does not carry."""
+        return self.genes_with(self.private(first, second)) & self.genes_with(self.private(second, first))
+
+    def phased(self, child: np.ndarray, father: np.ndarray, mother: np.ndarray) -> np.ndarray:
+        """Genes in which the child carries a variant inherited only from the father and another only from the mother."""
+        carried = self.carried(child)
+        from_father = carried & self.private(father, mother)
+        from_mother = carried & self.private(mother, father)
+
+        return self.genes_with(from_father) & self.genes_with(from_mother)
@@ -0,0 +1,233 @@
+import os
+import pathlib
+import struct
+import zlib
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+from typing import Iterator, Tuple, Union
+
+Path = Union[str, pathlib.Path]
+
+GZIP_MAGIC = b'\x1f\x8b'
+ZSTD_MAGIC = b'\x28\xb5\x2f\xfd'
+BLOCK_SIZE = 1 << 20
+BATCH_SIZE = 4 << 20
+# BGZF blocks are at most 64 KB, a few hundred of them are read ahead and inflated in parallel.
+READ_AHEAD = 256
+
+
+def detect_format(path: Path) -> str:
+    """'bgzf', 'gzip', 'zstd' or 'plain', from the magic bytes of the file."""
+    with open(path, 'rb') as f:
+        header = f.read(18)
+
+    if header[:4] == ZSTD_MAGIC:
+        return 'zstd'
+
+    if header[:2] != GZIP_MAGIC:
+        return 'plain'
+
+    # BGZF: a gzip member with FEXTRA whose first subfield is 'BC' holding the block size.
+    if len(header) >= 18 and header[3] & 4 and header[12:14] == b'BC':
+        return 'bgzf'
+
+    return 'gzip'
+
+
+def threads() -> int:
+    return min(8, os.cpu_count() or 1)
+
+
+def read_bgzf_blocks(f) -> Iterator[bytes]:
+    """The raw deflate data of every BGZF block of `f`, without inflating it."""
+    while True:
+        header = f.read(12)
+
+        if not header:
+            return
+
+        if len(header) < 12 or header[:2] != GZIP_MAGIC:
+            raise ValueError(f'{f.name} is not a valid BGZF file')
+
+        xlen, = struct.unpack('<H', header[10:12])
+        extra = f.read(xlen)
+        size = None
+        position = 0
+
+        while position + 4 <= len(extra):
+            length, = struct.unpack('<H', extra[position + 2:position + 4])
+
+            if extra[position:position + 2] == b'BC':
+                size, = struct.unpack('<H', extra[position + 4:position + 6])
+
+            position += 4 + length
+
+        if size is None:
+            raise ValueError(f'{f.name} has a gzip member without a BGZF block size')
+
+        # BSIZE is the whole block minus one: header, extra field, deflate data and the 8 byte trailer.
+        data = f.read(size + 1 - 12 - xlen)
+        yield data[:-8]
+
+
+def inflate(data: bytes) -> bytes:
+    return zlib.decompress(data, -15)
+
+
+def iter_bgzf_blocks(path: Path, workers: Union[int, None] = None) -> Iterator[Tuple[int, bytes]]:
+    """(file offset, inflated data) of every BGZF block of `path`, inflated on a thread pool, zlib releases the GIL while inflating."""
+    with open(path, 'rb') as f, ThreadPoolExecutor(max_workers=workers or threads()) as pool:
+        pending = deque()
+        blocks = read_bgzf_blocks(f)
+
+        while True:
+            # The generator reads a block only when asked for it, so this is where the block starts.
+            offset = f.tell()
+            data = next(blocks, None)
+
+            if data is None:
+                break
+
+            pending.append((offset, pool.submit(inflate, data)))
+
+            if len(pending) >= READ_AHEAD:
+                offset, future = pending.popleft()
+                yield offset, future.result()
+
+        while pending:
+            offset, future = pending.popleft()
+            yield offset, future.result()
+
+
+def iter_bgzf(path: Path, workers: Union[int, None] = None) -> Iterator[bytes]:
+    """Inflates the independent BGZF blocks of `path` on a thread pool."""
+    blocks = iter_bgzf_blocks(path, workers)
+
+    try:
+        for _, data in blocks:
+            yield data
+    finally:
+        blocks.close()
+
+
+def read_bgzf_line(path: Path, offset: int, start: int) -> bytes:
+    """The line starting `start` bytes into the inflated data of the BGZF block at file `offset`, read up to its newline."""
+    with open(path, 'rb') as f:
+        f.seek(offset)
+        data = b''
+
+        for block in read_bgzf_blocks(f):
+            data += inflate(block)
+            end = data.find(b'\n', start)
+
+            if end >= 0:
+                return data[start:end]
+
+    return data[start:]
+
+
+def iter_gzip(path: Path, block_size: int = BLOCK_SIZE) -> Iterator[bytes]:
+    """Streams a gzip file, a new decompressor is started at every member boundary."""
+    with open(path, 'rb') as f:
+        decompressor = zlib.decompressobj(31)
+
+        for data in iter(lambda: f.read(block_size), b''):
+            while data:
+                out = decompressor.decompress(data)
+
+                if out:
+                    yield out
+
+                if decompressor.eof:
+                    data = decompressor.unused_data
+                    decompressor = zlib.decompressobj(31)
+                else:
+                    data = b''
+
+        out = decompressor.flush()
+
+        if out:
+            yield out
+
+
+def iter_zstd(path: Path, block_size: int = BLOCK_SIZE) -> Iterator[bytes]:
+    try:
+        import zstandard
+    except ImportError:
+        raise ImportError(f'reading the zstd compressed {path} needs the zstandard package') from None
+
+    with open(path, 'rb') as f, zstandard.ZstdDecompressor().stream_reader(f, read_across_frames=True) as reader:
+        yield from iter(lambda: reader.read(block_size), b'')
+
+
+def iter_plain(path: Path, block_size: int = BLOCK_SIZE) -> Iterator[bytes]:
+    with open(path, 'rb') as f:
+        yield from iter(lambda: f.read(block_size), b'')
+
+
+def iter_blocks(path: Path, block_size: int = BLOCK_SIZE, workers: Union[int, None] = None) -> Iterator[bytes]:
+    """Yields the decompressed content of a plain, gzip, bgzip or zstd file block by block.
+
+    The whole file is never held in memory. bgzip files are inflated in
+    parallel, the other formats can only be inflated sequentially. The file is
+    closed when the generator is exhausted or closed.
+    """
+    format = detect_format(path)
+
+    if format == 'bgzf':
+        return iter_bgzf(path, workers)
+
+    if format == 'gzip':
+        return iter_gzip(path, block_size)
+
+    if format == 'zstd':
+        return iter_zstd(path, block_size)
+
+    return iter_plain(path, block_size)
+
+
+def iter_batches(path: Path, batch_size: int = BATCH_SIZE, workers: Union[int, None] = None) -> Iterator[bytes]:
+    """Decompressed content in batches of about `batch_size` bytes that always end at a line boundary."""
+    blocks = iter_blocks(path, workers=workers)
+    parts = []
+    size = 0
+
+    try:
+        for block in blocks:
+            parts.append(block)
+            size += len(block)
+
+            if size < batch_size:
+                continue
+
+            data = b''.join(parts)
+            end = data.rfind(b'\n') + 1
+
+            if end:
+                yield data[:end]
+                parts, size = [data[end:]], len(data) - end
+            else:
+                parts, size = [data], len(data)
+
+        if size:
+            yield b''.join(parts)
+    finally:
+        blocks.close()
+
+
+def iter_lines(path: Path, encoding: str = 'utf-8', batch_size: int = BATCH_SIZE) -> Iterator[str]:
+    batches = iter_batches(path, batch_size)
+
+    try:
+        for batch in batches:
+            lines = batch.decode(encoding).split('\n')
+
+            # Every batch but the last ends with a newline, which is not the start of another line.
+            if not lines[-1]:
+                lines.pop()
+
+            for line in lines:
+                yield line.rstrip('\r')
+    finally:
+        batches.close()
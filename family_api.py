@@ -0,0 +1,114 @@
+import pathlib
+
+import pandas as pd
+
+from typing import Any, Dict, List, Tuple, Union
+
+from filter_all import FamilyParser, FatherMotherChildParser, FatherMotherParser, GeneralParser, MotherChildParser
+from variant_key import KEY
+from variant_schema import GENOTYPE_FIELDS
+
+Path = Union[str, pathlib.Path]
+# A pandas DataFrame, a pyarrow Table or the path of a csv or vcf file.
+Table = Any
+
+PARSERS = {
+    'father_mother': FatherMotherParser,
+    'mother_child': MotherChildParser,
+    'father_mother_child': FatherMotherChildParser,
+    'family': FamilyParser,
+}
+
+
+def to_frame(table: Table):
+    """DataFrames and paths are used as they are, Arrow tables are converted without copying the columns arrow can share."""
+    if isinstance(table, (pd.DataFrame, str, pathlib.PurePath)) or table is None:
+        return table
+
+    if hasattr(table, 'to_pandas'):
+        return table.to_pandas(split_blocks=True, self_destruct=False)
+
+    raise TypeError(f'expected a DataFrame, an Arrow table or a path, got {type(table).__name__}')
+
+
+def to_arrow(df: pd.DataFrame):
+    try:
+        import pyarrow
+    except ImportError:
+        raise ImportError('returning Arrow tables needs the pyarrow package') from None
+
+    return pyarrow.Table.from_pandas(df, preserve_index=False)
+
+
+def member_inputs(members: Dict[str, Union[Table, Tuple[Table, Table]]]) -> List[Tuple[str, Any, Any]]:
+    """(member, gene table, pathogen table or None), a single table is used for both views."""
+    inputs = []
+
+    for name, tables in members.items():
+        gene, pathogen = tables if isinstance(tables, tuple) else (tables, None)
+        inputs.append((name, to_frame(gene), to_frame(pathogen)))
+
+    return inputs
+
+
+def family_parser(mode: str, members: Dict[str, Union[Table, Tuple[Table, Table]]], proband: Union[str, None] = None,
+                  keep_intronic: bool = False, name: str = 'family', **options) -> GeneralParser:
+    """A configured parser of `mode` for the given member tables, keyed by member ('mother', 'father', 'child', ...)."""
+    if mode not in PARSERS:
+        raise ValueError(f'unknown mode {mode!r}, expected one of {list(PARSERS)}')
+
+    inputs = member_inputs(members)
+    in_memory = any(isinstance(x, pd.DataFrame) for _, gene, pathogen in inputs for x in (gene, pathogen))
+
+    if in_memory and (options.get('run_store') is not None or options.get('cohort_db') is not None):
+        raise ValueError('the run store and the cohort store key their results on file contents, they need file inputs')
+
+    if mode == 'family':
+        if proband is None:
+            raise ValueError('the family mode needs a proband')
+
+        parser = FamilyParser(inputs, proband, None, name, keep_intronic)
+    else:
+        files = {}
+
+        for member, gene, pathogen in inputs:
+            files[member], files[f'{member}_path'] = gene, pathogen
+
+        try:
+            parser = PARSERS[mode](omim=None, output=name, keep_intronic=keep_intronic, **files)
+        except TypeError:
+            raise ValueError(f'the {mode} mode needs the members {mode.split("_")}, got {[x for x, _, _ in inputs]}') from None
+
+    return parser.configure(**options)
+
+
+def analyse_family(mode: str, members: Dict[str, Union[Table, Tuple[Table, Table]]], omim: Union[Dict[str, str], Path],
+                   proband: Union[str, None] = None, keep_intronic: bool = False, output: str = 'pandas',
+                   name: str = 'family', **options) -> List[Tuple[Any, str]]:
+    """Runs a family analysis in process and returns the labelled report sections.
+
+    `members` maps every member to its annotated variants, a DataFrame, an Arrow
+    table or a file path, or to a (gene, pathogen) pair of them. A single table
+    is filtered into both views. `omim` is a gene -> 'AR'/'AD' mapping or the
+    path of an OMIM file. `options` are the GeneralParser options. The sections
+    are returned in report order as DataFrames with the schema dtypes, or as
+    Arrow tables with output='arrow'; pass them to write_report for the xlsx
+    report.
+    """
+    if output not in ('pandas', 'arrow'):
+        raise ValueError(f"unknown output {output!r}, expected 'pandas' or 'arrow'")
+
+    parser = family_parser(mode, members, proband, keep_intronic, name, **options)
+    omim_file = parser.read_OMIMfile(omim) if isinstance(omim, (str, pathlib.PurePath)) else dict(omim)
+    sections = []
+
+    for df, label in parser.report_sections(parser.analyse(omim_file)):
+        df = df.drop(columns=[x for x in [*GENOTYPE_FIELDS, KEY] if x in df.columns]).reset_index(drop=True)
+        sections.append((to_arrow(df) if output == 'arrow' else df, label))
+
+    return sections
+
+
+def write_report(sections: List[Tuple[Any, str]], output: Path):
+    """Writes sections returned by analyse_family to an xlsx report."""
+    GeneralParser().save_xlsx([(to_frame(df), label) for df, label in sections], output)
@@ -5,10 +5,43 @@ import os
 import argparse
 import io
 import pathlib
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+from itertools import repeat
 
 from typing import Callable, Tuple, List, Union, Dict
 
+from cohort_store import VARIANT_COLUMNS, CohortStore
+from population_index import index_version, open_index
+from region_filter import open_regions
+from run_store import RunStore, file_hash, hash_key
+from group_index import GroupIndex, report_order
+from section_rules import RulePlanner, SectionRule, uses_omim
+from variant_schema import apply_schema, to_text, with_genotypes
+from variant_key import isin, joint_keys, with_variant_key
+from vcf_reader import VcfReader, is_vcf
+
 Path = Union[str, pathlib.Path]
+Section = Tuple[pd.DataFrame, str]
+# The columns of a member's gene file kept in the cohort store.
+COHORT_COLUMNS = VARIANT_COLUMNS + ['Zygosity']
+
+def chromosome_key(chr) -> Tuple[int, int, str]:
+    name = str(chr)
+    name = name[3:] if name.lower().startswith('chr') else name
+    return (0, int(name), '') if name.isdigit() else (1, 0, name)
+
+def variant_rows(df: pd.DataFrame, columns: List[str]) -> List[tuple]:
+    """Rows of `columns` as plain Python values, for the cohort store."""
+    df = df.dropna(subset=['Start', 'End'])
+    return list(zip(*[(df[x].astype(int) if x in ('Start', 'End') else df[x].astype(str)).tolist() for x in columns]))
+
+def same_input(a, b) -> bool:
+    """Whether two inputs are the same file or the same in-memory frame."""
+    if isinstance(a, pd.DataFrame) or isinstance(b, pd.DataFrame):
+        return a is b
+
+    return a == b
 
 def generate_file_name(*files: List[str]) -> str: 
     files = [file.split(os.sep)[-1].replace('filtered_', '').replace('.csv','')[:-2] for file in files]
@@ -17,7 +50,68 @@ def generate_file_name(*files: List[str]) -> str:
 class GeneralParser():
     match_columns = ["Het Iranome", "Hom Iranome", "Het Our DB", "Chr", "Start", "End", "Ref", "Alt", "Zygosity", "Gene.refGene", "ExonicFunc.refGene"]
     gene_exceptions = ['frameshift insertion', 'frameshift deletion', 'stopgain', 'stoploss', 'splicing']
-    
+    analysis_columns = match_columns + ['Func.refGene', 'ExonicFunc.ensGene', 'ExonicFunc.knownGene', 'Function_description', 'CLNSIG', 'ValueInfo2']
+
+    # Rows read per chunk. Filters run on every chunk so only surviving rows are kept in memory.
+    chunksize: int = 100000
+    # Columns of the report, None keeps every column of the input file.
+    report_columns: Union[List[str], None] = None
+    # Read the columns that are only needed for the report in a second pass, for the surviving rows only.
+    lazy_columns: bool = True
+    # Spill the filtered inputs to disk per chromosome and evaluate one partition at a time.
+    out_of_core: bool = False
+    # Approximate size in MB of the filtered rows loaded for one partition, None loads one chromosome at a time.
+    memory_budget: Union[int, None] = None
+    # Directory for the spill files, None uses the system temporary directory.
+    spill_dir: Union[Path, None] = None
+    # Worker processes evaluating the report sections of different chromosomes.
+    jobs: int = 1
+    # Directory keeping filtered inputs and section outputs between runs, None disables incremental runs.
+    run_store: Union[Path, None] = None
+    # Approximate size in MB the run store may grow to before old results are evicted.
+    store_size: Union[int, None] = None
+    # Sample name or position read from multi sample VCF inputs.
+    vcf_sample: Union[str, int] = 0
+    # SQLite cohort store every member's gene file is ingested into, None disables it.
+    cohort_db: Union[Path, None] = None
+    # Family the members are stored under in the cohort store, None uses the report name.
+    family_id: Union[str, None] = None
+    # Use the het carriers of the other families in the cohort store as 'Het Our DB' in filter_normal.
+    cohort_frequencies: bool = False
+    # Population frequency index (see population_index.py) filling 'Het Iranome' and 'Hom Iranome' while reading.
+    population_index: Union[Path, None] = None
+    # Drop the variants the index marks as common before the filters, and before the report columns are read.
+    population_prefilter: bool = False
+    # Gene list and BED file of target regions, rows on neither are pruned as every chunk is read.
+    gene_panel: Union[Path, None] = None
+    target_regions: Union[Path, None] = None
+
+    # Numeric filters of filter_path on the genotype fields parsed from ValueInfo2.
+    path_genotypes: Tuple[str, ...] = ('0/1', '1/1')
+    min_alt_reads: int = 8
+    min_depth: int = 0
+
+    # The report sections in report order, see SectionRule.
+    rules: List[SectionRule] = []
+    # Sections only reported when their option is set, rule name -> option name.
+    optional_rules: Dict[str, str] = {}
+    # Report the child compound section of the trio report.
+    child_compound: bool = False
+
+    # Content hashes of the member gene files, computed once by cohort_sources.
+    member_hashes: Union[List[str], None] = None
+    # Members whose gene file went to the cohort store during the analysis, None outside of it.
+    cohort_read: Union[set, None] = None
+
+    def configure(self, **options) -> 'GeneralParser':
+        for name, value in options.items():
+            if not hasattr(self, name):
+                raise AttributeError(f'{type(self).__name__} has no option {name!r}')
+
+            setattr(self, name, value)
+
+        return self
+
     def warn(self, message: str):
         print("Warning:", message)
 
@@ -55,23 +149,24 @@ class GeneralParser():
             return filtered_genes
 
     def drop_duplicates_in_dataframes(self, dataframes: List[Tuple[pd.DataFrame, str]], columns: List[str]) -> List[Tuple[pd.DataFrame, str]]:
-        accumulator = pd.DataFrame(columns=dataframes[0][0].columns)
-        
+        keys = joint_keys([df for df, _ in dataframes], columns)
+        seen = np.empty(0, dtype=np.uint64)
         dfs = []
 
-        for df, label in dataframes: 
-            if len(accumulator) > 0:
-                t = df[~df.set_index(columns).index.isin(accumulator.set_index(columns).index)]
-                dfs.append((t, label))
-            else:
-                dfs.append((df, label))
- 
-            accumulator = pd.concat((accumulator, df))
+        for (df, label), key in zip(dataframes, keys):
+            dfs.append((df[~isin(key, seen)], label))
+            seen = np.concatenate([seen, key])
 
         return dfs
 
-    def save_xlsx(self, dataframes: List[Tuple[pd.DataFrame, str]], output: Path):
+    def report_sections(self, dataframes: List[Tuple[pd.DataFrame, str]]) -> List[Tuple[pd.DataFrame, str]]:
+        """The sections as they are reported: a variant is only listed in its first section, rows are in report order."""
         dataframes = self.drop_duplicates_in_dataframes(dataframes, ['Parent', 'Chr', 'Start', 'End', 'Ref', 'Alt', 'Gene.refGene'])
+        orders = report_order([df for df, _ in dataframes], ['Gene.refGene', 'Ref', 'Alt'])
+
+        return [(df.iloc[order], label) for (df, label), order in zip(dataframes, orders)]
+
+    def save_xlsx(self, dataframes: List[Tuple[pd.DataFrame, str]], output: Path):
         current_row: int = 0
         writer = pd.ExcelWriter(output, engine='xlsxwriter')
 
@@ -89,7 +184,9 @@ class GeneralParser():
             'font_size': 16
         })
 
-        for index, (df, label) in enumerate(dataframes):
+        for index, (df, label) in enumerate(self.report_sections(dataframes)):
+            df = to_text(df)
+
             if index == 0:
                 columns = pd.DataFrame(columns=df.columns)
                 columns.to_excel(writer, sheet_name='Sheet1', header=True, index=False, startrow=current_row)
@@ -97,10 +194,11 @@ class GeneralParser():
 
             worksheet.merge_range(current_row, 4, current_row, 7, label, merge_format)
             current_row += 1
-            df.sort_values(['Gene.refGene', 'Ref', 'Alt']).to_excel(writer, sheet_name='Sheet1', header=False, index=False, startrow=current_row)
+            df.to_excel(writer, sheet_name='Sheet1', header=False, index=False, startrow=current_row)
             current_row += df.shape[0]
 
-        writer.save()
+        # Closing the writer saves the workbook, ExcelWriter.save was removed in pandas 2.
+        writer.close()
 
     def read_faulty_csv(self, path: Path) -> pd.DataFrame: 
         df: pd.DataFrame | None = None
@@ -134,120 +232,165 @@ class GeneralParser():
         
         return df
 
-    def read_csv(self, path: Path, parent: str, data_filter: Callable[[pd.DataFrame, str, bool], pd.DataFrame], keep_intronic: bool = False) -> pd.DataFrame:
+    def prepare(self, df: pd.DataFrame) -> pd.DataFrame:
+        """Converts a chunk read as text to the schema dtypes, with the population counts of the index if one is set.
+
+        Rows outside the gene panel or target regions are pruned first, so the
+        rest of the chunk work is in proportion to the panel.
+        """
+        if self.gene_panel is not None or self.target_regions is not None:
+            df = df[open_regions(self.gene_panel and str(self.gene_panel), self.target_regions and str(self.target_regions)).mask(df)]
+
+        df = apply_schema(df)
+
+        if self.population_index is None:
+            return df
+
+        index = open_index(str(self.population_index))
+
+        if self.population_prefilter:
+            df = df[~index.common(df)]
+
+        return index.attach(df)
+
+    def read_csv(self, path: Path, parent: str, data_filter: Callable[[pd.DataFrame, str, bool], pd.DataFrame], keep_intronic: bool = False,
+                 cohort: bool = False) -> pd.DataFrame:
+        return self.read_views(path, parent, [(data_filter, keep_intronic)], cohort)[0]
+
+    def read_views(self, path: Path, parent: str, filters: List[Tuple[Callable[[pd.DataFrame, str, bool], pd.DataFrame], bool]],
+                   cohort: bool = False) -> List[pd.DataFrame]:
+        """Reads `path` once and applies every (data_filter, keep_intronic) of `filters` to each chunk, one frame per filter.
+
+        When `path` is the gene file of `parent` (`cohort`), the variants of every
+        chunk are also kept, before any row is pruned, and added to the cohort store
+        once the file is read.
+        """
+        stored = self.cohort_capture(parent) if cohort else None
+
+        def apply(chunk: pd.DataFrame) -> List[pd.DataFrame]:
+            if stored is not None:
+                stored.append(apply_schema(chunk[COHORT_COLUMNS]))
+
+            chunk = self.prepare(chunk)
+            return [data_filter(chunk, parent, keep_intronic) for data_filter, keep_intronic in filters]
+
+        if isinstance(path, pd.DataFrame):
+            return [with_variant_key(df) for df in self.read_frame(path, apply)]
+
         try:
-            df = pd.read_csv(path, index_col=False)
-        except:
+            if is_vcf(path):
+                views = self.read_vcf(path, apply)
+            else:
+                views = self.read_csv_chunked(path, apply)
+        except (pd.errors.ParserError, UnicodeDecodeError):
+            # The slower method reads comma separated text, it would take the ## lines of a VCF for its header.
+            if is_vcf(path):
+                raise
+
             self.warn(f'{path} contains bad lines, trying slower method')
             df = self.read_faulty_csv(path)
+
+            if stored is not None:
+                stored.clear()
+
+            if self.report_columns is not None:
+                df = df[[x for x in df.columns if x in self.report_columns or x in self.analysis_columns]]
+
+            views = apply(df)
         
         self.success(f'{path} was read successfully')
 
-        return data_filter(df, parent, keep_intronic)
+        if stored is not None:
+            with CohortStore(self.cohort_db) as store:
+                self.ingest_member(store, parent, path, (variant_rows(df, COHORT_COLUMNS) for df in stored))
 
-    def concat_dataframes(self, dataframes: List[pd.DataFrame]) -> pd.DataFrame:
-        dataframes = [df.astype(str).reset_index(drop=True) for df in dataframes]
-        df = pd.concat(dataframes, ignore_index=True).reset_index(drop=True).sort_values(['Gene.refGene'])
+        return [with_variant_key(df) for df in views]
 
-        df['_rank'] = df.groupby(['Gene.refGene', 'Parent']).cumcount()
-        df.sort_values(['Gene.refGene', '_rank'], inplace=True)
-        df.drop(labels=['_rank'], axis=1, inplace=True)
+    def read_frame(self, df: pd.DataFrame, apply: Callable[[pd.DataFrame], List[pd.DataFrame]]) -> List[pd.DataFrame]:
+        """Filters an in-memory frame in slices of `chunksize` rows, the frame itself is never copied or converted as a whole."""
+        if self.report_columns is not None:
+            df = df[[x for x in df.columns if x in self.report_columns or x in self.analysis_columns]]
 
-        return df
+        views = [apply(df.iloc[start:start + self.chunksize]) for start in range(0, len(df), self.chunksize)] or [apply(df.iloc[:0])]
 
-    def mother_and_father_share_gene(self, row: pd.Series) -> bool:
-        row = row.sort_values('Parent')
-        parents = tuple(row['Parent'].values)
-        return ('mother' in parents) and ('father' in parents)
-    
-    def compound_gene(self, row: pd.Series, match_columns: List[str]) -> bool:
-        row = row.sort_values('Parent')
-        parents = tuple(row['Parent'].values)
+        return [pd.concat(frames) for frames in zip(*views)]
 
-        if not (('mother' in parents) and ('father' in parents)):
-            return False
+    def read_vcf(self, path: Path, apply: Callable[[pd.DataFrame], List[pd.DataFrame]]) -> List[pd.DataFrame]:
+        reader = VcfReader(path, self.vcf_sample)
 
-        father = row[row['Parent'] == 'father']
-        mother = row[row['Parent'] == 'mother']
-        
-        return not np.array_equal(father[match_columns].values, mother[match_columns].values)
-
-    def mother_and_child_share_gene(self, row: pd.Series, check_zygosity: bool = True) -> bool:
-        row = row.sort_values('Parent')
-
-        if check_zygosity:
-            return (tuple(row['Parent'].values) == ('child', 'mother')) and (tuple(row['Zygosity'].values) == ('hom', 'het'))
-        else: 
-            return (tuple(row['Parent'].values) == ('child', 'mother'))
-
-    def mother_father_and_child_do_not_share_gene(self, row: pd.Series)  -> bool:
-        row = row.sort_values('Parent')
-        return ('father' not in row['Parent'].values) and ('mother' not in row['Parent'].values)
-
-    def not_shared_path(self, row: pd.Series): 
-        row = row[row['Parent'] != 'child']
-        return len(row['Parent'].values) == 1
-
-    def mother_and_child_or_father_and_child_share_gene(self, row : pd.Series) -> bool:
-        row = row.sort_values('Parent')
-        zygosity = tuple(row['Zygosity'].values)
-        parents = tuple(row['Parent'].values)
-        if ('child' in parents and (('father' in parents) or ('mother' in parents))):
-            if zygosity[0] == 'hom' and zygosity[1] == 'het':
-                if len(zygosity) > 2:
-                    if zygosity[2] == 'het':
-                        return True
-                    else:
-                        False
-                return True
-        return False
+        if self.report_columns is None:
+            columns = None
+        else:
+            columns = [x for x in reader.columns if x in self.report_columns or x in self.analysis_columns]
 
-    def mother_and_child_share_path(self, row: pd.Series, omim: Dict[str, str], omim_check: str = 'AR') -> bool: 
-        row = row.sort_values(['Parent'])
+        return [pd.concat(frames) for frames in zip(*[apply(chunk) for chunk in reader.chunks(self.chunksize, columns)])]
 
-        if tuple(row['Parent'].values) != ('child', 'mother'):
-            return False
+    def read_csv_chunked(self, path: Path, apply: Callable[[pd.DataFrame], List[pd.DataFrame]]) -> List[pd.DataFrame]:
+        header = list(pd.read_csv(path, index_col=False, nrows=0).columns)
 
-        if tuple(row['Zygosity'].values) != ('het', 'het'):
-            return False
-        
-        gene = row['Gene.refGene'].values[0]
+        if self.report_columns is None:
+            wanted = header
+        else:
+            wanted = [x for x in header if x in self.report_columns or x in self.analysis_columns]
 
-        if omim.get(gene, 'AR') == omim_check:
-            return True
+        if self.lazy_columns:
+            narrow = [x for x in wanted if x in self.analysis_columns]
+            wide = [x for x in wanted if x not in self.analysis_columns]
         else:
-            return False
+            narrow = wanted
+            wide = []
 
-    def for_check_in_mother_child(self, row: pd.Series, omim: Dict[str, str], omim_check: str = 'AR'): 
-        if row['Zygosity'] != 'hom':
-            return False
-        
-        if omim.get(row['Gene.refGene'], 'AR') == omim_check:
-            return True
+        # The row index of every chunk continues where the previous one stopped, so the
+        # surviving rows keep their position in the file for the second pass.
+        chunks = pd.read_csv(path, index_col=False, usecols=narrow, dtype=str, chunksize=self.chunksize)
+        views = [apply(chunk) for chunk in chunks] or [apply(pd.DataFrame(columns=narrow, dtype=str))]
+        views = [pd.concat(frames) for frames in zip(*views)]
+
+        if not wide:
+            return views
+
+        # The rows surviving any of the filters are read once, every view joins its own rows.
+        survivors = views[0].index.append([df.index for df in views[1:]])
+        chunks = pd.read_csv(path, index_col=False, usecols=wide, dtype=str, chunksize=self.chunksize)
+        wide_df = pd.concat([chunk[chunk.index.isin(survivors)] for chunk in chunks] or [pd.DataFrame(columns=wide, dtype=str)])
+
+        return [self.join_wide(df, wide_df, header) for df in views]
+
+    def join_wide(self, df: pd.DataFrame, wide_df: pd.DataFrame, header: List[str]) -> pd.DataFrame:
+        """Joins the columns of the second pass, in the order of the file header."""
+        position = {x: i for i, x in enumerate(header)}
+        pending = [x for x in header if x in wide_df.columns]
+        columns = []
 
-        return False
+        for column in df.columns:
+            if column in position:
+                while pending and position[pending[0]] < position[column]:
+                    columns.append(pending.pop(0))
 
-    def for_check_in_father_mother_child(self, row: pd.Series, omim: Dict[str, str]): 
-        if row['Zygosity'] == 'het' and omim.get(row['Gene.refGene'], 'AR') == 'AD':
-            return True
-        if row['Zygosity'] == 'hom' and omim.get(row['Gene.refGene'], 'AR') == 'AR':
-            return True
+            columns.append(column)
 
-        return False
+        return df.join(wide_df)[columns + pending]
+
+    def concat_dataframes(self, dataframes: List[pd.DataFrame]) -> pd.DataFrame:
+        """Combines the frames ordered by gene, interleaving the rows of the parents within every gene."""
+        df = pd.concat(dataframes, ignore_index=True)
+        index = GroupIndex(df)
+        genes, _ = index.column('Gene.refGene')
+
+        return df.iloc[np.lexsort((index.groups(['Gene.refGene', 'Parent']).rank(), genes))]
 
     def filter_normal(self, df: pd.DataFrame, parent: str, keep_intronic: bool = False) -> pd.DataFrame:
-        df = df[(df['Hom Iranome'] == '0') | (df['Hom Iranome'] == '.')]
+        df = df[df['Hom Iranome'].fillna(0) == 0]
         
         if not keep_intronic:
             df = df[df['Func.refGene'] != 'intronic']
 
-        df['Het Iranome'] = pd.to_numeric(df['Het Iranome'], errors='coerce')
         df = df[(df['Het Iranome'].isna()) | (df['Het Iranome'] < 80)]
-        df['Het Iranome'] = df['Het Iranome'].fillna('.')
 
-        df['Het Our DB'] = pd.to_numeric(df['Het Our DB'], errors='coerce')
+        if self.cohort_frequencies:
+            df = self.with_cohort_frequencies(df)
+
         df = df[(df['Het Our DB'].isna()) | (df['Het Our DB'] < 40)]
-        df['Het Our DB'] = df['Het Our DB'].fillna('.')
 
         zygosity_index = df.columns.get_loc('Zygosity')
         df.insert(zygosity_index, 'Parent', parent)
@@ -256,12 +399,13 @@ class GeneralParser():
 
     def filter_path(self, df: pd.DataFrame, parent: str, keep_intronic: bool = True) -> pd.DataFrame:
 
-        df = df[(df['Hom Iranome'] == '0') | (df['Hom Iranome'] == '.')]
+        df = df[df['Hom Iranome'].fillna(0) == 0]
         df = df[~(df['CLNSIG'].str.contains('Benign', case=False))]
 
-        df = df[((df['ValueInfo2'].str.split(':').str[0] == '0/1')
-                | (df['ValueInfo2'].str.split(':').str[0] == '1/1'))
-                & (df['ValueInfo2'].str.split(':').str[1].str.split(',').str[1].astype(int) > 7)]
+        df = with_genotypes(df)
+        df = df[(df['ValueInfo2.GT'].isin(self.path_genotypes)
+                & (df['ValueInfo2.AD_ALT'] >= self.min_alt_reads)
+                & (df['ValueInfo2.DP'].fillna(0) >= self.min_depth)).fillna(False).astype(bool)]
 
         zygosity_index = df.columns.get_loc('Zygosity')
         df.insert(zygosity_index, 'Parent', parent)
@@ -269,18 +413,434 @@ class GeneralParser():
         return df
 
 
+    def family_name(self) -> str:
+        return self.family_id or pathlib.Path(self.output).stem
+
+    def cohort_sources(self) -> List[str]:
+        """Content hashes of the member gene files, the same samples whatever family they were stored under."""
+        if self.member_hashes is None:
+            self.member_hashes = [file_hash(gene) for _, gene, _ in self.inputs()]
+
+        return self.member_hashes
+
+    def cohort_source(self, parent: str) -> str:
+        return dict(zip([x for x, _, _ in self.inputs()], self.cohort_sources()))[parent]
+
+    def cohort_capture(self, parent: str) -> Union[List[pd.DataFrame], None]:
+        """The list the chunks of the gene file of `parent` are kept in while it is read, None when the store does not need them."""
+        if self.cohort_read is None or parent in self.cohort_read:
+            return None
+
+        with CohortStore(self.cohort_db) as store:
+            source = self.cohort_source(parent)
+
+            if store.is_ingested(self.family_name(), parent, source) or store.stored_as(self.family_name(), parent, source) is not None:
+                return None
+
+        return []
+
+    def cohort_rows(self, path: Path):
+        """The (chr, start, end, ref, alt, gene, zygosity) rows of an input file, a chunk at a time."""
+        if is_vcf(path):
+            chunks = VcfReader(path, self.vcf_sample).chunks(self.chunksize, COHORT_COLUMNS)
+        else:
+            chunks = pd.read_csv(path, index_col=False, usecols=COHORT_COLUMNS, dtype=str, chunksize=self.chunksize)
+
+        for chunk in chunks:
+            yield variant_rows(apply_schema(chunk), COHORT_COLUMNS)
+
+    def ingest_member(self, store: CohortStore, parent: str, gene: Path, chunks):
+        ingested = store.ingest(self.family_name(), parent, self.cohort_source(parent), chunks)
+        stored_as = store.stored_as(self.family_name(), parent, self.cohort_source(parent))
+        self.cohort_read.add(parent)
+
+        if ingested:
+            self.success(f'{gene} was added to the cohort store')
+        elif stored_as is not None:
+            self.warn(f'{gene} is already in the cohort store as {stored_as[1]} of {stored_as[0]}, it is not added again')
+
+    def ingest_cohort(self):
+        """Adds the gene files the analysis did not read to the cohort store, unchanged files are skipped.
+
+        The gene files read for the analysis are stored as they are read, see
+        read_views, the others (e.g. the results the run store kept) are read
+        again here, only when they changed.
+        """
+        with CohortStore(self.cohort_db) as store:
+            for parent, gene, _ in self.inputs():
+                if parent in self.cohort_read:
+                    continue
+
+                try:
+                    self.ingest_member(store, parent, gene, self.cohort_rows(gene))
+                except (pd.errors.ParserError, UnicodeDecodeError):
+                    if is_vcf(gene):
+                        raise
+
+                    self.warn(f'{gene} contains bad lines, trying slower method')
+                    self.ingest_member(store, parent, gene, [variant_rows(apply_schema(self.read_faulty_csv(gene)), COHORT_COLUMNS)])
+
+    def with_cohort_frequencies(self, df: pd.DataFrame) -> pd.DataFrame:
+        """Replaces 'Het Our DB' with the number of het carriers of every variant in the other families of the cohort store."""
+        keys = df.dropna(subset=['Start', 'End'])
+
+        with CohortStore(self.cohort_db) as store:
+            counts = store.frequencies(variant_rows(keys, VARIANT_COLUMNS), self.family_name(), self.cohort_sources())
+
+        het = pd.Series([x[0] for x in counts], index=keys.index, dtype='Float64')
+        return df.assign(**{'Het Our DB': het.reindex(df.index)})
+
     def drop_from(self, set_, subset, columns = ['Parent', 'Chr', 'Start', 'End', 'Ref', 'Alt', 'Gene.refGene']):
-        df = set_.drop(labels=subset.index, errors='ignore')
-        df = df[~df.set_index(columns).reset_index().index.isin(subset.set_index(columns).reset_index().index)]
+        keys, subset_keys = joint_keys([set_, subset], columns)
+        return set_[~isin(keys, subset_keys)]
 
-        return df
 
+    def inputs(self) -> List[Tuple[str, Path, Union[Path, None]]]:
+        """The family members as (parent, gene file, pathogen file), in report order.
 
-    def run(self):
+        A member without a pathogen file (None, or the gene file again) is read
+        once and both of its views are filtered from the same chunks.
+        """
         raise NotImplementedError()
 
+    def member_files(self, gene: Path, pathogen: Union[Path, None]) -> Dict[str, Path]:
+        return {'normal': gene, 'path': gene if pathogen is None else pathogen}
+
+    def view_filters(self) -> Dict[str, Tuple[Callable[[pd.DataFrame, str, bool], pd.DataFrame], bool]]:
+        """(data_filter, keep_intronic) of the normal and path frames."""
+        return {'normal': (self.filter_normal, self.keep_intronic), 'path': (self.filter_path, False)}
+
+    def read_member(self, parent: str, gene: Path, pathogen: Union[Path, None]) -> Dict[str, pd.DataFrame]:
+        """The filtered normal and path frames of a member, from a single read of its file in single-input mode."""
+        files = self.member_files(gene, pathogen)
+        filters = self.view_filters()
+
+        if same_input(files['normal'], files['path']):
+            return dict(zip(filters, self.read_views(gene, parent, list(filters.values()), cohort=True)))
+
+        return {kind: self.read_csv(files[kind], parent, *filters[kind], cohort=kind == 'normal') for kind in filters}
+
+    def planner(self, frames: Dict[str, pd.DataFrame], omim_file: Union[Dict[str, str], None] = None) -> RulePlanner:
+        keys = {'variant': self.match_columns,
+                'site': [x for x in self.match_columns if x != 'Zygosity'],
+                'gene': ['Gene.refGene'],
+                'allele': ['Chr', 'Start', 'End', 'Ref', 'Alt']}
+
+        members = [parent for parent, _, _ in self.inputs()]
+
+        return RulePlanner(self.report_rules(), frames, keys, members, self.gene_exceptions, self.concat_dataframes, omim_file)
+
+    def report_rules(self) -> List[SectionRule]:
+        """The rules of the reported sections, without the optional ones whose option is off."""
+        return [rule for rule in self.rules if rule.name not in self.optional_rules or getattr(self, self.optional_rules[rule.name])]
+
+    def variant_sections(self, normal_df: pd.DataFrame, path_df: pd.DataFrame) -> Dict[str, Section]:
+        """The report sections that only depend on the filtered variants."""
+        rules = {rule.name: rule for rule in self.report_rules()}
+        names = [name for name, rule in rules.items() if not uses_omim(rule, rules)]
+
+        return self.planner({'normal': normal_df, 'path': path_df}).evaluate(names)
+
+    def omim_sections(self, path_df: pd.DataFrame, omim_file: Dict[str, str]) -> Dict[str, Section]:
+        """The report sections that depend on the OMIM inheritance modes, they only use the pathogenic variants."""
+        rules = {rule.name: rule for rule in self.report_rules()}
+        names = [name for name, rule in rules.items() if uses_omim(rule, rules)]
+
+        return self.planner({'path': path_df}, omim_file).evaluate(names)
+
+    def section_table(self, normal_df: pd.DataFrame, path_df: pd.DataFrame, omim_file: Dict[str, str]) -> Dict[str, Section]:
+        return self.planner({'normal': normal_df, 'path': path_df}, omim_file).evaluate()
+
+    def arrange(self, table: Dict[str, Section]) -> List[Section]:
+        return [table[rule.name] for rule in self.report_rules()]
+
+    def sections(self, normal_df: pd.DataFrame, path_df: pd.DataFrame, omim_file: Dict[str, str]) -> List[Section]:
+        return self.arrange(self.section_table(normal_df, path_df, omim_file))
+
+    def read_inputs(self) -> Tuple[List[pd.DataFrame], List[pd.DataFrame]]:
+        members = [self.read_member(*member) for member in self.inputs()]
+
+        return [x['normal'] for x in members], [x['path'] for x in members]
+
+    def run(self):
+        self.save_xlsx(self.analyse(self.read_OMIMfile(self.omim)), self.output)
+
+    def analyse(self, omim_file: Dict[str, str]) -> List[Section]:
+        """The report sections in report order, with the OMIM inheritance mode of every gene in `omim_file`."""
+        if self.cohort_db is not None:
+            self.cohort_read = set()
+        elif self.cohort_frequencies:
+            raise ValueError('cohort frequencies need a cohort store, set cohort_db')
+
+        if self.run_store is not None:
+            if self.out_of_core:
+                self.warn('the run store keeps its results in memory, ignoring the out-of-core mode')
+
+            datasets = self.run_incremental(omim_file)
+        elif self.out_of_core:
+            datasets = self.run_out_of_core(omim_file)
+        else:
+            normal, path = self.read_inputs()
+            normal_df, path_df = self.concat_dataframes(normal), self.concat_dataframes(path)
+            datasets = self.arrange(self.evaluate(self.section_table, (normal_df, path_df), omim_file))
+
+        if self.cohort_db is not None:
+            self.ingest_cohort()
+            self.cohort_read = None
+
+        return datasets
+
+    def filter_settings(self, kind: str) -> Dict:
+        """The options a filtered input of `kind` depends on, part of its run store key."""
+        settings = {'report_columns': self.report_columns, 'vcf_sample': self.vcf_sample}
+
+        if self.population_index is not None:
+            settings.update(population=index_version(self.population_index), population_prefilter=self.population_prefilter)
+
+        if self.gene_panel is not None or self.target_regions is not None:
+            settings.update(regions=[None if x is None else file_hash(x) for x in (self.gene_panel, self.target_regions)])
+
+        if kind == 'normal':
+            settings.update(keep_intronic=self.keep_intronic)
+
+            if self.cohort_frequencies:
+                with CohortStore(self.cohort_db) as store:
+                    settings.update(cohort=store.generation(self.family_name(), self.cohort_sources()))
+        else:
+            settings.update(path_genotypes=list(self.path_genotypes), min_alt_reads=self.min_alt_reads, min_depth=self.min_depth)
+
+        return settings
+
+    def run_incremental(self, omim_file: Dict[str, str]) -> List[Section]:
+        """Runs the analysis on top of the run store, recomputing only the stale results.
+
+        The filtered inputs are keyed on the content of their file and the filter
+        settings, the combined frames on the keys of their inputs and every group
+        of sections on the keys of what it depends on. A new OMIM release only
+        recomputes the OMIM sections and a corrected gene file of one member only
+        rereads that file and recomputes the variant sections.
+        """
+        store = RunStore(self.run_store, self.store_size)
+        family = pathlib.Path(self.output).stem
+        members = {'normal': [], 'path': []}
+
+        for parent, gene, pathogen in self.inputs():
+            files = self.member_files(gene, pathogen)
+            hashes = {path: file_hash(path) for path in set(files.values())}
+            member = {kind: hash_key(kind, parent, hashes[path], self.filter_settings(kind)) for kind, path in files.items()}
+
+            for kind in files:
+                members[kind].append((parent, (gene, pathogen), files, member))
+
+        keys = {kind: hash_key(*[x[-1][kind] for x in items]) for kind, items in members.items()}
+        combined: Dict[str, pd.DataFrame] = {}
+
+        def frame(kind: str) -> pd.DataFrame:
+            if kind in combined:
+                return combined[kind]
+
+            df = store.get(family, f'combined.{kind}', keys[kind])
+
+            if df is None:
+                frames = []
+
+                for parent, inputs, files, member in members[kind]:
+                    filtered = store.get(family, f'filtered.{kind}.{parent}', member[kind])
+
+                    if filtered is None and same_input(files['normal'], files['path']):
+                        # Both views come from the same read, the other one is stored for later.
+                        views = self.read_member(parent, *inputs)
+
+                        for name, view in views.items():
+                            store.put(family, f'filtered.{name}.{parent}', member[name], view)
+
+                        filtered = views[kind]
+                    elif filtered is None:
+                        filtered = self.read_csv(files[kind], parent, *self.view_filters()[kind], cohort=kind == 'normal')
+                        store.put(family, f'filtered.{kind}.{parent}', member[kind], filtered)
+                    else:
+                        self.success(f'{files[kind]} is unchanged, using the run store')
+
+                    frames.append(filtered)
+
+                df = self.concat_dataframes(frames)
+                store.put(family, f'combined.{kind}', keys[kind], df)
+
+            combined[kind] = df
+            return df
+
+        def group(name: str, key: str, compute: Callable[[], Dict[str, Section]]) -> Dict[str, Section]:
+            names = store.get(family, f'sections.{name}', key)
+
+            if names is not None:
+                table = {x: store.get(family, f'section.{x}', key) for x in names}
+
+                if all(x is not None for x in table.values()):
+                    self.success(f'{name} sections are unchanged, using the run store')
+                    return table
+
+            table = compute()
+
+            for x, section in table.items():
+                store.put(family, f'section.{x}', key, section)
+
+            store.put(family, f'sections.{name}', key, list(table))
+            return table
+
+        try:
+            sections = [rule.name for rule in self.report_rules()]
+            table = group('variant', hash_key(type(self).__name__, sections, keys['normal'], keys['path']),
+                          lambda: self.evaluate(self.variant_sections, (frame('normal'), frame('path'))))
+            table.update(group('omim', hash_key(type(self).__name__, keys['path'], sorted(omim_file.items())),
+                               lambda: self.evaluate(self.omim_sections, (frame('path'),), omim_file)))
+        finally:
+            store.flush()
+
+        return self.arrange(table)
+
+    def spill(self, df: pd.DataFrame, kind: str, parent: str, spill_dir: Path, partitions: Dict[str, Dict], genes: Dict[str, set]):
+        # The parts keep the row positions as their index, load_partition puts the rows of a gene spread over several back in order.
+        df = df.reset_index(drop=True)
+
+        for index, (chr, part) in enumerate(df.groupby('Chr', dropna=False, sort=False)):
+            path = os.path.join(spill_dir, f'{kind}_{parent}_{index}.pkl')
+            part.to_pickle(path)
+
+            partition = partitions.setdefault(chr, {'size': 0, 'files': []})
+            partition['size'] += int(part.memory_usage(deep=True).sum())
+            partition['files'].append((kind, parent, path))
+
+            for gene in part['Gene.refGene'].unique():
+                genes.setdefault(gene, set()).add(chr)
+
+    def plan_partitions(self, partitions: Dict[str, Dict]) -> List[List[str]]:
+        budget = None if self.memory_budget is None else self.memory_budget * 1024 * 1024
+        plan: List[List[str]] = []
+        used = 0
+
+        for chr in sorted(partitions, key=chromosome_key):
+            size = partitions[chr]['size']
+
+            if budget is not None and size > budget:
+                self.warn(f'chromosome {chr} needs about {size // 2 ** 20} MB which is over the memory budget')
+
+            if not plan or budget is None or used + size > budget:
+                plan.append([chr])
+                used = size
+            else:
+                plan[-1].append(chr)
+                used += size
+
+        return plan
+
+    def load_partition(self, files: List[Tuple[str, str, Path]], spanning: List[str], spanning_partition: bool, templates: Dict[str, pd.DataFrame]) -> Tuple[pd.DataFrame, pd.DataFrame]:
+        order = {parent: index for index, (parent, _, _) in enumerate(self.inputs())}
+        frames: Dict[str, Dict[str, List[pd.DataFrame]]] = {'normal': {}, 'path': {}}
+
+        for kind, parent, path in files:
+            df = pd.read_pickle(path)
+            frames[kind].setdefault(parent, []).append(df[df['Gene.refGene'].isin(spanning) == spanning_partition])
+
+        # The rows of every member in the order they were read, as the in-memory report combines them.
+        members = {kind: [pd.concat(parts).sort_index(kind='stable') for _, parts in sorted(frames[kind].items(), key=lambda x: order[x[0]])]
+                   for kind in frames}
+
+        return tuple(self.concat_dataframes(members[kind] or [templates[kind]]) for kind in ('normal', 'path'))
+
+    def evaluate_partition(self, files: List[Tuple[str, str, Path]], spanning: List[str], spanning_partition: bool, templates: Dict[str, pd.DataFrame], omim_file: Dict[str, str]) -> List[Tuple[pd.DataFrame, str]]:
+        normal_df, path_df = self.load_partition(files, spanning, spanning_partition, templates)
+        return self.sections(normal_df, path_df, omim_file)
+
+    def shard(self, *frames: pd.DataFrame) -> List[Tuple[pd.DataFrame, ...]]:
+        """Splits the combined frames per chromosome, with the genes found on several chromosomes in one extra shard."""
+        genes = pd.concat([df[['Gene.refGene', 'Chr']] for df in frames]).drop_duplicates()
+        spanning = genes.loc[genes['Gene.refGene'].duplicated(), 'Gene.refGene'].unique()
+
+        masks = [df['Gene.refGene'].isin(spanning) for df in frames]
+        parts = [dict(tuple(df[~mask].groupby('Chr', dropna=False, sort=False))) for df, mask in zip(frames, masks)]
+
+        shards = [tuple(part.get(chr, df.iloc[:0]) for df, part in zip(frames, parts))
+                  for chr in sorted(set().union(*parts), key=chromosome_key)]
+
+        if len(spanning):
+            shards.append(tuple(df[mask] for df, mask in zip(frames, masks)))
+
+        return shards or [frames]
+
+    def evaluate(self, sections: Callable[..., Dict[str, Section]], frames: Tuple[pd.DataFrame, ...], *args) -> Dict[str, Section]:
+        """Evaluates `sections` on the frames, per chromosome shard in a process pool when `jobs` is over one."""
+        if self.jobs <= 1:
+            return sections(*frames, *args)
+
+        shards = self.shard(*frames)
+
+        with ProcessPoolExecutor(max_workers=self.jobs) as executor:
+            outputs = list(executor.map(sections, *zip(*shards), *[repeat(x, len(shards)) for x in args]))
+
+        return {name: (pd.concat([output[name][0] for output in outputs], ignore_index=True), label)
+                for name, (_, label) in outputs[0].items()}
+
+    def run_out_of_core(self, omim_file: Dict[str, str]) -> List[Tuple[pd.DataFrame, str]]:
+        """Runs the report sections one chromosome partition at a time.
+
+        The filtered inputs are spilled to disk per chromosome and packed into
+        partitions of at most `memory_budget` MB. Every grouping key of the report
+        sections contains `Gene.refGene`, so a partition only has to hold whole
+        genes: genes seen on more than one chromosome are left out of the
+        chromosome partitions and evaluated together in one extra partition.
+        """
+        with tempfile.TemporaryDirectory(dir=self.spill_dir) as spill_dir:
+            partitions: Dict[str, Dict] = {}
+            genes: Dict[str, set] = {}
+            templates: Dict[str, pd.DataFrame] = {}
+
+            for parent, gene, pathogen in self.inputs():
+                views = self.read_member(parent, gene, pathogen)
+
+                for kind in ('normal', 'path'):
+                    df = views.pop(kind)
+                    templates.setdefault(kind, df.iloc[:0])
+                    self.spill(df, kind, parent, spill_dir, partitions, genes)
+                    del df
+
+            spanning = [gene for gene, chrs in genes.items() if len(chrs) > 1]
+            tasks = [([x for chr in chrs for x in partitions[chr]['files']], False) for chrs in self.plan_partitions(partitions)]
+
+            if spanning:
+                tasks.append(([x for partition in partitions.values() for x in partition['files']], True))
+
+            if self.jobs > 1:
+                with ProcessPoolExecutor(max_workers=self.jobs) as executor:
+                    futures = [executor.submit(self.evaluate_partition, files, spanning, spanning_partition, templates, omim_file)
+                               for files, spanning_partition in tasks]
+                    outputs = [future.result() for future in futures]
+            else:
+                outputs = [self.evaluate_partition(files, spanning, spanning_partition, templates, omim_file)
+                           for files, spanning_partition in tasks]
+
+            self.success(f'{len(tasks)} partitions done, {len(spanning)} genes span several chromosomes')
+
+            if not outputs:
+                outputs.append(self.sections(self.concat_dataframes([templates['normal']]), self.concat_dataframes([templates['path']]), omim_file))
+
+        return self.merge_sections(outputs)
+
+    def merge_sections(self, outputs: List[List[Tuple[pd.DataFrame, str]]]) -> List[Tuple[pd.DataFrame, str]]:
+        return [(pd.concat([output[index][0] for output in outputs], ignore_index=True), label)
+                for index, (_, label) in enumerate(outputs[0])]
+
 
 class FatherMotherParser(GeneralParser):
+    rules = [
+        SectionRule('shared_genes', 'موارد مشترک در زوج', ('normal', 'path'), 'variant', present=('mother', 'father'),
+                    distinct=('Parent', 'Chr', 'Start', 'End', 'Ref', 'Alt')),
+        SectionRule('compound_gene', 'ژن مشترک برای احتمال کامپوند', ('normal',), 'gene', test='compound'),
+        SectionRule('dangerous_gene', 'موارد خطرناک در هر یک از زوجین', ('normal',), exceptions=True, exclude_intronic=True),
+        SectionRule('not_shared_path', 'موارد پاتوژن غیرمشترک', ('path',), 'variant', size=1),
+        SectionRule('for_check_father', 'برای بررسی در پدر', ('path',), parents=('father',), omim='zygosity'),
+        SectionRule('for_check_mother', 'برای بررسی در مادر', ('path',), parents=('mother',), omim='zygosity'),
+    ]
+
     def __init__(self, mother: Path, father: Path, 
                        mother_path: Path, father_path: Path, 
                        omim: Path,
@@ -293,50 +853,28 @@ class FatherMotherParser(GeneralParser):
         self.output = output
         self.keep_intronic = keep_intronic
         self.omim = omim
-    
-    def run(self):         
-        omim_file = self.read_OMIMfile(self.omim)
-
-        mother = self.read_csv(self.mother, 'mother', self.filter_normal, self.keep_intronic)
-        father = self.read_csv(self.father, 'father', self.filter_normal, self.keep_intronic)
-
-        mother_path = self.read_csv(self.mother_path, 'mother', self.filter_path)
-        father_path = self.read_csv(self.father_path, 'father', self.filter_path)
 
-        normal_df = self.concat_dataframes([mother, father])
-        path_df = self.concat_dataframes([mother_path, father_path])
+    def inputs(self):
+        return [('mother', self.mother, self.mother_path),
+                ('father', self.father, self.father_path)]
 
-        mother_and_father_shared_gene = normal_df.groupby(self.match_columns).filter(self.mother_and_father_share_gene)
-
-        mother_and_father_shared_path = path_df.groupby(self.match_columns).filter(self.mother_and_father_share_gene)
-
-        shared_genes = self.concat_dataframes([mother_and_father_shared_gene, mother_and_father_shared_path])
-        shared_genes.drop_duplicates(['Parent', 'Chr', 'Start', 'End', 'Ref', 'Alt'], inplace=True)
-        
-        compound_gene = normal_df.groupby('Gene.refGene').filter(lambda row: self.compound_gene(row, self.match_columns))
-
-        dangerous_gene = normal_df[(normal_df['ExonicFunc.refGene'].isin(self.gene_exceptions))
-                          | (normal_df['ExonicFunc.ensGene'].isin(self.gene_exceptions))
-                          | (normal_df['ExonicFunc.knownGene'].isin(self.gene_exceptions))
-                          | (normal_df['Func.refGene'].isin(self.gene_exceptions))
-                          | (normal_df['Function_description'].isin(self.gene_exceptions))]
-        dangerous_gene = dangerous_gene[dangerous_gene['Func.refGene'] != 'intronic']
-
-        mother_and_father_not_shared_path = path_df[~(path_df.duplicated(subset=self.match_columns, keep=False))]
-
-        f = lambda x, *args, **kwargs: self.for_check_in_father_mother_child(x, omim_file)
-        for_check = path_df[path_df.apply(f, axis=1, reduce=True)]
-        
-        datasets = [(shared_genes, 'موارد مشترک در زوج'),
-                    (compound_gene, 'ژن مشترک برای احتمال کامپوند'),
-                    (dangerous_gene, 'موارد خطرناک در هر یک از زوجین'),
-                    (mother_and_father_not_shared_path, 'موارد پاتوژن غیرمشترک'),
-                    (for_check[for_check['Parent'] == 'father'], 'برای بررسی در پدر'),
-                    (for_check[for_check['Parent'] == 'mother'], 'برای بررسی در مادر')]
-
-        self.save_xlsx(datasets, self.output)
 
 class MotherChildParser(GeneralParser):
+    rules = [
+        SectionRule('shared_gene', 'موارد مشترک در مادر و فرزند', ('normal', 'path'), 'variant', genotypes=(('child', 'hom'), ('mother', 'het'))),
+        SectionRule('not_shared_gene', 'موارد غیرمشترک در فرزند (‌فقط فرزند)', ('normal',), 'gene', absent=('father', 'mother')),
+        SectionRule('child_path', 'موارد پاتوژن فرزند', ('path',), 'gene', absent=('father', 'mother')),
+        SectionRule('mother_path', 'موارد پاتوژن مادر', ('path',), parents=('mother',), zygosity='hom'),
+        SectionRule('carrier_chance', 'احتمال ناقل بودن در مادر و فرزند', ('path',), 'variant', genotypes=(('child', 'het'), ('mother', 'het')), omim='AR'),
+        SectionRule('shared_path_without_het', 'موارد مشترک پاتوژن مشترک در مادر و فرزند', ('path',), 'variant',
+                    genotypes=(('child', 'het'), ('mother', 'het')), omim='AR'),
+        SectionRule('for_check_child', 'برای بررسی در فرزند', ('path',), 'variant', genotypes=(('child', 'het'), ('mother', 'het')),
+                    omim='AD', parents=('child',)),
+        SectionRule('for_check_mother', 'برای بررسی در مادر', ('path',), 'variant', genotypes=(('child', 'het'), ('mother', 'het')),
+                    omim='AD', parents=('mother',)),
+        SectionRule('not_shared_path', 'موارد غیرمشترک پاتوژن در مادر و فرزند', ('path',), exclude_rows_of=('carrier_chance', 'shared_gene')),
+    ]
+
     def __init__(self, mother: Path, child: Path, 
                        mother_path: Path, child_path: Path, 
                        omim: Path,
@@ -349,51 +887,37 @@ class MotherChildParser(GeneralParser):
         self.output = output
         self.keep_intronic = keep_intronic
         self.omim = omim
-    
-    def run(self): 
-        mother = self.read_csv(self.mother, 'mother', self.filter_normal, self.keep_intronic)
-        child = self.read_csv(self.child, 'child', self.filter_normal, self.keep_intronic)
-
-        mother_path = self.read_csv(self.mother_path, 'mother', self.filter_path)
-        child_path = self.read_csv(self.child_path, 'child', self.filter_path)
-
-        omim_file = self.read_OMIMfile(self.omim)
-
-        normal_df = self.concat_dataframes([mother, child])
-        path_df = self.concat_dataframes([mother_path, child_path])
-
-        for_check = path_df.groupby(self.match_columns).filter(lambda x: self.mother_and_child_share_path(x, omim_file, 'AD'))        
-        carrier_chance = path_df.groupby(self.match_columns).filter(lambda x: self.mother_and_child_share_path(x, omim_file, 'AR'))
-
-        shared_mother_child_gene = normal_df.groupby(self.match_columns).filter(self.mother_and_child_share_gene)
-        shared_mother_child_path = path_df.groupby(self.match_columns).filter(self.mother_and_child_share_gene)
-
-        not_shared_mother_child_gene = normal_df.groupby('Gene.refGene').filter(self.mother_father_and_child_do_not_share_gene)
-
-        not_shared_mother_child_path = path_df.groupby('Gene.refGene').filter(self.mother_father_and_child_do_not_share_gene)
-
-        shared_mother_child_path_without_het = path_df.groupby(self.match_columns).filter(lambda x: self.mother_and_child_share_path(x, omim_file, 'AR'))
-
-        shared_gene = self.concat_dataframes([shared_mother_child_gene, shared_mother_child_path])
-        not_shared_path = pd.merge(path_df, self.concat_dataframes([shared_mother_child_path_without_het, shared_mother_child_path]), how='left', indicator=True).query("_merge == 'left_only'").drop('_merge', axis=1)
-
-        dataframes = [
-            (shared_gene, 'موارد مشترک در مادر و فرزند'),
-            (not_shared_mother_child_gene, 'موارد غیرمشترک در فرزند (‌فقط فرزند)'),
-            (not_shared_mother_child_path, 'موارد پاتوژن فرزند'),
-            (mother_path[mother_path['Zygosity'] == 'hom'], 'موارد پاتوژن مادر'),
-            (carrier_chance, 'احتمال ناقل بودن در مادر و فرزند'),
-            (shared_mother_child_path_without_het, 'موارد مشترک پاتوژن مشترک در مادر و فرزند'),
-            (for_check[for_check['Parent'] == 'child'], 'برای بررسی در فرزند'),
-            (for_check[for_check['Parent'] == 'mother'], 'برای بررسی در مادر'),
-            (not_shared_path, 'موارد غیرمشترک پاتوژن در مادر و فرزند')
-        ]
-
-        self.save_xlsx(dataframes, self.output)
 
+    def inputs(self):
+        return [('mother', self.mother, self.mother_path),
+                ('child', self.child, self.child_path)]
 
 
 class FatherMotherChildParser(GeneralParser): 
+    rules = [
+        SectionRule('shared', 'موارد مشترک در پدر و مادر و فرزند', ('normal', 'path'), 'site', present=('child',),
+                    present_any=('father', 'mother'), test='hom_then_het'),
+        SectionRule('not_shared', 'موارد غیرمشترک در پدر و مادر و فرزند', ('normal', 'path'), 'gene', absent=('father', 'mother')),
+        SectionRule('father_mother_shared', 'موارد مشترک در زوج', ('normal', 'path'), 'site', present=('mother', 'father'),
+                    parents=('father', 'mother')),
+        # Only with the child_compound option. Before compound_gene: every gene with a phased compound is also a
+        # parental compound, and a row is only reported once.
+        SectionRule('child_compound', 'موارد کامپوند در فرزند', ('normal', 'path'), 'gene', test='phased_compound'),
+        SectionRule('compound_gene', 'ژن مشترک برای احتمال کامپوند', ('normal',), 'gene', test='compound'),
+        SectionRule('dangerous_gene', 'موارد خطرناک در هر یک از زوجین', ('normal',), parents=('father', 'mother'),
+                    exceptions=True, exclude_intronic=True),
+        SectionRule('not_shared_path_couple', 'موارد پاتوژن غیر مشترک در زوج', ('path',), 'gene', size=1, size_of=('father', 'mother'),
+                    parents=('father', 'mother')),
+        SectionRule('for_check_father', 'برای بررسی در پدر', ('path',), 'variant', genotypes=(('child', 'het'), ('mother', 'het')),
+                    omim='AD', parents=('father',)),
+        SectionRule('for_check_mother', 'برای بررسی در مادر', ('path',), 'variant', genotypes=(('child', 'het'), ('mother', 'het')),
+                    omim='AD', parents=('mother',)),
+        SectionRule('for_check_child', 'برای بررسی در فرزند', ('path',), 'variant', genotypes=(('child', 'het'), ('mother', 'het')),
+                    omim='AD', parents=('child',)),
+        SectionRule('not_shared_path', 'موارد پاتوژن غیرمشترک در فرزند و پدر و مادر', ('path',)),
+    ]
+    optional_rules = {'child_compound': 'child_compound'}
+
     def __init__(self, 
                  mother: Path, father: Path, child: Path,
                  mother_path: Path, father_path: Path, child_path: Path,
@@ -410,112 +934,128 @@ class FatherMotherChildParser(GeneralParser):
         self.keep_intronic = keep_intronic
         self.omim = omim
 
-    def run(self): 
-        father = self.read_csv(self.father, 'father', self.filter_normal, self.keep_intronic)
-        mother = self.read_csv(self.mother, 'mother', self.filter_normal, self.keep_intronic)
-        child = self.read_csv(self.child, 'child', self.filter_normal, self.keep_intronic)
-        omim_file = self.read_OMIMfile(self.omim)
-
-        father_path = self.read_csv(self.father_path, 'father', self.filter_path)
-        mother_path = self.read_csv(self.mother_path, 'mother', self.filter_path)
-        child_path = self.read_csv(self.child_path, 'child', self.filter_path)
-
-        normal_df = self.concat_dataframes([father, mother, child])
-        path_df = self.concat_dataframes([father_path, mother_path, child_path])
-
-        for_check = path_df.groupby(self.match_columns).filter(lambda x: self.mother_and_child_share_path(x, omim_file, 'AD'))
+    def inputs(self):
+        return [('father', self.father, self.father_path),
+                ('mother', self.mother, self.mother_path),
+                ('child', self.child, self.child_path)]
 
-        shared_gene = normal_df.groupby([x for x in self.match_columns if x != 'Zygosity']).filter(self.mother_and_child_or_father_and_child_share_gene)
 
-        shared_gene_path = path_df.groupby([x for x in self.match_columns if x != 'Zygosity']).filter(self.mother_and_child_or_father_and_child_share_gene)
+def family_rules(proband: str, relatives: List[str]) -> List[SectionRule]:
+    """The report of a family of any size, analysing `proband` against all `relatives`."""
+    return [
+        SectionRule('shared', 'موارد مشترک در همه اعضای خانواده', ('normal', 'path'), 'site', present=(proband, *relatives)),
+        SectionRule('not_shared', f'موارد غیرمشترک (فقط {proband})', ('normal', 'path'), 'gene', absent=tuple(relatives)),
+        SectionRule('dangerous_gene', f'موارد خطرناک در {proband}', ('normal',), parents=(proband,), exceptions=True, exclude_intronic=True),
+        SectionRule('for_check', f'برای بررسی در {proband}', ('path',), parents=(proband,), omim='zygosity'),
+        SectionRule('path', f'موارد پاتوژن {proband}', ('path',), parents=(proband,)),
+    ]
 
-        not_shared_gene = normal_df.groupby('Gene.refGene').filter(self.mother_father_and_child_do_not_share_gene)
 
-        not_shared_gene_path = path_df.groupby('Gene.refGene').filter(self.mother_father_and_child_do_not_share_gene)
+class FamilyParser(GeneralParser):
+    """A family of any size, for example with siblings or grandparents, given as (member, gene file, pathogen file or None)."""
 
-        shared_gene_without_child = normal_df.groupby([x for x in self.match_columns if x != 'Zygosity']).filter(self.mother_and_father_share_gene)
-
-        shared_gene_without_child_path = path_df.groupby([x for x in self.match_columns if x != 'Zygosity']).filter(self.mother_and_father_share_gene)
-
-        shared_gene_without_child = shared_gene_without_child[shared_gene_without_child['Parent'] != 'child']
-        shared_gene_without_child_path = shared_gene_without_child_path[shared_gene_without_child_path['Parent'] != 'child']
-
-        compound_gene = normal_df.groupby('Gene.refGene').filter(lambda row: self.compound_gene(row, self.match_columns))
-
-        father_mother_child_shared = self.concat_dataframes([shared_gene, shared_gene_path])
-        father_mother_child_not_shared = self.concat_dataframes([not_shared_gene, not_shared_gene_path])
-        father_mother_shared = self.concat_dataframes([shared_gene_without_child, shared_gene_without_child_path])
-
-        dangerous_gene = normal_df[(normal_df['ExonicFunc.refGene'].isin(self.gene_exceptions))
-                          | (normal_df['ExonicFunc.ensGene'].isin(self.gene_exceptions))
-                          | (normal_df['ExonicFunc.knownGene'].isin(self.gene_exceptions))
-                          | (normal_df['Func.refGene'].isin(self.gene_exceptions))
-                          | (normal_df['Function_description'].isin(self.gene_exceptions))]
-        
-        dangerous_gene = dangerous_gene[dangerous_gene['Parent'] != 'child']
-        dangerous_gene = dangerous_gene[dangerous_gene['Func.refGene'] != 'intronic']
-
-        mother_and_father_not_shared_path = path_df.groupby('Gene.refGene').filter(self.not_shared_path)
-        mother_and_father_not_shared_path = mother_and_father_not_shared_path[mother_and_father_not_shared_path['Parent'] != 'child']
+    def __init__(self, members: List[Tuple[str, Path, Path]], proband: str,
+                 omim: Path,
+                 output: Path,
+                 keep_intronic: bool = False,
+                 rules: Union[List[SectionRule], None] = None):
+        names = [name for name, _, _ in members]
 
-        not_shared_path = path_df
+        if proband not in names:
+            raise ValueError(f'proband {proband!r} is not one of the members {names}')
 
-        datasets = [
-            (father_mother_child_shared, 'موارد مشترک در پدر و مادر و فرزند'),
-            (father_mother_child_not_shared, 'موارد غیرمشترک در پدر و مادر و فرزند'),
-            (father_mother_shared, 'موارد مشترک در زوج'),
-            (compound_gene, 'ژن مشترک برای احتمال کامپوند'),
-            (dangerous_gene, 'موارد خطرناک در هر یک از زوجین'),
-            (mother_and_father_not_shared_path, 'موارد پاتوژن غیر مشترک در زوج'),
-            (for_check[for_check['Parent'] == 'father'], 'برای بررسی در پدر'),
-            (for_check[for_check['Parent'] == 'mother'], 'برای بررسی در مادر'),
-            (for_check[for_check['Parent'] == 'child'], 'برای بررسی در فرزند'),
-            (not_shared_path, 'موارد پاتوژن غیرمشترک در فرزند و پدر و مادر')
-        ]
+        self.members = list(members)
+        self.proband = proband
+        self.output = output
+        self.keep_intronic = keep_intronic
+        self.omim = omim
+        self.rules = rules if rules is not None else family_rules(proband, [x for x in names if x != proband])
 
-        self.save_xlsx(datasets, self.output)
+    def inputs(self):
+        return self.members
 
 
-def main():
+def main(argv=None):
     parser = argparse.ArgumentParser()
     parser.add_argument('--keep-intronic', action='store_true')
     parser.add_argument('--no-keep-intronic', dest='keep-intronic', action='store_false')
     parser.set_defaults(keep_intronic=False)
+    parser.add_argument('--chunksize', type=int, default=GeneralParser.chunksize, help="Rows parsed and filtered at a time")
+    parser.add_argument('--min-alt-reads', type=int, default=GeneralParser.min_alt_reads, help="Minimum alt allele depth (AD) of pathogenic variants")
+    parser.add_argument('--min-depth', type=int, default=GeneralParser.min_depth, help="Minimum read depth (DP) of pathogenic variants")
+    parser.add_argument('--path-genotypes', default=','.join(GeneralParser.path_genotypes), help="Comma separated genotypes (GT) accepted for pathogenic variants")
+    parser.add_argument('--vcf-sample', default=0, type=lambda x: int(x) if x.isdigit() else x, help="Sample name or position to read from multi sample VCF inputs")
+    parser.add_argument('--out-of-core', action='store_true', help="Spill the filtered inputs to disk per chromosome and analyse one partition at a time")
+    parser.add_argument('--memory-budget', type=int, default=None, help="Approximate MB of filtered rows per partition in --out-of-core mode")
+    parser.add_argument('--spill-dir', default=None, help="Directory for the spill files of --out-of-core mode")
+    parser.add_argument('--jobs', type=int, default=1, help="Worker processes evaluating different chromosomes in parallel")
+    parser.add_argument('--run-store', default=None, help="Directory keeping results between runs, only what depends on changed inputs is recomputed")
+    parser.add_argument('--store-size', type=int, default=None, help="Approximate MB the run store may use before old results are evicted")
+    parser.add_argument('--cohort-db', default=None, help="SQLite cohort store the gene files of every member are added to, see cohort_store.py for queries")
+    parser.add_argument('--family-id', default=None, help="Family the members are stored under in --cohort-db, use the same id for every analysis of a family (default: the report name)")
+    parser.add_argument('--cohort-frequencies', action='store_true', help="Filter on the het carriers in the other families of --cohort-db instead of the 'Het Our DB' column")
+    parser.add_argument('--population-index', default=None, help="Population frequency index filling missing Het/Hom Iranome counts, see population_index.py")
+    parser.add_argument('--population-prefilter', action='store_true', help="Drop the variants that are common in --population-index before filtering")
+    parser.add_argument('--panel', default=None, help="File of gene names, only variants on these genes (or in --bed) are analysed")
+    parser.add_argument('--bed', default=None, help="BED file of target regions, only variants overlapping them (or on --panel genes) are analysed")
+    parser.add_argument('--child-compound', action='store_true', help="Add the child compound section to the father_mother_child report, its rows leave the parental compound section")
+    parser.add_argument('--eager-columns', dest='lazy_columns', action='store_false', help="Read every column in the first pass instead of only for the surviving rows")
 
     subparsers = parser.add_subparsers(dest='mode', required=True)
 
     father_mother = subparsers.add_parser('father_mother', help="Filter the father_mother dataset")
-    father_mother.add_argument('mother', help="The file address for the mother gene csv file")
-    father_mother.add_argument('father', help="The file address for the father gene csv file")
-    father_mother.add_argument('mother_path', help="The file address for the mother pathogen csv file")
-    father_mother.add_argument('father_path', help="The file address for the father pathogen csv file")
+    father_mother.add_argument('mother', help="The file address for the mother gene csv or vcf file")
+    father_mother.add_argument('father', help="The file address for the father gene csv or vcf file")
+    father_mother.add_argument('mother_path', nargs='?', help="The file address for the mother pathogen csv or vcf file, the mother gene file is used when left out")
+    father_mother.add_argument('father_path', nargs='?', help="The file address for the father pathogen csv or vcf file, the father gene file is used when left out")
     
     mother_child = subparsers.add_parser('mother_child', help="Filter the mother_child dataset")
-    mother_child.add_argument('mother', help="The file address for the mother gene csv file")
-    mother_child.add_argument('child', help="The file address for the child gene csv file")
-    mother_child.add_argument('mother_path', help="The file address for the mother pathogen csv file")
-    mother_child.add_argument('child_path', help="The file address for the child pathogen csv file")
+    mother_child.add_argument('mother', help="The file address for the mother gene csv or vcf file")
+    mother_child.add_argument('child', help="The file address for the child gene csv or vcf file")
+    mother_child.add_argument('mother_path', nargs='?', help="The file address for the mother pathogen csv or vcf file, the mother gene file is used when left out")
+    mother_child.add_argument('child_path', nargs='?', help="The file address for the child pathogen csv or vcf file, the child gene file is used when left out")
     
     father_mother_child = subparsers.add_parser('father_mother_child', help="Filter the father_mother_child dataset")
-    father_mother_child.add_argument('father', help="The file address for the father gene csv file")
-    father_mother_child.add_argument('mother', help="The file address for the mother gene csv file")
-    father_mother_child.add_argument('child', help="The file address for the child gene csv file")
-    father_mother_child.add_argument('father_path', help="The file address for the father pathogen csv file")
-    father_mother_child.add_argument('mother_path', help="The file address for the mother pathogen csv file")
-    father_mother_child.add_argument('child_path', help="The file address for the child pathogen csv file")
+    father_mother_child.add_argument('father', help="The file address for the father gene csv or vcf file")
+    father_mother_child.add_argument('mother', help="The file address for the mother gene csv or vcf file")
+    father_mother_child.add_argument('child', help="The file address for the child gene csv or vcf file")
+    father_mother_child.add_argument('father_path', nargs='?', help="The file address for the father pathogen csv or vcf file, the father gene file is used when left out")
+    father_mother_child.add_argument('mother_path', nargs='?', help="The file address for the mother pathogen csv or vcf file, the mother gene file is used when left out")
+    father_mother_child.add_argument('child_path', nargs='?', help="The file address for the child pathogen csv or vcf file, the child gene file is used when left out")
+
+    family = subparsers.add_parser('family', help="Filter the dataset of a family of any size")
+    family.add_argument('--member', nargs=3, action='append', metavar=('NAME', 'GENE', 'PATHOGEN'),
+                        help="A family member with its gene and pathogen csv or vcf files, repeated for every member")
+    family.add_argument('--sample', dest='member', nargs=2, action='append', metavar=('NAME', 'FILE'),
+                        help="A family member with a single csv or vcf file, read once for both the gene and the pathogen filters")
+    family.add_argument('--proband', required=True, help="The member analysed against all other members")
 
     parser.add_argument('omim', help="The file address for the omim txt file")
-    args = parser.parse_args()
+    args = parser.parse_args(argv)
+    options = dict(chunksize=args.chunksize, lazy_columns=args.lazy_columns, vcf_sample=args.vcf_sample,
+                   out_of_core=args.out_of_core, memory_budget=args.memory_budget, spill_dir=args.spill_dir, jobs=args.jobs,
+                   run_store=args.run_store, store_size=args.store_size,
+                   cohort_db=args.cohort_db, family_id=args.family_id, cohort_frequencies=args.cohort_frequencies,
+                   population_index=args.population_index, population_prefilter=args.population_prefilter,
+                   gene_panel=args.panel, target_regions=args.bed, child_compound=args.child_compound,
+                   min_alt_reads=args.min_alt_reads, min_depth=args.min_depth, path_genotypes=tuple(args.path_genotypes.split(',')))
     
     if args.mode == 'father_mother':
         file_name = generate_file_name(args.father, args.mother)
-        FatherMotherParser(args.mother, args.father, args.mother_path, args.father_path, args.omim, file_name, args.keep_intronic).run()
+        FatherMotherParser(args.mother, args.father, args.mother_path, args.father_path, args.omim, file_name, args.keep_intronic).configure(**options).run()
     elif args.mode == 'mother_child':
         file_name = generate_file_name(args.child, args.mother)
-        MotherChildParser(args.mother, args.child, args.mother_path, args.child_path, args.omim, file_name, args.keep_intronic).run()
+        MotherChildParser(args.mother, args.child, args.mother_path, args.child_path, args.omim, file_name, args.keep_intronic).configure(**options).run()
     elif args.mode == 'father_mother_child': 
         file_name = generate_file_name(args.father, args.child, args.mother)
-        FatherMotherChildParser(args.mother, args.father, args.child, args.mother_path, args.father_path, args.child_path, args.omim, file_name, args.keep_intronic).run()
+        FatherMotherChildParser(args.mother, args.father, args.child, args.mother_path, args.father_path, args.child_path, args.omim, file_name, args.keep_intronic).configure(**options).run()
+    elif args.mode == 'family':
+        if not args.member:
+            parser.error('the family mode needs at least one --member or --sample')
+
+        args.member = [(x[0], x[1], x[2] if len(x) == 3 else None) for x in args.member]
+        file_name = generate_file_name(*[gene for _, gene, _ in args.member])
+        FamilyParser([tuple(x) for x in args.member], args.proband, args.omim, file_name, args.keep_intronic).configure(**options).run()
 
 if __name__ == "__main__":
     main()
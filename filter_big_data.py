@@ -2,28 +2,38 @@ import itertools
 import shutil
 import argparse
 from multiprocessing.pool import ThreadPool as Pool
-import xlsxwriter
 import time
-import gzip
+from contextlib import closing
+
+from compressed_io import iter_lines
+from vcf_reader import VcfReader, is_vcf
 
 FILTER_INTRONIC = True
 
 class ThreadedParser():
-    def __init__(self, path): 
+    def __init__(self, path, vcfSample=0): 
         self.path = path
+        # Sample name or position read from multi sample VCF inputs.
+        self.vcfSample = vcfSample
         self.initColumns()
 
     def getNextLine(self):
-        f = open(self.path)
-        
-        if self.path.endswith('.gz'):
-            f = gzip.open(self.path, 'rt') 
+        # Closed as soon as the parser stops reading, also when it stops early.
+        with closing(iter_lines(self.path)) as lines:
+            yield from lines
+
+    def getNextRecord(self):
+        if is_vcf(self.path):
+            reader = VcfReader(self.path, self.vcfSample)
+            yield reader.columns
+            yield from reader.records()
+            return
 
-        for line in f:
-            yield line
+        for line in self.getNextLine():
+            yield [x.strip('"') for x in line.rstrip('\n').split(',')]
 
     def initColumns(self): 
-        self.columns = [x.strip('"') for x in next(self.getNextLine()).split(',')]
+        self.columns = next(self.getNextRecord())
 
         indexer = lambda e: self.columns.index(e) if e in self.columns else None
 
@@ -37,7 +47,7 @@ class ThreadedParser():
         self.END = indexer('End')
 
 
-    def processLine(self, line): 
+    def processLine(self, data): 
         pass
 
     def afterProcess(self): 
@@ -47,8 +57,8 @@ class ThreadedParser():
     def run(self):
         pool = Pool(processes=8)
 
-        for line in self.getNextLine():
-            pool.map(self.processLine, (line, ))
+        for record in self.getNextRecord():
+            pool.map(self.processLine, (record, ))
         
         pool.close()
         pool.join()
@@ -60,9 +70,7 @@ class ChildParser(ThreadedParser):
     childGenes = []
     sharedGenes = []
 
-    def processLine(self, line):
-        data = [x.strip('"') for x in line.split(',')]
-        
+    def processLine(self, data):
         if data[self.HOM_IRANOME] != '.' and data[self.HOM_IRANOME] != '0':
             return
 
@@ -94,11 +102,11 @@ class ChildParser(ThreadedParser):
 
 
 class MotherFatherParser(ThreadedParser):
-    def __init__(self, path, childGenes, childColumns):
+    def __init__(self, path, childGenes, childColumns, vcfSample=0):
         self.childGenes = childGenes
         self.childColumns = childColumns
         self.sharedGenes = []
-        super().__init__(path)
+        super().__init__(path, vcfSample)
 
     motherChildSharedGenes = []
 
@@ -109,10 +117,15 @@ class MotherFatherParser(ThreadedParser):
         self.CHILD_GENE_REFGENE = child_indexer('Gene.refGene')
         self.CHILD_START = child_indexer('Start')
         self.CHILD_END = child_indexer('End')
-        
-    def processLine(self, line):
-        data = [x.strip('"') for x in line.split(',')]
 
+        # Child genes keyed on (Start, End, Gene.refGene), so every line is matched with one lookup.
+        self.childIndex = {}
+
+        for gene in self.childGenes:
+            key = (gene[self.CHILD_START], gene[self.CHILD_END], gene[self.CHILD_GENE_REFGENE])
+            self.childIndex.setdefault(key, []).append(gene)
+        
+    def processLine(self, data):
         if FILTER_INTRONIC:
             if data[self.FUNC_REFGENE] == 'intronic': 
                 return
@@ -120,47 +133,48 @@ class MotherFatherParser(ThreadedParser):
         if data[self.ZYGOSITY] == 'hom':
             return
     
-        for gene in self.childGenes:
-            if gene[self.CHILD_START] == data[self.START] and gene[self.CHILD_END] == data[self.END] and gene[self.CHILD_GENE_REFGENE] == data[self.GENE_REFGENE]:
-                self.sharedGenes.append(gene)
+        self.sharedGenes.extend(self.childIndex.get((data[self.START], data[self.END], data[self.GENE_REFGENE]), []))
 
     def afterProcess(self):
         return self.sharedGenes
 
-def main():
+def main(argv=None):
+    import xlsxwriter
+
     parser = argparse.ArgumentParser()
     parser.add_argument('--keep-intronic', action='store_true')
     parser.add_argument('--no-keep-intronic', dest='keep-intronic', action='store_false')
     parser.set_defaults(keep_intronic=False)
+    parser.add_argument('--vcf-sample', default=0, type=lambda x: int(x) if x.isdigit() else x, help="Sample name or position to read from multi sample VCF inputs")
 
     subparsers = parser.add_subparsers(dest='mode', required=True)
 
     mother_child = subparsers.add_parser('mother_child', help='Filter the mother child dataset')
-    mother_child.add_argument('mother', help="The file address for the mother gene csv file")
-    mother_child.add_argument('child', help="The file address for the child gene csv file")
+    mother_child.add_argument('mother', help="The file address for the mother gene csv or vcf file")
+    mother_child.add_argument('child', help="The file address for the child gene csv or vcf file")
 
     father_mother_child = subparsers.add_parser('father_mother_child', help='Filter the father mother child dataset')
-    father_mother_child.add_argument('father', help="The file address for the father gene csv file")
-    father_mother_child.add_argument('mother', help="The file address for the mother gene csv file")
-    father_mother_child.add_argument('child', help="The file address for the child gene csv file")
+    father_mother_child.add_argument('father', help="The file address for the father gene csv or vcf file")
+    father_mother_child.add_argument('mother', help="The file address for the mother gene csv or vcf file")
+    father_mother_child.add_argument('child', help="The file address for the child gene csv or vcf file")
     
-    args = parser.parse_args()
+    args = parser.parse_args(argv)
 
     childName = ''.join(args.child.split('.')[:-1])
 
     FILTER_INTRONIC = not args.keep_intronic
 
-    childParser = ChildParser(args.child)
+    childParser = ChildParser(args.child, args.vcf_sample)
     childGenes, childColumns = childParser.run()
     print(f'Child filter done, found {len(childGenes)} genes')
 
-    motherParser = MotherFatherParser(args.mother, childGenes, childColumns)
+    motherParser = MotherFatherParser(args.mother, childGenes, childColumns, args.vcf_sample)
     sharedGenes, _ = motherParser.run()
     print(f'Mother filter done, found {len(sharedGenes)} genes')
     label = 'احتمال کامپوند در مادر و فرزند'
 
     if args.mode == 'father_mother_child':
-        motherParser = MotherFatherParser(args.father, sharedGenes, childColumns)
+        motherParser = MotherFatherParser(args.father, sharedGenes, childColumns, args.vcf_sample)
         sharedGenes, _ = motherParser.run()
         print(f'Father filter done, found {len(sharedGenes)} genes')
         label = 'موارد کامپوند در فرزند'
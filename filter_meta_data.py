@@ -1,10 +1,15 @@
 import argparse
 from multiprocessing.pool import ThreadPool as Pool
-import gzip
+import json
+import sys
 import pathlib
-import matplotlib.pyplot as plt
+from contextlib import closing
 
-from typing import Union, Any, List
+from chr_scan import ChromosomeFiles, scan_lines, scan_sites
+from compressed_io import iter_lines
+from query_service import QueryClient, computeFrequencies
+
+from typing import Union, Any, Dict, List, Tuple
 
 import base64
 
@@ -15,13 +20,9 @@ class ThreadedParser():
         self.path = path
 
     def getNextLine(self):
-        f = open(self.path)
-        
-        if self.path.endswith('.gz'):
-            f = gzip.open(self.path, 'rt') 
-
-        for line in f:
-            yield line
+        # Closed as soon as the parser stops reading, also when it stops early.
+        with closing(iter_lines(self.path)) as lines:
+            yield from lines
 
     def processLine(self, line: str): 
         pass
@@ -52,22 +53,28 @@ class MetaDataParser(ThreadedParser):
 
         for phenotype in self.found.keys():
             if phenotype.lower() in line.lower():
-                self.found[phenotype].append(data[0])
+                self.found[phenotype].append((data[0], data[3]))
                 
     def afterProcess(self):
         return self.found
 
 class ChrParser(ThreadedParser):
-    def __init__(self, path: Path, chr: str, pos: str, ref: str, alt: str):
+    def __init__(self, path: Path, chr: str, pos: str, ref: str, alt: str, sorted: bool = False):
         super().__init__(path)
 
         self.chr = chr
         self.pos = pos
         self.ref = ref
         self.alt = alt
+        self.sorted = sorted
 
         self.found = {}
 
+    def getNextLine(self):
+        # Only the lines starting with chr and pos are decoded, the rest of the file is searched as raw bytes.
+        with closing(scan_lines(self.path, self.chr, self.pos, self.sorted)) as lines:
+            yield from lines
+
     def processLine(self, line):
         data = tuple(x.strip() for x in line.split('\t'))
 
@@ -108,59 +115,136 @@ class ChrParser(ThreadedParser):
     def afterProcess(self): 
         return self.found
 
-def main():
+def plot(result, phenotypes, output: Path, title: str = ''):
+    # matplotlib is only imported when a plot is drawn, it dominates the startup time otherwise.
+    from plot_render import render_plot
+
+    render_plot({phenotype: result[phenotype] for phenotype in phenotypes}, output, title)
+
+def readVariants(path: Path) -> List[Tuple[str, str, str, str]]:
+    """chr, pos, ref and alt of every line of a variants file, '#' starts a comment."""
+    variants = []
+
+    for line in iter_lines(path):
+        fields = line.split('#', 1)[0].split()
+
+        if fields:
+            variants.append(tuple(fields[:4]))
+
+    return variants
+
+def findVariants(chrFiles: ChromosomeFiles, variants: List[Tuple[str, str, str, str]], sorted: bool = False, processes: int = 8, parser=ChrParser) -> List[Dict[str, str]]:
+    """The zygosity of every sample carrying each of `variants`.
+
+    Every variant is only searched in the files of its chromosome. Each file is
+    read once for all of its variants, the lines at their positions are handed
+    to one parser per variant, and the files are scanned together on a thread
+    pool.
+    """
+    files: Dict[str, List[int]] = {}
+
+    for index, variant in enumerate(variants):
+        for path in chrFiles.files(variant[0]):
+            files.setdefault(path, []).append(index)
+
+    def searchFile(path: str) -> Dict[int, Dict[str, str]]:
+        parsers = {index: parser(path, *variants[index], sorted) for index in files[path]}
+        sites: Dict[Tuple[str, str], list] = {}
+
+        for index, chrParser in parsers.items():
+            sites.setdefault(tuple(variants[index][:2]), []).append(chrParser)
+
+        with closing(scan_sites(path, list(sites), sorted)) as lines:
+            for line in lines:
+                for chrParser in sites.get(tuple(line.split('\t', 2)[:2]), ()):
+                    chrParser.processLine(line)
+
+        return {index: chrParser.afterProcess() for index, chrParser in parsers.items()}
+
+    with Pool(processes=max(1, min(processes, len(files)))) as pool:
+        results = dict(zip(files, pool.map(searchFile, files)))
+
+    found = [{} for _ in variants]
+
+    # Merged in the order of the files of every variant, as the scans of one file at a time did.
+    for index, variant in enumerate(variants):
+        for path in chrFiles.files(variant[0]):
+            found[index].update(results[path][index])
+
+    return found
+
+def main(argv=None):
     parser = argparse.ArgumentParser()
     parser.add_argument('metadata', help="Path to metadata file")
-    parser.add_argument('chromosomes', help="Path to chromosomes file")
+    parser.add_argument('chromosomes', help="Chromosomes file, directory or glob of per chromosome files (quote the glob)")
     parser.add_argument('chr', help="Snip chromosome type")
     parser.add_argument('pos', help="Snip position")
     parser.add_argument('ref', help="Snip reference type")
     parser.add_argument('alt', help="Snip alternative type")
     parser.add_argument('phenotypes', help="Pheneotypes to search")
-    args = parser.parse_args()
-
-    phenotypes = MetaDataParser('TestData_metaData.txt', args.phenotypes.split(',')).run()
-    print('Found Phenotypes')
-    chromosomes = ChrParser('chr11Data_test.txt.gz', args.chr, args.pos, args.ref, args.alt).run()
-    print('Found chromosomes')
-
-    fig, ax = plt.subplots()
-    plt.grid(zorder=0)
-    
-    max_freq = 0
-
-    for index, (phenotype, pids) in enumerate(phenotypes.items()): 
-        nHet = 0
-        nHom = 0
-
-        for pid in pids: 
-            if pid in chromosomes.keys():
-                if chromosomes[pid] == 'het':
-                    nHet += 1
-                else:
-                    nHom += 1
-        
-        if len(pids) > 0:
-            freq = (1 * nHet + 2 * nHom) / (2 * len(pids))
-            
-            if freq > max_freq:
-                max_freq = freq
-        else: 
-            freq = 0
-
-        text = f'''Freq: {freq}\nn(Het): {nHet}\nn(Hom): {nHom}'''
-        ax.bar(index, freq, width=1, edgecolor="white", linewidth=0.7)
-        ax.text(index - 0.25, 0.05 + freq, text)
-        
-    ax.set_ylim((0, max_freq + 0.25))
-    ax.set_xlabel('Phenotypes')
-    ax.set_ylabel('Frequency')
-    ax.set_xticks(range(len(phenotypes.items())), labels=phenotypes.keys(), rotation=45)
-
-    figure = plt.gcf()
-    #figure.subplots_adjust(bottom=0.4)
-    figure.set_size_inches(20, 18)
-    plt.savefig(f"{args.chr}_{args.pos}_{args.ref}_{args.alt}.png", dpi=100)
+    parser.add_argument('--variant', nargs=4, action='append', default=[], metavar=('CHR', 'POS', 'REF', 'ALT'), help="Another snip to search, can be repeated")
+    parser.add_argument('--service', help="Address of a running query_service.py, e.g. http://127.0.0.1:8765 or unix:/path/to/socket")
+    parser.add_argument('--json', action='store_true', help="Print the frequencies as JSON instead of plotting them, one line per snip")
+    parser.add_argument('--sorted', action='store_true', help="The chromosomes files are sorted by position, the scan stops after the position")
+    parser.add_argument('--jobs', type=int, default=8, help="Files scanned at the same time")
+    parser.add_argument('--table', help="Scan table written by phenotype_scan.py build, answers from the table instead of the files")
+    parser.add_argument('--variants-file', help="File with more snips to search, one 'chr pos ref alt' per line")
+    parser.add_argument('--plot-jobs', type=int, default=1, help="Processes rendering the plots")
+    parser.add_argument('--pdf', help="Also write every plot to one multi-page PDF")
+    parser.add_argument('--sheet', help="Also write a contact sheet of all plots to this image")
+    args = parser.parse_args(argv)
+
+    variants = [(args.chr, args.pos, args.ref, args.alt)] + [tuple(x) for x in args.variant]
+
+    if args.variants_file:
+        variants += readVariants(args.variants_file)
+
+    if any(len(variant) != 4 for variant in variants):
+        parser.error('every snip needs chr, pos, ref and alt')
+    results = []
+
+    if args.table:
+        # Imported here, the table needs numpy and pandas which the other modes do not.
+        from phenotype_scan import open_table
+
+        table = open_table(args.table)
+        phenotypes = {phenotype: [] for phenotype in args.phenotypes.split(',')}
+
+        try:
+            results = [table.query(*variant, list(phenotypes)) for variant in variants]
+        except KeyError as e:
+            parser.error(e.args[0])
+
+        print('Queried scan table', file=sys.stderr)
+    elif args.service:
+        client = QueryClient(args.service)
+
+        for variant in variants:
+            result = client.query(*variant, args.phenotypes)
+            phenotypes = result.pop('phenotypes')
+            result.pop('chromosomes')
+            results.append(result)
+
+        print('Queried service', file=sys.stderr)
+    else:
+        phenotypes = MetaDataParser(args.metadata, args.phenotypes.split(',')).run()
+        print('Found Phenotypes', file=sys.stderr)
+        found = findVariants(ChromosomeFiles(args.chromosomes), variants, args.sorted, args.jobs)
+        print('Found chromosomes', file=sys.stderr)
+        results = [computeFrequencies(phenotypes, chromosomes) for chromosomes in found]
+
+    if args.json:
+        for result in results:
+            print(json.dumps(result))
+    elif len(variants) == 1 and args.pdf is None and args.sheet is None:
+        plot(results[0], phenotypes, f"{'_'.join(variants[0])}.png", ' '.join(variants[0]))
+    else:
+        # Imported here for the same reason as in plot.
+        from plot_render import render_plots
+
+        plots = [({phenotype: result[phenotype] for phenotype in phenotypes}, f"{'_'.join(variant)}.png", ' '.join(variant))
+                 for variant, result in zip(variants, results)]
+        render_plots(plots, args.plot_jobs, args.pdf, args.sheet)
 
 if __name__ == "__main__":
     main()
@@ -1,14 +1,17 @@
+import argparse
 import tkinter as tk
 from tkinter import ttk
 from tkinter import filedialog as fd
 from tkinter.messagebox import showerror, showinfo, askyesno
+from tkinter.simpledialog import askstring
 import datetime
 import webbrowser
-import gzip
 import pathlib
+from contextlib import closing
 from typing import Union, Any, List
 from multiprocessing.pool import ThreadPool as Pool
 import threading
+from array import array
 
 import matplotlib as plt
 plt.use('TkAgg')
@@ -19,6 +22,11 @@ from matplotlib.backends.backend_tkagg import (
     NavigationToolbar2Tk
 )
 
+from chr_scan import ChromosomeFiles, scan_lines
+from compressed_io import iter_lines
+from filter_meta_data import findVariants
+from query_service import QueryClient, computeFrequencies
+
 Path = Union[str, pathlib.Path]
 
 class ThreadedParser():
@@ -26,13 +34,9 @@ class ThreadedParser():
         self.path = path
 
     def getNextLine(self):
-        f = open(self.path)
-        
-        if self.path.endswith('.gz'):
-            f = gzip.open(self.path, 'rt') 
-
-        for line in f:
-            yield line
+        # Closed as soon as the parser stops reading, also when it stops early.
+        with closing(iter_lines(self.path)) as lines:
+            yield from lines
 
     def processLine(self, line: str): 
         pass
@@ -69,16 +73,22 @@ class MetaDataParser(ThreadedParser):
         return self.found
 
 class ChrParser(ThreadedParser):
-    def __init__(self, path: Path, chr: str, pos: str, ref: str, alt: str):
+    def __init__(self, path: Path, chr: str, pos: str, ref: str, alt: str, sorted: bool = False):
         super().__init__(path)
 
         self.chr = chr
         self.pos = pos
         self.ref = ref
         self.alt = alt
+        self.sorted = sorted
 
         self.found = {}
 
+    def getNextLine(self):
+        # Only the lines starting with chr and pos are decoded, the rest of the file is searched as raw bytes.
+        with closing(scan_lines(self.path, self.chr, self.pos, self.sorted)) as lines:
+            yield from lines
+
     def processLine(self, line):
         data = tuple(x.strip() for x in line.split('\t'))
 
@@ -120,7 +130,7 @@ class ChrParser(ThreadedParser):
         return self.found
 
 class AsyncSearch(threading.Thread):
-    def __init__(self, chr, pos, ref, alt, phenotypes, chrFile, metaFile, progressCallback, finishCallback):
+    def __init__(self, chr, pos, ref, alt, phenotypes, chrFile, metaFile, progressCallback, finishCallback, service=None, table=None):
         super().__init__()
         self.chr = chr
         self.pos = pos
@@ -131,43 +141,34 @@ class AsyncSearch(threading.Thread):
         self.metaFile = metaFile
         self.progressCallback = progressCallback
         self.finishCallback = finishCallback
+        self.service = service
+        self.table = table
 
     
     def run(self):
-        phenotypes = MetaDataParser(self.metaFile, self.phenotypes.split(',')).run()
-        self.progressCallback(33)
-        
-        chromosomes = ChrParser(self.chrFile, self.chr, self.pos, self.ref, self.alt).run()
-        self.progressCallback(66)
-
-        result = {}
-
-        result['phenotypes'] = phenotypes
-        result['chromosomes'] = chromosomes
-        
-
-        for index, (phenotype, pids) in enumerate(phenotypes.items()): 
-            hets = []
-            homs = []
-            other_phenotypes = {}
-
-            for pid in pids:
-                if pid[0] in chromosomes.keys():
-                    if chromosomes[pid[0]] == 'het':
-                        hets.append(pid[0])
-                    else:
-                        homs.append(pid[0])
-
-                    other_phenotypes[pid[0]] = pid[1]
-                    
+        if self.service:
+            self.progressCallback(33)
+            result = QueryClient(self.service).query(self.chr, self.pos, self.ref, self.alt, self.phenotypes)
+        elif self.table:
+            # Imported here, the table needs numpy and pandas which the other searches do not.
+            from phenotype_scan import open_table
+
+            self.progressCallback(33)
+            phenotypes = self.phenotypes.split(',')
+            result = open_table(self.table).query(self.chr, self.pos, self.ref, self.alt, phenotypes)
+            # The table keeps counts only, the carriers are not listed.
+            result['phenotypes'] = {phenotype: [] for phenotype in phenotypes}
+            result['chromosomes'] = {}
+        else:
+            phenotypes = MetaDataParser(self.metaFile, self.phenotypes.split(',')).run()
+            self.progressCallback(33)
             
-            if len(pids) > 0:
-                freq = (1 * len(hets) + 2 * len(homs)) / (2 * len(pids))
-            else: 
-                freq = 0
+            chromosomes = findVariants(ChromosomeFiles(self.chrFile), [(self.chr, self.pos, self.ref, self.alt)], parser=ChrParser)[0]
+            self.progressCallback(66)
 
-            
-            result[phenotype] = (freq, len(hets), len(homs), hets, homs, other_phenotypes)
+            result = computeFrequencies(phenotypes, chromosomes)
+            result['phenotypes'] = phenotypes
+            result['chromosomes'] = chromosomes
 
         self.progressCallback(100)
         self.finishCallback(result)
@@ -186,7 +187,143 @@ class ReadonlyEntry:
         self.entry = ttk.Entry(master, state="readonly", textvariable=textvariable)
         self.entry.grid(column=1, row=row, sticky='we', pady=2, padx=5, ipady=2, ipadx=2, columnspan=2)
 
-class MainWindow(tk.Tk): 
+class VirtualTable(ttk.Frame):
+    ZYGOSITIES = ('Het', 'Hom')
+
+    def __init__(self, master, height=6):
+        super().__init__(master)
+
+        self.height = height
+        self.offset = 0
+        self.sortColumn = None
+        self.sortReverse = False
+
+        # Column data is kept outside of Tk: ids as a tuple, phenotypes
+        # dictionary encoded and zygosities as one byte per sample. Only
+        # `height` Treeview rows ever exist, scrolling rewrites their values.
+        self.ids = ()
+        self.phenotypeLabels = []
+        self.phenotypeCodes = array('I')
+        self.zygosityCodes = array('B')
+        self.view = array('I')
+
+        self.zygosityFilter = tk.StringVar(value='All')
+        self.filterBox = ttk.Combobox(self, textvariable=self.zygosityFilter, values=('All',) + self.ZYGOSITIES, state='readonly', width=6)
+        self.filterBox.bind('<<ComboboxSelected>>', lambda event: self.refresh())
+        self.filterBox.grid(column=0, row=0, sticky='w', pady=2)
+
+        self.countLabel = ttk.Label(self, text='')
+        self.countLabel.grid(column=1, row=0, sticky='e', pady=2)
+
+        self.tree = ttk.Treeview(self, column=('ID', 'Phenotypes', 'Zygosity'), show='headings', height=height, selectmode='browse')
+        self.tree.column("# 1", anchor='center', width=75, stretch=False)
+        self.tree.heading("# 1", text='ID', command=lambda: self.sortBy('ID'))
+        self.tree.column("# 2", anchor='center')
+        self.tree.heading("# 2", text='Phenotypes', command=lambda: self.sortBy('Phenotypes'))
+        self.tree.column("# 3", anchor='center', width=75, stretch=False)
+        self.tree.heading("# 3", text='Zygosity', command=lambda: self.sortBy('Zygosity'))
+        self.tree.grid(column=0, row=1, sticky='we', columnspan=2)
+
+        self.scrollbar = ttk.Scrollbar(self, orient='vertical', command=self.onScroll)
+        self.scrollbar.grid(column=2, row=1, sticky='ns')
+
+        for widget in (self.tree, self.scrollbar):
+            widget.bind('<MouseWheel>', lambda event: self.scrollBy(-1 if event.delta > 0 else 1))
+            widget.bind('<Button-4>', lambda event: self.scrollBy(-1))
+            widget.bind('<Button-5>', lambda event: self.scrollBy(1))
+
+        self.columnconfigure(0, weight=1)
+
+        for row in range(height):
+            self.tree.insert('', 'end', iid=str(row), values=('', '', ''))
+
+        self.render()
+
+    def setRows(self, ids, phenotypes, zygosities):
+        labels = {}
+
+        self.ids = tuple(ids)
+        self.phenotypeCodes = array('I', (labels.setdefault(x, len(labels)) for x in phenotypes))
+        self.phenotypeLabels = list(labels)
+        self.zygosityCodes = array('B', (self.ZYGOSITIES.index(x) for x in zygosities))
+        self.refresh()
+
+    def clear(self):
+        self.setRows((), (), ())
+
+    def refresh(self):
+        selected = self.zygosityFilter.get()
+
+        if selected in self.ZYGOSITIES:
+            code = self.ZYGOSITIES.index(selected)
+            self.view = array('I', (i for i, x in enumerate(self.zygosityCodes) if x == code))
+        else:
+            self.view = array('I', range(len(self.ids)))
+
+        if self.sortColumn is not None:
+            self.view = array('I', sorted(self.view, key=self.sortKey(self.sortColumn), reverse=self.sortReverse))
+
+        self.offset = 0
+        self.render()
+
+    def sortKey(self, column):
+        if column == 'ID':
+            return self.ids.__getitem__
+        elif column == 'Phenotypes':
+            return lambda i: self.phenotypeLabels[self.phenotypeCodes[i]]
+        else:
+            return self.zygosityCodes.__getitem__
+
+    def sortBy(self, column):
+        if self.sortColumn == column:
+            self.sortReverse = not self.sortReverse
+        else:
+            self.sortColumn = column
+            self.sortReverse = False
+
+        self.view = array('I', sorted(self.view, key=self.sortKey(column), reverse=self.sortReverse))
+        self.render()
+
+    def scrollBy(self, rows):
+        last = max(len(self.view) - self.height, 0)
+        offset = min(max(self.offset + rows, 0), last)
+
+        if offset != self.offset:
+            self.offset = offset
+            self.render()
+
+        return 'break'
+
+    def onScroll(self, action, value, unit=None):
+        if action == 'moveto':
+            self.scrollBy(int(float(value) * len(self.view)) - self.offset)
+        elif unit == 'pages':
+            self.scrollBy(int(value) * self.height)
+        else:
+            self.scrollBy(int(value))
+
+    def render(self):
+        total = len(self.view)
+
+        for row in range(self.height):
+            position = self.offset + row
+
+            if position < total:
+                i = self.view[position]
+                values = (self.ids[i], self.phenotypeLabels[self.phenotypeCodes[i]], self.ZYGOSITIES[self.zygosityCodes[i]])
+            else:
+                values = ('', '', '')
+
+            self.tree.item(str(row), values=values)
+
+        if total:
+            self.scrollbar.set(self.offset / total, min(self.offset + self.height, total) / total)
+        else:
+            self.scrollbar.set(0, 1)
+
+        self.countLabel['text'] = f'{total} of {len(self.ids)} samples'
+
+class MainWindow(tk.Tk):
     def openChr(self): 
         filename = fd.askopenfilename(title='Open the meta data file', filetypes=(('Uncompressed txt', '*.txt'), ('Compressed txt', '*.gz')))
 
@@ -196,6 +333,15 @@ class MainWindow(tk.Tk):
             if self.metaDataPath.get() != 'No file is opened': 
                 self.enableAfterOpen()
 
+    def openChrDirectory(self):
+        directory = fd.askdirectory(title='Open the directory of the chromosome files')
+
+        if directory:
+            self.chrPath.set(directory)
+
+            if self.metaDataPath.get() != 'No file is opened':
+                self.enableAfterOpen()
+
     def openMetaData(self):
         filename = fd.askopenfilename(title='Open the meta data file', filetypes=(('Uncompressed txt', '*.txt'), ('Compressed txt', '*.gz')))
 
@@ -205,6 +351,45 @@ class MainWindow(tk.Tk):
             if self.chrPath.get() != 'No file is opened': 
                 self.enableAfterOpen()
 
+    def connectService(self):
+        address = askstring(title='Query service', prompt='Address of the running query service\n(e.g. http://127.0.0.1:8765 or unix:/path/to/socket)', initialvalue=self.service or '')
+
+        if address is None:
+            return
+
+        if not address:
+            self.service = None
+            self.serviceAddress.set('Not connected')
+
+            if self.chrPath.get() == 'No file is opened' or self.metaDataPath.get() == 'No file is opened':
+                self.searchButton['state'] = 'disabled'
+
+            return
+
+        try:
+            health = QueryClient(address, timeout=5).health()
+        except Exception as e:
+            showerror(title='Query service', message=f'Could not reach {address}:\n{e}')
+            return
+
+        self.service = address
+        self.serviceAddress.set(f"{address} ({health['samples']} samples, {health['variants']} variants)")
+        self.enableAfterOpen()
+
+    def openScanTable(self):
+        directory = fd.askdirectory(title='Open the directory of a scan table')
+
+        if not directory:
+            return
+
+        if not (pathlib.Path(directory) / 'meta.json').exists():
+            showerror(title='Scan table', message=f'{directory} is not a scan table, build one with phenotype_scan.py build')
+            return
+
+        self.table = directory
+        self.tablePath.set(directory)
+        self.enableAfterOpen()
+
     def enableAfterOpen(self):
         self.searchButton['state'] = 'normal'
         self.progress.stop()
@@ -227,6 +412,7 @@ class MainWindow(tk.Tk):
         self.openMetaDataButton['state'] = 'normal'
         self.fileMenu.entryconfigure("Open Meta data", state='normal')
         self.fileMenu.entryconfigure("Open Chromosome file", state='normal')
+        self.fileMenu.entryconfigure("Open Chromosome directory", state='normal')
         self.fileMenu.entryconfigure("Save plot as png", state='normal')
         self.progress['mode'] = 'determinate'
         self.progress.stop()
@@ -296,6 +482,7 @@ class MainWindow(tk.Tk):
         self.savePngButton['state'] = 'disabled'
         self.fileMenu.entryconfigure("Open Meta data", state='disabled')
         self.fileMenu.entryconfigure("Open Chromosome file", state='disabled')
+        self.fileMenu.entryconfigure("Open Chromosome directory", state='disabled')
         self.fileMenu.entryconfigure("Save plot as png", state='disabled')
         self.progress['mode'] = 'indeterminate'
         self.progress.start()
@@ -314,7 +501,9 @@ class MainWindow(tk.Tk):
                             self.chrPath.get(),
                             self.metaDataPath.get(),
                             self.progressCallback,
-                            self.finishCallback)
+                            self.finishCallback,
+                            self.service,
+                            self.table)
 
         thread.setDaemon(True)
         thread.start()
@@ -347,7 +536,7 @@ class MainWindow(tk.Tk):
                     homs = items[4] 
 
                     text = f'''Freq: {round(freq, 3)}\nn(Het): {nHet}\nn(Hom): {nHom}'''
-                    if nHet > 0 or nHom > 0:
+                    if hets or homs:
                         text += f'''\nHet IDS: {','.join(hets)}\nHom IDS: {','.join(homs)}'''
                         
                     self.annot.set_visible(True)
@@ -365,19 +554,15 @@ class MainWindow(tk.Tk):
             x = event.xdata  
             labels = axes.get_xticklabels()
 
-            for item in self.infoTable.get_children():
-                self.infoTable.delete(item)
+            self.infoTable.clear()
 
             for index, patch in enumerate(axes.patches):
                 if patch.get_bbox().containsx(x):
                     items = self.result[labels[index]._text]
-                    hets = items[3] 
-                    for index, (key, item) in enumerate(items[5].items()):
-                        if key in hets:
-                            zygosity = 'Het'
-                        else:
-                            zygosity = 'Hom'
-                        self.infoTable.insert('', 'end',text=str(index),values=(key, item, zygosity))
+                    hets = set(items[3])
+                    self.infoTable.setRows(items[5].keys(),
+                                           items[5].values(),
+                                           ('Het' if key in hets else 'Hom' for key in items[5].keys()))
 
                     
     def __init__(self):
@@ -385,6 +570,10 @@ class MainWindow(tk.Tk):
 
         self.metaDataPath = tk.StringVar(value='No file is opened')
         self.chrPath = tk.StringVar(value='No file is opened')
+        self.serviceAddress = tk.StringVar(value='Not connected')
+        self.service = None
+        self.tablePath = tk.StringVar(value='No table is opened')
+        self.table = None
 
         self.title('Human Gene Pars :: Meta data filter UI')
         self.geometry('800x350')
@@ -395,6 +584,9 @@ class MainWindow(tk.Tk):
         self.fileMenu = tk.Menu(self.menuBar, tearoff=False)
         self.fileMenu.add_command(label="Open Meta data", command=self.openMetaData)
         self.fileMenu.add_command(label="Open Chromosome file", command=self.openChr)
+        self.fileMenu.add_command(label="Open Chromosome directory", command=self.openChrDirectory)
+        self.fileMenu.add_command(label="Connect to query service", command=self.connectService)
+        self.fileMenu.add_command(label="Open scan table", command=self.openScanTable)
         self.fileMenu.add_command(label="Save plot as png", command=self.savePlotAsPng, state="disabled")
         self.fileMenu.add_separator()
         self.fileMenu.add_command(label="Exit", command=self.destroy)
@@ -431,23 +623,19 @@ class MainWindow(tk.Tk):
 
         self.metaDataPathLabel = ReadonlyEntry(self.fileManagement, 'Meta data file:', 8, self.metaDataPath)
         self.chrPathLabel = ReadonlyEntry(self.fileManagement, 'Chromosome file:', 9, self.chrPath)
+        self.serviceLabel = ReadonlyEntry(self.fileManagement, 'Query service:', 10, self.serviceAddress)
+        self.tableLabel = ReadonlyEntry(self.fileManagement, 'Scan table:', 11, self.tablePath)
         
-        ttk.Separator(self.fileManagement, orient='horizontal').grid(column=0, row=10, columnspan=3, pady=5)
+        ttk.Separator(self.fileManagement, orient='horizontal').grid(column=0, row=12, columnspan=3, pady=5)
 
         self.searchButton = ttk.Button(self.fileManagement, text='Search', state='disabled', command=self.processFiles)
-        self.searchButton.grid(column=0, row=11, sticky='we', columnspan=1, ipady=3, ipadx=3)
+        self.searchButton.grid(column=0, row=13, sticky='we', columnspan=1, ipady=3, ipadx=3)
 
         self.progress = ttk.Progressbar(self.fileManagement, orient='horizontal', length=100)
-        self.progress.grid(column=1, row=11, sticky='we', columnspan=2, ipady=3, ipadx=3)
+        self.progress.grid(column=1, row=13, sticky='we', columnspan=2, ipady=3, ipadx=3)
 
-        self.infoTable = ttk.Treeview(self.fileManagement, column=('ID', 'Phenotypes', 'Zygosity'), show='headings', height=6)
-        self.infoTable.column("# 1", anchor='center', width=75, stretch=False)
-        self.infoTable.heading("# 1", text= 'ID')
-        self.infoTable.column("# 2", anchor='center')
-        self.infoTable.heading("# 2", text='Phenotypes')
-        self.infoTable.column("# 3", anchor='center', width=75, stretch=False)
-        self.infoTable.heading("# 3", text='Zygosity')  
-        self.infoTable.grid(column=0, row=12, sticky='we', columnspan=3, ipady=3, ipadx=3)
+        self.infoTable = VirtualTable(self.fileManagement, height=6)
+        self.infoTable.grid(column=0, row=14, sticky='we', columnspan=3, ipady=3, ipadx=3)
 
 
 
@@ -465,6 +653,17 @@ class MainWindow(tk.Tk):
         self.figureCanvas.get_tk_widget().pack(side='top', fill='both', expand=True)
 
 
-if __name__ == "__main__":
-    app = MainWindow()
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Opens the graphical interface, it takes no arguments.")
+    parser.parse_args(argv)
+
+    try:
+        app = MainWindow()
+    except tk.TclError as e:
+        parser.exit(1, f'{parser.prog}: cannot open the window: {e}\n')
+
     app.mainloop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,72 @@
+import numpy as np
+import pandas as pd
+
+from typing import List, Sequence
+
+from group_index import GroupIndex
+
+# Zygosity flags of a member in a variant, combined with | when a member has several rows.
+ABSENT = 0
+HET = 1
+HOM = 2
+OTHER = 4
+
+class GenotypeMatrix():
+    """The long family table pivoted to one row per group and one column per family member.
+
+    `codes` holds an int8 zygosity flag per group and member (ABSENT, HET, HOM or
+    OTHER, or-ed together for members with several rows) and `rows` the number of
+    rows of every member, so family rules become comparisons across columns.
+    Members that are not part of the family are always absent.
+    """
+
+    def __init__(self, index: GroupIndex, columns: Sequence[str], members: List[str]):
+        self.index = index
+        self.columns = list(columns)
+        self.members = list(members)
+        self.groups = index.groups(self.columns)
+
+        df = index.df
+        member = pd.Categorical(df['Parent'], categories=self.members).codes.astype(np.int64)
+        known = member >= 0
+        cells = self.groups.codes[known] * len(self.members) + member[known]
+        shape = (self.groups.count, len(self.members))
+
+        het, hom = index.equals('Zygosity', 'het')[known], index.equals('Zygosity', 'hom')[known]
+        self.codes = np.zeros(shape, dtype=np.int8)
+
+        for flag, mask in ((HET, het), (HOM, hom), (OTHER, ~(het | hom))):
+            self.codes |= (np.bincount(cells[mask], minlength=shape[0] * shape[1]).reshape(shape) > 0).astype(np.int8) * flag
+
+        self.rows = np.bincount(cells, minlength=shape[0] * shape[1]).reshape(shape).astype(np.int32)
+
+    @property
+    def sizes(self) -> np.ndarray:
+        return self.groups.sizes
+
+    def column(self, member: str) -> np.ndarray:
+        if member not in self.members:
+            return np.zeros(self.groups.count, dtype=np.int8)
+
+        return self.codes[:, self.members.index(member)]
+
+    def count(self, member: str) -> np.ndarray:
+        if member not in self.members:
+            return np.zeros(self.groups.count, dtype=np.int32)
+
+        return self.rows[:, self.members.index(member)]
+
+    def has(self, *members: str) -> np.ndarray:
+        """Groups in which every one of `members` has a row."""
+        return np.logical_and.reduce([self.column(x) != ABSENT for x in members])
+
+    def has_any(self, *members: str) -> np.ndarray:
+        return np.logical_or.reduce([self.column(x) != ABSENT for x in members])
+
+    def genotype(self, member: str, flag: int) -> np.ndarray:
+        """Groups in which `member` has exactly one row, with zygosity `flag`."""
+        return (self.count(member) == 1) & (self.column(member) == flag)
+
+
+def zygosity_flag(zygosity: str) -> int:
+    return {'het': HET, 'hom': HOM}.get(zygosity, OTHER)
@@ -0,0 +1,119 @@
+import numpy as np
+import pandas as pd
+
+from typing import Dict, List, Sequence, Tuple
+
+
+def factorize(values: pd.Series) -> Tuple[np.ndarray, int]:
+    """Sorted codes of a column, missing values get the last code like in `sort_values`."""
+    codes, uniques = pd.factorize(values, sort=True)
+    codes = np.asarray(codes, dtype=np.int64)
+    missing = codes < 0
+
+    if missing.any():
+        codes[missing] = len(uniques)
+        return codes, len(uniques) + 1
+
+    return codes, len(uniques)
+
+
+class Groups():
+    """The groups of one grouping key: a code per row and the start/end offsets of every group in `order`."""
+
+    def __init__(self, codes: np.ndarray, count: int):
+        self.codes = codes
+        self.count = count
+        self.order = np.argsort(codes, kind='stable')
+        self.sizes = np.bincount(codes, minlength=count)
+        self.ends = np.cumsum(self.sizes)
+        self.starts = self.ends - self.sizes
+
+    def total(self, mask: np.ndarray) -> np.ndarray:
+        """Number of rows of every group for which `mask` holds."""
+        return np.bincount(self.codes[mask], minlength=self.count)
+
+    def has(self, mask: np.ndarray) -> np.ndarray:
+        return self.total(mask) > 0
+
+    def rows(self, keep: np.ndarray) -> np.ndarray:
+        """Broadcasts a per group decision to the rows, like `groupby(...).filter`."""
+        return keep[self.codes]
+
+    def rank(self) -> np.ndarray:
+        """Position of every row within its group, like `groupby(...).cumcount`."""
+        rank = np.empty(len(self.codes), dtype=np.int64)
+        rank[self.order] = np.arange(len(self.codes)) - np.repeat(self.starts, self.sizes)
+        return rank
+
+    def nth(self, values: np.ndarray, n: int, by: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """The value of the n-th row of every group with the rows of a group stably sorted on `by`.
+
+        Returns the values and a mask of the groups that have more than n rows.
+        """
+        order = np.lexsort((by, self.codes))
+        valid = self.sizes > n
+        picked = np.empty(self.count, dtype=values.dtype)
+        picked[valid] = values[order[self.starts[valid] + n]]
+
+        return picked, valid
+
+
+class GroupIndex():
+    """Group codes of a combined frame, computed once per grouping key and shared by all report sections.
+
+    Every column is factorized once, the codes of a key with several columns are
+    combined from the column codes. Group codes follow the sorted order of the
+    key, missing values form their own group like `groupby(..., dropna=False)`.
+    """
+
+    def __init__(self, df: pd.DataFrame):
+        self.df = df
+        self.columns: Dict[str, Tuple[np.ndarray, int]] = {}
+        self.keys: Dict[Tuple[str, ...], Groups] = {}
+        self.masks: Dict[Tuple[str, str], np.ndarray] = {}
+
+    def __len__(self) -> int:
+        return len(self.df)
+
+    def column(self, name: str) -> Tuple[np.ndarray, int]:
+        if name not in self.columns:
+            self.columns[name] = factorize(self.df[name])
+
+        return self.columns[name]
+
+    def codes(self, columns: Sequence[str]) -> Tuple[np.ndarray, int]:
+        codes, count = np.zeros(len(self.df), dtype=np.int64), 1
+
+        for name in columns:
+            column, size = self.column(name)
+            codes, uniques = pd.factorize(codes * size + column, sort=True)
+            count = len(uniques)
+
+        return codes, count
+
+    def groups(self, columns: Sequence[str]) -> Groups:
+        key = tuple(columns)
+
+        if key not in self.keys:
+            self.keys[key] = Groups(*self.codes(key))
+
+        return self.keys[key]
+
+    def equals(self, column: str, value: str) -> np.ndarray:
+        if (column, value) not in self.masks:
+            self.masks[column, value] = self.df[column].eq(value).fillna(False).to_numpy(dtype=bool)
+
+        return self.masks[column, value]
+
+    def sort_order(self, columns: Sequence[str]) -> np.ndarray:
+        """Positions of the rows stably sorted on `columns`, like `sort_values(columns, kind='stable')`."""
+        return np.argsort(self.codes(columns)[0], kind='stable')
+
+
+def report_order(frames: List[pd.DataFrame], columns: Sequence[str]) -> List[np.ndarray]:
+    """The report order of every frame, from one index over the rows of all frames."""
+    index = GroupIndex(pd.concat([df[list(columns)] for df in frames], ignore_index=True))
+    codes = index.codes(columns)[0]
+    bounds = np.cumsum([0] + [len(df) for df in frames])
+
+    return [np.argsort(codes[start:end], kind='stable') for start, end in zip(bounds[:-1], bounds[1:])]
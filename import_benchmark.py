@@ -0,0 +1,64 @@
+import argparse
+import pathlib
+import subprocess
+import sys
+import time
+
+# Lightweight paths of cli.py and the seconds they may take, best of `--repeat` runs.
+TARGETS = [
+    (['cli.py', '--help'], 0.15),
+    (['cli.py', 'meta', '--help'], 0.25),
+    (['cli.py', 'serve', '--help'], 0.25),
+]
+
+ROOT = pathlib.Path(__file__).resolve().parent
+
+# Modules the lightweight paths must not import.
+HEAVY = ['pandas', 'numpy', 'matplotlib', 'xlsxwriter', 'tkinter']
+LIGHT_MODULES = ['cli', 'filter_meta_data', 'query_service', 'filter_big_data']
+
+
+def best_time(command, repeat: int) -> float:
+    times = []
+
+    for _ in range(repeat):
+        start = time.perf_counter()
+        subprocess.run([sys.executable, *command], cwd=ROOT, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, check=True)
+        times.append(time.perf_counter() - start)
+
+    return min(times)
+
+
+def heavy_imports() -> list:
+    """The heavy modules loaded by importing the lightweight modules in a fresh interpreter."""
+    code = f"import sys, {', '.join(LIGHT_MODULES)}; print(','.join(m for m in {HEAVY!r} if m in sys.modules))"
+    output = subprocess.run([sys.executable, '-c', code], cwd=ROOT, capture_output=True, text=True, check=True).stdout.strip()
+    return output.split(',') if output else []
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Measures the startup time of the lightweight command line paths.")
+    parser.add_argument('--repeat', type=int, default=5, help="Runs per command, the best one is compared with the target")
+    parser.add_argument('--scale', type=float, default=1.0, help="Multiplier of the targets for slower machines")
+    args = parser.parse_args(argv)
+
+    # Startup of a bare interpreter, the targets are on top of it.
+    baseline = best_time(['-c', 'pass'], args.repeat)
+    failed = False
+
+    for command, target in TARGETS:
+        elapsed = best_time(command, args.repeat) - baseline
+        ok = elapsed <= target * args.scale
+        failed |= not ok
+        print(f"{' '.join(command):<30} {elapsed:.3f}s (target {target * args.scale:.3f}s) {'ok' if ok else 'SLOW'}")
+
+    loaded = heavy_imports()
+    if loaded:
+        failed = True
+        print(f"heavy modules imported at startup: {', '.join(loaded)}")
+
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,321 @@
+import argparse
+import json
+import pathlib
+from functools import lru_cache
+
+import numpy as np
+import pandas as pd
+
+from typing import Any, Dict, Iterator, List, Tuple, Union
+
+from chr_scan import ChromosomeFiles
+from compressed_io import iter_batches, iter_lines
+
+Path = Union[str, pathlib.Path]
+Phenotypes = Dict[str, List[Tuple[str, str]]]
+
+FIELDS = ['chr', 'pos', 'ref', 'alts', 'zygosities', 'ids']
+
+
+def find_phenotypes(metadata: Path, phenotypes: List[str]) -> Phenotypes:
+    """The (sample, phenotypes) of the metadata lines mentioning every phenotype, as MetaDataParser finds them."""
+    found = {phenotype: [] for phenotype in phenotypes}
+
+    for line in iter_lines(metadata):
+        data = tuple(x.strip() for x in line.split('\t'))
+
+        for phenotype in found:
+            if phenotype.lower() in line.lower():
+                found[phenotype].append((data[0], data[3] if len(data) > 3 else ''))
+
+    return found
+
+
+def membership(phenotypes: Phenotypes) -> Tuple[pd.Index, np.ndarray]:
+    """The samples of the phenotypes and how many times each sample is listed under every phenotype."""
+    samples = pd.Index(list(dict.fromkeys(pid for pids in phenotypes.values() for pid, _ in pids)))
+    counts = np.zeros((len(samples), len(phenotypes)), dtype=np.int64)
+
+    for column, pids in enumerate(phenotypes.values()):
+        np.add.at(counts[:, column], samples.get_indexer([pid for pid, _ in pids]), 1)
+
+    return samples, counts
+
+
+def scan_keys(variants: pd.DataFrame) -> np.ndarray:
+    """64-bit keys of (chr, pos, ref, alt) text columns."""
+    return pd.util.hash_pandas_object(variants[['chr', 'pos', 'ref', 'alt']].astype(object), index=False, categorize=True).to_numpy(dtype=np.uint64)
+
+
+def split_items(values: pd.Series) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """The non empty ';' separated items of every value, with the position of their value and their position among its kept items.
+
+    All values are split at once: a newline, which no value of a line holds, is
+    added between the values and the running count of newlines numbers them.
+    """
+    items = np.array(';\n;'.join(values.fillna('').tolist()).split(';'), dtype=object)
+    marker = items == '\n'
+    value = np.cumsum(marker)
+    keep = ~marker & (items != '')
+    items, value = items[keep], value[keep]
+    position = np.arange(len(items)) - np.searchsorted(value, value)
+
+    return items, values.index.to_numpy()[value], position
+
+
+def parse_batch(batch: bytes, chr: str, start: Union[int, None], end: Union[int, None], samples: pd.Index, first: int):
+    """The variants of a batch of lines in the region, and the carriers of every line among `samples`.
+
+    Returns the variants (line, key, chr, pos, ref, alt) and the carriers as
+    (line, sample, hom) arrays; `first` numbers the lines across batches.
+    """
+    lines = batch.decode().split('\n')
+
+    if lines and not lines[-1]:
+        lines.pop()
+
+    fields = pd.Series(lines, dtype=object).str.split('\t', n=len(FIELDS), expand=True)
+    fields = fields.reindex(columns=range(len(FIELDS))).astype(object)
+    fields.columns = FIELDS
+    fields.index = pd.RangeIndex(first, first + len(fields), name='line')
+    fields = fields[fields['chr'].str.strip() == chr].apply(lambda x: x.str.strip())
+
+    if start is not None or end is not None:
+        pos = pd.to_numeric(fields['pos'], errors='coerce')
+        fields = fields[pos.between(-np.inf if start is None else start, np.inf if end is None else end).to_numpy(dtype=bool)]
+
+    # One variant per alt of a line, a line lists every carrier of all of its alts.
+    variants = fields[['chr', 'pos', 'ref']].join(fields['alts'].str.split(',').explode().rename('alt'))
+    variants = variants[variants['alt'].notna() & (variants['alt'] != '')].reset_index().drop_duplicates()
+    variants = variants.assign(key=scan_keys(variants))
+
+    # The ids and zygosities of a line are paired in order, the extra items of the longer list are ignored.
+    ids, id_lines, id_positions = split_items(fields['ids'])
+    zygosities, zygosity_lines, zygosity_positions = split_items(fields['zygosities'])
+    line_index = fields.index.to_numpy()
+    id_rows, zygosity_rows = np.searchsorted(line_index, id_lines), np.searchsorted(line_index, zygosity_lines)
+    pairs = np.minimum(np.bincount(id_rows, minlength=len(line_index)), np.bincount(zygosity_rows, minlength=len(line_index)))
+    id_keep = id_positions < pairs[id_rows]
+    zygosity_keep = zygosity_positions < pairs[zygosity_rows]
+
+    codes, uniques = pd.factorize(zygosities[zygosity_keep])
+    hom = np.array(['0' not in x for x in uniques], dtype=bool)[codes]
+    sample = samples.get_indexer(ids[id_keep])
+    carrier = sample >= 0
+
+    return variants, (id_lines[id_keep][carrier], sample[carrier], hom[carrier])
+
+
+def scan_batches(paths: List[str]) -> Iterator[bytes]:
+    for path in paths:
+        yield from iter_batches(path)
+
+
+def encode_labels(labels: List[str]) -> Tuple[np.ndarray, np.ndarray]:
+    data = [x.encode() for x in labels]
+    offsets = np.zeros(len(data) + 1, dtype=np.int64)
+    np.cumsum([len(x) for x in data], out=offsets[1:])
+
+    return np.frombuffer(b''.join(data), dtype=np.uint8), offsets
+
+
+class ScanTable():
+    """Per-phenotype het and hom carrier counts of every variant of a chromosome or region.
+
+    The table is a directory of numpy arrays opened memory mapped: the sorted
+    variant keys, the het and hom counts in the same order with one column per
+    phenotype and the variant labels, so a variant lookup is a binary search
+    and ranking a phenotype only reads its columns. Frequencies are
+    (nHet + 2 * nHom) / (2 * n) with n the samples listed under the phenotype,
+    as computeFrequencies counts them.
+    """
+
+    def __init__(self, root: Path):
+        self.root = pathlib.Path(root)
+
+        with open(self.root / 'meta.json') as f:
+            self.meta = json.load(f)
+
+        self.phenotypes: List[str] = self.meta['phenotypes']
+        self.sizes = np.array(self.meta['sizes'], dtype=np.int64)
+        self.keys = np.load(self.root / 'keys.npy', mmap_mode='r')
+        self.het = np.load(self.root / 'het.npy', mmap_mode='r')
+        self.hom = np.load(self.root / 'hom.npy', mmap_mode='r')
+        self.labels = np.load(self.root / 'labels.npy', mmap_mode='r')
+        self.offsets = np.load(self.root / 'offsets.npy', mmap_mode='r')
+
+    @staticmethod
+    def build(metadata: Path, chromosomes: Path, chr: str, phenotypes: List[str], root: Path,
+              start: Union[int, None] = None, end: Union[int, None] = None) -> 'ScanTable':
+        """Streams the files of `chr` once and writes the table of the variants between `start` and `end` to `root`."""
+        found = find_phenotypes(metadata, phenotypes)
+        samples, counts = membership(found)
+        paths = ChromosomeFiles(chromosomes).files(chr)
+        variants, carriers, first = [], [], 0
+
+        for batch in scan_batches(paths):
+            batch_variants, batch_carriers = parse_batch(batch, chr, start, end, samples, first)
+            variants.append(batch_variants)
+            carriers.append(batch_carriers)
+            # Line numbers only have to grow across batches.
+            first += batch.count(b'\n') + 1
+
+        variants = pd.concat(variants, ignore_index=True) if variants else pd.DataFrame(columns=['line', 'chr', 'pos', 'ref', 'alt', 'key'])
+        keys, index, rows = np.unique(variants['key'].to_numpy(dtype=np.uint64), return_index=True, return_inverse=True)
+        lines = variants['line'].to_numpy(dtype=np.int64)
+
+        if carriers:
+            line, sample, hom = (np.concatenate(x) for x in zip(*carriers))
+        else:
+            line, sample, hom = np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64), np.empty(0, dtype=bool)
+
+        # A sample listed twice on a line keeps its last zygosity, as ChrParser does.
+        listed = pd.DataFrame({'line': line, 'sample': sample, 'hom': hom}).drop_duplicates(['line', 'sample'], keep='last')
+        line, sample, hom = listed['line'].to_numpy(), listed['sample'].to_numpy(), listed['hom'].to_numpy(dtype=bool)
+
+        het_counts = np.zeros((len(keys), len(found)), dtype=np.int32)
+        hom_counts = np.zeros((len(keys), len(found)), dtype=np.int32)
+
+        # Counted per line, every variant listed on a single line takes the counts of its line.
+        single = np.bincount(rows, minlength=len(keys))[rows] == 1
+
+        for column in range(len(found)):
+            weights = counts[sample, column]
+            het_counts[rows[single], column] = np.bincount(line[~hom], weights=weights[~hom], minlength=first)[lines[single]]
+            hom_counts[rows[single], column] = np.bincount(line[hom], weights=weights[hom], minlength=first)[lines[single]]
+
+        # A sample listed on several lines of a variant keeps its zygosity on the last line, as ChrParser does.
+        if not single.all():
+            repeated = pd.DataFrame({'row': rows[~single], 'line': lines[~single]})
+            listed = pd.DataFrame({'line': line, 'sample': sample, 'hom': hom}).merge(repeated, on='line')
+            listed = listed.sort_values(['row', 'sample', 'line'], kind='stable').drop_duplicates(['row', 'sample'], keep='last')
+            listed_hom = listed['hom'].to_numpy(dtype=bool)
+
+            for column in range(len(found)):
+                weights = counts[listed['sample'].to_numpy(), column]
+                het_counts[:, column][np.unique(rows[~single])] = 0
+                hom_counts[:, column][np.unique(rows[~single])] = 0
+                np.add.at(het_counts[:, column], listed['row'].to_numpy()[~listed_hom], weights[~listed_hom])
+                np.add.at(hom_counts[:, column], listed['row'].to_numpy()[listed_hom], weights[listed_hom])
+
+        variants = variants.iloc[index]
+        labels, offsets = encode_labels(variants['chr'].str.cat(variants[['pos', 'ref', 'alt']], sep='\t').tolist())
+
+        root = pathlib.Path(root)
+        root.mkdir(parents=True, exist_ok=True)
+        np.save(root / 'keys.npy', keys)
+        np.save(root / 'het.npy', het_counts)
+        np.save(root / 'hom.npy', hom_counts)
+        np.save(root / 'labels.npy', labels)
+        np.save(root / 'offsets.npy', offsets)
+
+        with open(root / 'meta.json', 'w') as f:
+            json.dump({'phenotypes': list(found), 'sizes': [len(x) for x in found.values()], 'variants': int(len(keys)),
+                       'chr': chr, 'start': start, 'end': end, 'metadata': str(metadata), 'files': paths}, f)
+
+        return ScanTable(root)
+
+    def label(self, row: int) -> Tuple[str, ...]:
+        """(chr, pos, ref, alt) of a row."""
+        return tuple(bytes(self.labels[self.offsets[row]:self.offsets[row + 1]]).decode().split('\t'))
+
+    def covers(self, chr: str, pos: str) -> bool:
+        """Whether the position was scanned, a variant of a scanned position missing from the table has no carriers."""
+        if chr != self.meta['chr']:
+            return False
+
+        if self.meta['start'] is None and self.meta['end'] is None:
+            return True
+
+        return pos.isdigit() and (self.meta['start'] or 0) <= int(pos) <= (self.meta['end'] if self.meta['end'] is not None else int(pos))
+
+    def find(self, chr: str, pos: str, ref: str, alt: str) -> int:
+        """Row of a variant, -1 when it is not in the table."""
+        key = scan_keys(pd.DataFrame({'chr': [chr], 'pos': [pos], 'ref': [ref], 'alt': [alt]}))[0]
+        row = int(np.searchsorted(self.keys, key))
+
+        if row < len(self.keys) and self.keys[row] == key and self.label(row) == (chr, pos, ref, alt):
+            return row
+
+        return -1
+
+    def frequencies(self, rows) -> np.ndarray:
+        het, hom = np.asarray(self.het[rows], dtype=np.float64), np.asarray(self.hom[rows], dtype=np.float64)
+
+        with np.errstate(divide='ignore', invalid='ignore'):
+            return np.where(self.sizes > 0, (het + 2 * hom) / (2 * self.sizes), 0)
+
+    def result(self, row: int, phenotypes: Union[List[str], None] = None) -> Dict[str, Any]:
+        """The counts of a row in the format of computeFrequencies, without the carrier ids."""
+        phenotypes = self.phenotypes if phenotypes is None else phenotypes
+        columns = [self.phenotypes.index(x) for x in phenotypes]
+        freq = self.frequencies(row) if row >= 0 else np.zeros(len(self.phenotypes))
+
+        return {self.phenotypes[x]: (float(freq[x]), int(self.het[row, x]) if row >= 0 else 0, int(self.hom[row, x]) if row >= 0 else 0, [], [], {})
+                for x in columns}
+
+    def query(self, chr: str, pos: str, ref: str, alt: str, phenotypes: Union[List[str], None] = None) -> Dict[str, Any]:
+        missing = [x for x in phenotypes or [] if x not in self.phenotypes]
+
+        if missing:
+            raise KeyError(f'the table at {self.root} has no phenotypes {missing}, it has {self.phenotypes}')
+
+        row = self.find(chr, pos, ref, alt)
+
+        if row < 0 and not self.covers(chr, pos):
+            raise KeyError(f'{chr}:{pos} is outside the region of the table at {self.root}')
+
+        return self.result(row, phenotypes)
+
+    def rank(self, phenotype: str, against: Union[str, None] = None, limit: int = 20) -> List[Dict[str, Any]]:
+        """The variants with the highest frequency in `phenotype`, or the highest difference to its frequency in `against`."""
+        column = self.phenotypes.index(phenotype)
+        freq = self.frequencies(slice(None))
+        score = freq[:, column] - (freq[:, self.phenotypes.index(against)] if against is not None else 0)
+        rows = np.argsort(-score, kind='stable')[:limit]
+
+        return [{'variant': self.label(row), 'score': float(score[row]), 'result': self.result(int(row))} for row in rows]
+
+
+@lru_cache(maxsize=4)
+def open_table(root: str) -> ScanTable:
+    """One memory mapped table per directory and process."""
+    return ScanTable(root)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Per-phenotype frequencies of every variant of a chromosome or region.")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    build = subparsers.add_parser('build', help="Scan the chromosome files once and write the table")
+    build.add_argument('metadata', help="Path to metadata file")
+    build.add_argument('chromosomes', help="Chromosomes file, directory or glob of per chromosome files (quote the glob)")
+    build.add_argument('chr', help="Chromosome to scan")
+    build.add_argument('phenotypes', help="Comma separated phenotypes")
+    build.add_argument('table', help="Directory the table is written to")
+    build.add_argument('--start', type=int, default=None, help="First position of the region")
+    build.add_argument('--end', type=int, default=None, help="Last position of the region")
+
+    variant = subparsers.add_parser('variant', help="Frequencies of a variant")
+    variant.add_argument('table')
+    for name in ('chr', 'pos', 'ref', 'alt'):
+        variant.add_argument(name)
+
+    rank = subparsers.add_parser('rank', help="Variants ranked by frequency in a phenotype")
+    rank.add_argument('table')
+    rank.add_argument('phenotype')
+    rank.add_argument('--against', default=None, help="Rank by the difference to the frequency in this phenotype")
+    rank.add_argument('--limit', type=int, default=20)
+    args = parser.parse_args(argv)
+
+    if args.command == 'build':
+        table = ScanTable.build(args.metadata, args.chromosomes, args.chr, args.phenotypes.split(','), args.table, args.start, args.end)
+        print(f"Scanned {table.meta['variants']} variants")
+    elif args.command == 'variant':
+        print(json.dumps(open_table(args.table).query(args.chr, args.pos, args.ref, args.alt)))
+    else:
+        for row in open_table(args.table).rank(args.phenotype, args.against, args.limit):
+            print(json.dumps(row))
+
+if __name__ == "__main__":
+    main()
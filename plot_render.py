@@ -0,0 +1,139 @@
+import pathlib
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache
+
+import numpy as np
+from matplotlib import image
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from matplotlib.figure import Figure
+
+from typing import Dict, Iterable, List, Sequence, Tuple, Union
+
+Path = Union[str, pathlib.Path]
+# Phenotype -> (freq, n(Het), n(Hom), ...) as returned by computeFrequencies.
+Result = Dict[str, tuple]
+
+SIZE = (20, 18)
+DPI = 100
+SHEET_COLUMNS = 4
+SHEET_WIDTH = 400
+
+
+class PlotTemplate():
+    """The frequency plot of a list of phenotypes, drawn once and updated for every variant.
+
+    The figure has its own Agg canvas instead of going through the pyplot state,
+    so templates can be used from threads and worker processes. The axes, bars,
+    ticks and labels are created once; plotting a variant only changes the bar
+    heights, the texts and the y limit.
+    """
+
+    def __init__(self, phenotypes: Sequence[str]):
+        self.phenotypes = list(phenotypes)
+        self.figure = Figure(figsize=SIZE, dpi=DPI)
+        FigureCanvasAgg(self.figure)
+
+        self.axes = self.figure.add_subplot()
+        self.axes.grid(zorder=0)
+        # One colour per phenotype, as the bars used to be drawn one call at a time.
+        self.bars = self.axes.bar(range(len(self.phenotypes)), [0] * len(self.phenotypes), width=1, edgecolor="white",
+                                  linewidth=0.7, color=[f'C{index}' for index in range(len(self.phenotypes))])
+        self.texts = [self.axes.text(index - 0.25, 0.05, '') for index in range(len(self.phenotypes))]
+        self.axes.set_xlabel('Phenotypes')
+        self.axes.set_ylabel('Frequency')
+        self.axes.set_xticks(range(len(self.phenotypes)), labels=self.phenotypes, rotation=45)
+
+    def draw(self, result: Result, title: str = '') -> Figure:
+        max_freq = 0
+
+        for index, (phenotype, bar, text) in enumerate(zip(self.phenotypes, self.bars, self.texts)):
+            freq, nHet, nHom, *_ = result[phenotype]
+            max_freq = max(max_freq, freq)
+
+            bar.set_height(freq)
+            text.set_position((index - 0.25, 0.05 + freq))
+            text.set_text(f'''Freq: {freq}\nn(Het): {nHet}\nn(Hom): {nHom}''')
+
+        self.axes.set_ylim((0, max_freq + 0.25))
+        self.axes.set_title(title)
+
+        return self.figure
+
+
+@lru_cache(maxsize=8)
+def template(phenotypes: Tuple[str, ...]) -> PlotTemplate:
+    """One template per phenotype list and process."""
+    return PlotTemplate(phenotypes)
+
+
+def counts(result: Result) -> Result:
+    """Only what is plotted, the carrier IDs are not sent to the workers."""
+    return {phenotype: tuple(items[:3]) for phenotype, items in result.items()}
+
+
+def render_plot(result: Result, output: Path, title: str = '') -> Path:
+    """Writes the plot of `result` to `output`, the format follows the file extension."""
+    template(tuple(result)).draw(result, title).savefig(output, dpi=DPI)
+    return output
+
+
+def write_pdf(plots: Iterable[Tuple[Result, Path, str]], path: Path):
+    """One page per plot, titled with its variant."""
+    from matplotlib.backends.backend_pdf import PdfPages
+
+    with PdfPages(path) as pdf:
+        for result, _, title in plots:
+            pdf.savefig(template(tuple(result)).draw(result, title))
+
+
+def write_sheet(images: Sequence[Path], path: Path, columns: int = SHEET_COLUMNS, width: int = SHEET_WIDTH):
+    """Tiles downscaled copies of the rendered images into one image, `columns` per row."""
+    thumbnails = []
+
+    for png in images:
+        pixels = image.imread(png)
+        step = max(1, pixels.shape[1] // width)
+        thumbnails.append(pixels[::step, ::step])
+
+    cellHeight = max(x.shape[0] for x in thumbnails)
+    cellWidth = max(x.shape[1] for x in thumbnails)
+    rows = -(-len(thumbnails) // columns)
+    sheet = np.ones((rows * cellHeight, columns * cellWidth, thumbnails[0].shape[2]), dtype=thumbnails[0].dtype)
+
+    for index, thumbnail in enumerate(thumbnails):
+        top, left = divmod(index, columns)
+        top, left = top * cellHeight, left * cellWidth
+        sheet[top:top + thumbnail.shape[0], left:left + thumbnail.shape[1]] = thumbnail
+
+    image.imsave(path, sheet)
+
+
+def render_plots(plots: List[Tuple[Result, Path, str]], jobs: int = 1, pdf: Union[Path, None] = None,
+                 sheet: Union[Path, None] = None) -> List[Path]:
+    """Renders (result, output, title) plots, on `jobs` processes when it is over one.
+
+    Every worker keeps its own templates, so a phenotype list is laid out once
+    per process. The optional multi-page PDF is written by this process while
+    the workers render the images, and the contact sheet is tiled from the
+    rendered images.
+    """
+    plots = [(counts(result), output, title) for result, output, title in plots]
+
+    if jobs > 1 and len(plots) > 1:
+        with ProcessPoolExecutor(max_workers=min(jobs, len(plots))) as executor:
+            outputs = executor.map(render_plot, *zip(*plots), chunksize=max(1, len(plots) // (4 * jobs)))
+
+            if pdf is not None:
+                write_pdf(plots, pdf)
+
+            outputs = list(outputs)
+    else:
+        outputs = [render_plot(*plot) for plot in plots]
+
+        if pdf is not None:
+            write_pdf(plots, pdf)
+
+    if sheet is not None and outputs:
+        write_sheet(outputs, sheet)
+
+    return outputs
@@ -0,0 +1,218 @@
+import argparse
+import json
+import os
+import pathlib
+from functools import lru_cache
+
+import numpy as np
+import pandas as pd
+
+from typing import Union
+
+from region_filter import CHR_PREFIX
+from variant_key import ALLELE_COLUMNS, MULTIPLIER
+from variant_schema import apply_schema
+
+Path = Union[str, pathlib.Path]
+
+HET, HOM = 'Het Iranome', 'Hom Iranome'
+BITS_PER_KEY = 10
+HASHES = 7
+# Version of population_keys, indexes compiled with another version have to be compiled again.
+KEYS_VERSION = 2
+
+
+def population_keys(df: pd.DataFrame) -> np.ndarray:
+    """64-bit keys of the alleles of `df`, independent of the dtypes the columns were read with.
+
+    'chr11', 'Chr11' and '11' give the same key, as in region_filter.
+    """
+    df = apply_schema(df[ALLELE_COLUMNS])
+    df = df.assign(Chr=df['Chr'].str.strip().str.replace(CHR_PREFIX, '', regex=True))
+    columns = {x: df[x].fillna(-1).astype(np.int64) if x in ('Start', 'End') else df[x].astype(object) for x in ALLELE_COLUMNS}
+
+    return pd.util.hash_pandas_object(pd.DataFrame(columns, index=df.index), index=False, categorize=True).to_numpy(dtype=np.uint64)
+
+
+def bloom_positions(keys: np.ndarray, bits: int) -> np.ndarray:
+    """HASHES bit positions of every key, by double hashing."""
+    with np.errstate(over='ignore'):
+        step = (keys * MULTIPLIER) | np.uint64(1)
+        rounds = np.arange(HASHES, dtype=np.uint64)[:, None]
+        return (keys[None, :] + rounds * step[None, :]) % np.uint64(bits)
+
+
+class BloomFilter():
+    """A bit array with HASHES bits set per key, about 1% false positives at BITS_PER_KEY bits per key."""
+
+    def __init__(self, array: np.ndarray):
+        self.array = array
+        self.bits = len(array) * 8
+
+    @classmethod
+    def build(cls, keys: np.ndarray) -> 'BloomFilter':
+        array = np.zeros(max(1, len(keys) * BITS_PER_KEY // 8 + 1), dtype=np.uint8)
+        positions = bloom_positions(keys, len(array) * 8).ravel()
+        np.bitwise_or.at(array, (positions >> np.uint64(3)).astype(np.int64), (np.uint8(1) << (positions & np.uint64(7)).astype(np.uint8)))
+        return cls(array)
+
+    def might_contain(self, keys: np.ndarray) -> np.ndarray:
+        """False for keys that are certainly not in the filter."""
+        positions = bloom_positions(keys, self.bits)
+        found = (self.array[(positions >> np.uint64(3)).astype(np.int64)] >> (positions & np.uint64(7)).astype(np.uint8)) & 1
+        return found.all(axis=0)
+
+
+class PopulationIndex():
+    """Het and hom counts of a population frequency table, looked up by variant.
+
+    The index is a directory of numpy arrays opened memory mapped: the sorted
+    allele keys and the counts in the same order, so a lookup is a binary search
+    and only the touched pages are read. An optional Bloom filter of the common
+    variants (more than `max_hom` hom carriers, or at least `min_het` het carriers)
+    answers most "is it common?" questions without touching the index.
+    """
+
+    def __init__(self, root: Path):
+        self.root = pathlib.Path(root)
+
+        with open(self.root / 'meta.json') as f:
+            self.meta = json.load(f)
+
+        if self.meta.get('keys', 1) != KEYS_VERSION:
+            raise ValueError(f'the population index at {self.root} was compiled by an older version, compile it again')
+
+        self.keys = np.load(self.root / 'keys.npy', mmap_mode='r')
+        self.het = np.load(self.root / 'het.npy', mmap_mode='r')
+        self.hom = np.load(self.root / 'hom.npy', mmap_mode='r')
+        bloom = self.root / 'bloom.npy'
+        self.bloom = BloomFilter(np.load(bloom, mmap_mode='r')) if bloom.exists() else None
+
+    @staticmethod
+    def compile(table: Path, root: Path, het: str = HET, hom: str = HOM, sep: str = ',', chunksize: int = 1000000,
+                bloom: bool = True, max_hom: float = 0, min_het: Union[float, None] = None) -> 'PopulationIndex':
+        """Compiles a table with the allele columns and het and hom counts into an index at `root`."""
+        keys, hets, homs = [], [], []
+
+        for chunk in pd.read_csv(table, sep=sep, index_col=False, usecols=ALLELE_COLUMNS + [het, hom], dtype=str, chunksize=chunksize):
+            chunk = chunk.dropna(subset=['Start', 'End'])
+            keys.append(population_keys(chunk))
+            # Missing counts stay NaN, they are attached as missing values.
+            hets.append(pd.to_numeric(chunk[het], errors='coerce').to_numpy(dtype=np.float32, na_value=np.nan))
+            homs.append(pd.to_numeric(chunk[hom], errors='coerce').to_numpy(dtype=np.float32, na_value=np.nan))
+
+        keys = np.concatenate(keys) if keys else np.empty(0, dtype=np.uint64)
+        hets = np.concatenate(hets) if hets else np.empty(0, dtype=np.float32)
+        homs = np.concatenate(homs) if homs else np.empty(0, dtype=np.float32)
+
+        # Sorted by key; a variant listed twice keeps its first counts.
+        order = np.argsort(keys, kind='stable')
+        keys, hets, homs = keys[order], hets[order], homs[order]
+        first = np.ones(len(keys), dtype=bool)
+        first[1:] = keys[1:] != keys[:-1]
+        keys, hets, homs = keys[first], hets[first], homs[first]
+
+        root = pathlib.Path(root)
+        root.mkdir(parents=True, exist_ok=True)
+        np.save(root / 'keys.npy', keys)
+        np.save(root / 'het.npy', hets)
+        np.save(root / 'hom.npy', homs)
+        (root / 'bloom.npy').unlink(missing_ok=True)
+
+        if bloom:
+            np.save(root / 'bloom.npy', BloomFilter.build(keys[common_mask(hets, homs, max_hom, min_het)]).array)
+
+        with open(root / 'meta.json', 'w') as f:
+            json.dump({'variants': int(len(keys)), 'keys': KEYS_VERSION, 'het': het, 'hom': hom, 'max_hom': max_hom, 'min_het': min_het}, f)
+
+        return PopulationIndex(root)
+
+    def positions(self, keys: np.ndarray) -> np.ndarray:
+        """Position of every key in the index, -1 for keys that are not indexed."""
+        if len(self.keys) == 0:
+            return np.full(len(keys), -1, dtype=np.int64)
+
+        positions = np.searchsorted(self.keys, keys)
+        found = positions < len(self.keys)
+        found[found] = self.keys[positions[found]] == keys[found]
+
+        return np.where(found, positions, -1)
+
+    def counts(self, df: pd.DataFrame):
+        """(het, hom) of every row of `df` as nullable Float64 series, <NA> for variants not in the index."""
+        positions = self.positions(population_keys(df))
+        found = positions >= 0
+        het = pd.array(np.where(found, self.het[np.maximum(positions, 0)], 0), dtype='Float64')
+        hom = pd.array(np.where(found, self.hom[np.maximum(positions, 0)], 0), dtype='Float64')
+        het[~found] = pd.NA
+        hom[~found] = pd.NA
+
+        return pd.Series(het, index=df.index), pd.Series(hom, index=df.index)
+
+    def attach(self, df: pd.DataFrame) -> pd.DataFrame:
+        """Fills the het and hom columns of `df` from the index where they are missing, adding them if needed."""
+        het, hom = self.counts(df)
+        columns = {}
+
+        for name, values in ((HET, het), (HOM, hom)):
+            columns[name] = values if name not in df.columns else df[name].astype('Float64').fillna(values)
+
+        return df.assign(**columns)
+
+    def common(self, df: pd.DataFrame) -> np.ndarray:
+        """Rows of `df` whose variant is common in the population, as defined when the index was compiled."""
+        keys = population_keys(df)
+        candidates = np.ones(len(keys), dtype=bool) if self.bloom is None else self.bloom.might_contain(keys)
+        common = np.zeros(len(keys), dtype=bool)
+
+        # Only the Bloom filter hits are looked up in the index.
+        positions = self.positions(keys[candidates])
+        found = positions >= 0
+        hits = np.zeros(len(positions), dtype=bool)
+        hits[found] = common_mask(self.het[positions[found]], self.hom[positions[found]], self.meta['max_hom'], self.meta['min_het'])
+        common[candidates] = hits
+
+        return common
+
+
+@lru_cache(maxsize=4)
+def open_index(root: str) -> PopulationIndex:
+    """One memory mapped index per directory and process."""
+    return PopulationIndex(root)
+
+
+def index_version(root: Path) -> list:
+    """Changes whenever the index at `root` is compiled again."""
+    stat = os.stat(pathlib.Path(root) / 'keys.npy')
+    return [str(root), stat.st_size, stat.st_mtime_ns]
+
+
+def common_mask(het: np.ndarray, hom: np.ndarray, max_hom: float, min_het: Union[float, None]) -> np.ndarray:
+    mask = np.asarray(hom) > max_hom
+
+    if min_het is not None:
+        mask |= np.asarray(het) >= min_het
+
+    return mask
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Compiles a population frequency table into a memory mapped index.")
+    parser.add_argument('table', help="Table with the Chr, Start, End, Ref and Alt columns and het and hom counts")
+    parser.add_argument('index', help="Directory the index is written to")
+    parser.add_argument('--het-column', default=HET, help="Column with the het counts")
+    parser.add_argument('--hom-column', default=HOM, help="Column with the hom counts")
+    parser.add_argument('--sep', default=',', help="Column separator of the table")
+    parser.add_argument('--no-bloom', dest='bloom', action='store_false', help="Do not build the Bloom filter of the common variants")
+    parser.add_argument('--max-hom', type=float, default=0, help="Variants with more hom carriers are common, the default matches the Hom Iranome filters")
+    parser.add_argument('--min-het', type=float, default=None, help="Variants with at least this many het carriers are common")
+    args = parser.parse_args(argv)
+
+    # Lets the shell pass a tab as --sep '\t'.
+    sep = args.sep.encode().decode('unicode_escape')
+    index = PopulationIndex.compile(args.table, args.index, args.het_column, args.hom_column, sep, bloom=args.bloom,
+                                    max_hom=args.max_hom, min_het=args.min_het)
+    print(f"Indexed {index.meta['variants']} variants")
+
+if __name__ == "__main__":
+    main()
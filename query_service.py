@@ -0,0 +1,486 @@
+import argparse
+import asyncio
+import bisect
+import http.client
+import ipaddress
+import itertools
+import json
+import mmap
+import os
+import pathlib
+import socket
+import tempfile
+import threading
+import urllib.parse
+from contextlib import closing
+from functools import lru_cache
+
+from typing import Union, Any, Dict, Iterator, List, Tuple
+
+from chr_scan import expand_paths
+from compressed_io import detect_format, iter_bgzf_blocks, iter_blocks, iter_lines, iter_plain, read_bgzf_line
+
+Path = Union[str, pathlib.Path]
+
+Phenotypes = Dict[str, List[Tuple[str, str]]]
+Chromosomes = Dict[str, str]
+
+# Decompressed bytes of a chromosome file indexed at a time.
+INDEX_BATCH = 4 << 20
+
+
+def openText(path: Path):
+    """The lines of a plain, gzip, bgzip or zstd file, closed when the `with` block ends."""
+    return closing(iter_lines(path))
+
+
+def computeFrequencies(phenotypes: Phenotypes, chromosomes: Chromosomes) -> Dict[str, Any]:
+    result = {}
+
+    for phenotype, pids in phenotypes.items():
+        hets = []
+        homs = []
+        other_phenotypes = {}
+
+        for pid in pids:
+            if pid[0] in chromosomes.keys():
+                if chromosomes[pid[0]] == 'het':
+                    hets.append(pid[0])
+                else:
+                    homs.append(pid[0])
+
+                other_phenotypes[pid[0]] = pid[1]
+
+        if len(pids) > 0:
+            freq = (1 * len(hets) + 2 * len(homs)) / (2 * len(pids))
+        else:
+            freq = 0
+
+        result[phenotype] = (freq, len(hets), len(homs), hets, homs, other_phenotypes)
+
+    return result
+
+
+class LineFile():
+    """The lines of one chromosome file, read back by their offset in the decompressed text.
+
+    Plain files are memory mapped and bgzip files are read from the block that
+    holds the line. gzip and zstd streams cannot be read from the middle, they
+    are decompressed once into a plain copy in `spillDir`.
+    """
+
+    def __init__(self, path: Path, spillDir: Union[str, None]):
+        self.path = str(path)
+        self.format = detect_format(path)
+        self.spillDir = spillDir
+        self.copy = None
+        self.data = None
+        self.blockOffsets: List[int] = []
+        self.blockStarts: List[int] = []
+
+    def blocks(self) -> Iterator[bytes]:
+        """The decompressed content, recording on the way what reading a line back needs."""
+        if self.format == 'bgzf':
+            position = 0
+
+            for offset, data in iter_bgzf_blocks(self.path):
+                self.blockOffsets.append(offset)
+                self.blockStarts.append(position)
+                position += len(data)
+                yield data
+        elif self.format == 'plain':
+            yield from iter_plain(self.path)
+        else:
+            with tempfile.NamedTemporaryFile(dir=self.spillDir, suffix='.txt', delete=False) as f:
+                self.copy = f.name
+
+                for data in iter_blocks(self.path):
+                    f.write(data)
+                    yield data
+
+    def open(self):
+        path = self.copy or self.path
+
+        if self.format != 'bgzf' and os.path.getsize(path):
+            with open(path, 'rb') as f:
+                self.data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def line(self, offset: int) -> bytes:
+        if self.format == 'bgzf':
+            # Empty blocks share their start with the next block, the last block starting at or before the offset holds it.
+            block = bisect.bisect_right(self.blockStarts, offset) - 1
+            return read_bgzf_line(self.path, self.blockOffsets[block], offset - self.blockStarts[block])
+
+        end = self.data.find(b'\n', offset)
+        return self.data[offset:end if end >= 0 else len(self.data)]
+
+    def close(self):
+        if self.data is not None:
+            self.data.close()
+            self.data = None
+
+
+def siteKeys(sites: List[str]):
+    """64-bit keys of 'chr\tpos\tref' strings."""
+    import numpy as np
+    import pandas as pd
+
+    return pd.util.hash_array(np.asarray(sites, dtype=object))
+
+
+def indexBatch(data: bytes, base: int):
+    """(keys, offsets) of the variant lines of `data`, complete lines starting `base` bytes into the decompressed file."""
+    import numpy as np
+    import pandas as pd
+
+    newlines = np.flatnonzero(np.frombuffer(data, dtype=np.uint8) == ord('\n'))
+    starts = np.concatenate(([0], newlines[:-1] + 1)).astype(np.int64) + base
+    fields = pd.Series(data.decode().split('\n')[:-1], dtype=object).str.split('\t', n=6, expand=True)
+
+    # Lines with fewer than six fields carry no carriers.
+    if fields.shape[1] < 6:
+        return np.empty(0, dtype=np.uint64), np.empty(0, dtype=np.int64)
+
+    valid = fields[5].notna().to_numpy()
+    fields = fields[valid]
+    sites = fields[0].str.strip() + '\t' + fields[1].str.strip() + '\t' + fields[2].str.strip()
+
+    return siteKeys(sites.tolist()), starts[valid]
+
+
+class VariantIndex():
+    """Metadata kept in memory and the chromosome files indexed between queries.
+
+    Only a 64-bit key of (chr, pos, ref), the file and the offset of every
+    chromosome line are kept, in sorted numpy arrays of 20 bytes per line; the
+    carriers are read from the files when a variant is queried, so genome-wide
+    file sets can be served. The metadata, one line per sample, is kept as text.
+    """
+
+    def __init__(self, metaFile: Path, chrFiles: List[Path], spillDir: Union[Path, None] = None):
+        self.metaFile = metaFile
+        self.chrFiles = list(chrFiles)
+        self.spillDir = spillDir
+        self.spill = None
+        self.samples: List[Tuple[str, str, str]] = []
+        self.lineFiles: List[LineFile] = []
+        self.keys = self.files = self.offsets = None
+        self.sites = 0
+        # Cached per index, a cache on the method would be shared by all indexes and keep them alive.
+        self.findPhenotype = lru_cache(maxsize=1024)(self.matchPhenotype)
+
+    def load(self):
+        # numpy and pandas are imported here, `serve --help` and the clients do not need them.
+        import numpy as np
+
+        with openText(self.metaFile) as f:
+            for line in f:
+                data = tuple(x.strip() for x in line.split('\t'))
+                self.samples.append((line.lower(), data[0], data[3] if len(data) > 3 else ''))
+
+        keys, files, offsets = [], [], []
+
+        for number, path in enumerate(self.chrFiles):
+            if detect_format(path) in ('gzip', 'zstd') and self.spill is None:
+                self.spill = tempfile.TemporaryDirectory(prefix='ngs-index-', dir=self.spillDir)
+
+            lineFile = LineFile(path, self.spill.name if self.spill else None)
+            position, pending, size = 0, [], 0
+
+            for block in itertools.chain(lineFile.blocks(), [None]):
+                if block is not None:
+                    pending.append(block)
+                    size += len(block)
+
+                    if size < INDEX_BATCH:
+                        continue
+                else:
+                    # The end of the file ends a last line without a newline.
+                    pending.append(b'\n')
+
+                # Complete lines only, the rest waits for the next blocks.
+                data = b''.join(pending)
+                end = data.rfind(b'\n') + 1
+                batchKeys, batchOffsets = indexBatch(data[:end], position)
+                keys.append(batchKeys)
+                offsets.append(batchOffsets)
+                files.append(np.full(len(batchKeys), number, dtype=np.int32))
+                position, pending, size = position + end, [data[end:]], len(data) - end
+
+            lineFile.open()
+            self.lineFiles.append(lineFile)
+
+        self.keys = np.concatenate(keys) if keys else np.empty(0, dtype=np.uint64)
+        # A stable sort keeps the lines of a site in file order, later lines overwrite earlier carriers as before.
+        order = np.argsort(self.keys, kind='stable')
+        self.keys = self.keys[order]
+        self.files = (np.concatenate(files) if files else np.empty(0, dtype=np.int32))[order]
+        self.offsets = (np.concatenate(offsets) if offsets else np.empty(0, dtype=np.int64))[order]
+        self.sites = int(np.count_nonzero(np.diff(self.keys)) + 1) if len(self.keys) else 0
+
+        self.findPhenotype.cache_clear()
+
+        return self
+
+    def close(self):
+        for lineFile in self.lineFiles:
+            lineFile.close()
+
+        if self.spill is not None:
+            self.spill.cleanup()
+
+    def lines(self, chr: str, pos: str, ref: str) -> Iterator[Tuple[str, ...]]:
+        """The stripped fields of the lines at chr, pos and ref, in file order."""
+        key = siteKeys([f'{chr}\t{pos}\t{ref}'])[0]
+        first, last = self.keys.searchsorted(key, 'left'), self.keys.searchsorted(key, 'right')
+
+        for number, offset in zip(self.files[first:last].tolist(), self.offsets[first:last].tolist()):
+            data = tuple(x.strip() for x in self.lineFiles[number].line(offset).decode().split('\t'))
+
+            # Another site with the same key.
+            if data[:3] == (chr, pos, ref):
+                yield data
+
+    def matchPhenotype(self, phenotype: str) -> Tuple[Tuple[str, str], ...]:
+        phenotype = phenotype.lower()
+        return tuple((pid, other) for text, pid, other in self.samples if phenotype in text)
+
+    def findPhenotypes(self, phenotypes: List[str]) -> Phenotypes:
+        return {phenotype: list(self.findPhenotype(phenotype)) for phenotype in dict.fromkeys(phenotypes)}
+
+    def findVariant(self, chr: str, pos: str, ref: str, alt: str) -> Chromosomes:
+        found = {}
+
+        for alts, zygosities, ids in (data[3:6] for data in self.lines(chr, pos, ref)):
+            if alt not in alts.split(','):
+                continue
+
+            zygosities = tuple(x for x in zygosities.split(';') if x)
+            ids = tuple(x for x in ids.split(';') if x)
+
+            for zygosity, id in zip(zygosities, ids):
+                found[id] = 'het' if '0' in zygosity else 'hom'
+
+        return found
+
+    def query(self, chr: str, pos: str, ref: str, alt: str, phenotypes: List[str]) -> Dict[str, Any]:
+        phenotypes = self.findPhenotypes(phenotypes)
+        chromosomes = self.findVariant(chr, pos, ref, alt)
+
+        return {'phenotypes': phenotypes,
+                'chromosomes': chromosomes,
+                'result': computeFrequencies(phenotypes, chromosomes)}
+
+
+def isLoopback(host: str) -> bool:
+    if host == 'localhost':
+        return True
+
+    try:
+        return ipaddress.ip_address(host).is_loopback
+    except ValueError:
+        return False
+
+
+class QueryService():
+    """Serves variant -> phenotype frequency queries over HTTP.
+
+    The service listens on a TCP port of a loopback address or on a Unix socket and
+    answers `GET /query?chr=&pos=&ref=&alt=&phenotypes=a,b` with the same
+    numbers as `AsyncSearch.run`, and `GET /health` once the index is loaded.
+    """
+
+    def __init__(self, index: VariantIndex, host: str = '127.0.0.1', port: int = 8765, unixSocket: Path = None):
+        if not isLoopback(host):
+            raise ValueError(f'the query service only listens on localhost, not on {host}')
+
+        self.index = index
+        self.host = host
+        self.port = port
+        self.unixSocket = unixSocket
+        self.server = None
+        self.loop = None
+        self.thread = None
+        self.ready = threading.Event()
+        # Why the server could not start, raised again by start().
+        self.error = None
+
+    @property
+    def address(self) -> str:
+        if self.unixSocket:
+            return f'unix:{self.unixSocket}'
+
+        return f'http://{self.host}:{self.port}'
+
+    async def handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            request = await reader.readline()
+
+            while (await reader.readline()) not in (b'\r\n', b'\n', b''):
+                pass
+
+            try:
+                method, target, _ = request.decode('latin-1').split(' ', 2)
+            except ValueError:
+                return await self.respond(writer, 400, {'error': 'malformed request'})
+
+            url = urllib.parse.urlsplit(target)
+            params = dict(urllib.parse.parse_qsl(url.query))
+
+            if method != 'GET':
+                await self.respond(writer, 405, {'error': f'{method} is not supported'})
+            elif url.path == '/health':
+                await self.respond(writer, 200, {'status': 'ok', 'samples': len(self.index.samples), 'variants': self.index.sites})
+            elif url.path == '/query':
+                missing = [x for x in ('chr', 'pos', 'ref', 'alt', 'phenotypes') if not params.get(x)]
+
+                if missing:
+                    return await self.respond(writer, 400, {'error': f'missing parameters: {", ".join(missing)}'})
+
+                result = await asyncio.get_running_loop().run_in_executor(
+                    None, self.index.query,
+                    params['chr'], params['pos'], params['ref'], params['alt'], params['phenotypes'].split(','))
+
+                await self.respond(writer, 200, result)
+            else:
+                await self.respond(writer, 404, {'error': f'{url.path} not found'})
+        finally:
+            writer.close()
+
+    async def respond(self, writer: asyncio.StreamWriter, status: int, body: Dict[str, Any]):
+        payload = json.dumps(body).encode()
+        writer.write(f'HTTP/1.1 {status} {http.client.responses[status]}\r\n'
+                     f'Content-Type: application/json\r\n'
+                     f'Content-Length: {len(payload)}\r\n'
+                     f'Connection: close\r\n\r\n'.encode('latin-1') + payload)
+        await writer.drain()
+
+    async def serve(self):
+        try:
+            if self.unixSocket:
+                self.server = await asyncio.start_unix_server(self.handle, path=str(self.unixSocket))
+            else:
+                self.server = await asyncio.start_server(self.handle, self.host, self.port)
+                self.port = self.server.sockets[0].getsockname()[1]
+
+            self.loop = asyncio.get_running_loop()
+        except Exception as e:
+            self.error = e
+            raise
+        finally:
+            # Also set when the bind failed, so start() does not wait forever.
+            self.ready.set()
+
+        async with self.server:
+            try:
+                await self.server.serve_forever()
+            except asyncio.CancelledError:
+                pass
+
+    def serveInThread(self):
+        try:
+            asyncio.run(self.serve())
+        except Exception as e:
+            # Kept for start(), which raises it in the calling thread.
+            self.error = self.error or e
+
+    def start(self, timeout: float = 30) -> 'QueryService':
+        """Serve from a daemon thread, e.g. from a test harness with port=0.
+
+        Raises the error of the bind (e.g. the port is in use) and TimeoutError
+        when the server is not listening after `timeout` seconds.
+        """
+        self.thread = threading.Thread(target=self.serveInThread, daemon=True)
+        self.thread.start()
+
+        if not self.ready.wait(timeout):
+            raise TimeoutError(f'the query service did not start listening on {self.address} in {timeout} seconds')
+
+        if self.error is not None:
+            self.thread.join()
+            raise self.error
+
+        return self
+
+    def stop(self):
+        if self.loop is not None:
+            self.loop.call_soon_threadsafe(self.server.close)
+
+        if self.thread is not None:
+            self.thread.join()
+
+
+class UnixHTTPConnection(http.client.HTTPConnection):
+    def __init__(self, path: str, timeout: float = None):
+        super().__init__('localhost', timeout=timeout)
+        self.path = path
+
+    def connect(self):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.settimeout(self.timeout)
+        self.sock.connect(self.path)
+
+
+class QueryClient():
+    def __init__(self, address: str, timeout: float = 60):
+        self.address = address
+        self.timeout = timeout
+
+    def connection(self) -> http.client.HTTPConnection:
+        if self.address.startswith('unix:'):
+            return UnixHTTPConnection(self.address[len('unix:'):], timeout=self.timeout)
+
+        url = urllib.parse.urlsplit(self.address)
+        return http.client.HTTPConnection(url.hostname, url.port, timeout=self.timeout)
+
+    def get(self, path: str, **params) -> Dict[str, Any]:
+        connection = self.connection()
+
+        try:
+            connection.request('GET', f'{path}?{urllib.parse.urlencode(params)}' if params else path)
+            response = connection.getresponse()
+            body = json.loads(response.read())
+        finally:
+            connection.close()
+
+        if response.status != 200:
+            raise RuntimeError(f'query service answered {response.status}: {body.get("error")}')
+
+        return body
+
+    def health(self) -> Dict[str, Any]:
+        return self.get('/health')
+
+    def query(self, chr: str, pos: str, ref: str, alt: str, phenotypes: str) -> Dict[str, Any]:
+        """Returns the same dictionary `AsyncSearch` hands to its finish callback."""
+        body = self.get('/query', chr=chr, pos=pos, ref=ref, alt=alt, phenotypes=phenotypes)
+
+        result = {phenotype: tuple(items) for phenotype, items in body['result'].items()}
+        result['phenotypes'] = {phenotype: [tuple(pid) for pid in pids] for phenotype, pids in body['phenotypes'].items()}
+        result['chromosomes'] = body['chromosomes']
+
+        return result
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser()
+    parser.add_argument('metadata', help="Path to metadata file")
+    parser.add_argument('chromosomes', nargs='+', help="One or more chromosomes files, directories or globs of per chromosome files")
+    parser.add_argument('--port', type=int, default=8765, help="Port to listen on, on 127.0.0.1")
+    parser.add_argument('--unix-socket', help="Listen on a Unix socket instead of a TCP port")
+    args = parser.parse_args(argv)
+
+    index = VariantIndex(args.metadata, [path for spec in args.chromosomes for path in expand_paths(spec)]).load()
+    print(f'Loaded {len(index.samples)} samples and {index.sites} variants')
+
+    service = QueryService(index, port=args.port, unixSocket=args.unix_socket)
+
+    try:
+        asyncio.run(service.serve())
+    except KeyboardInterrupt:
+        pass
+    finally:
+        index.close()
+
+if __name__ == "__main__":
+    main()
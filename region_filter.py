@@ -0,0 +1,131 @@
+import pathlib
+import re
+from functools import lru_cache
+
+import numpy as np
+import pandas as pd
+
+from typing import Dict, FrozenSet, Iterable, Tuple, Union
+
+from compressed_io import iter_lines
+
+Path = Union[str, pathlib.Path]
+
+# ANNOVAR lists the genes of overlapping transcripts as GENE1;GENE2.
+GENE_SEPARATOR = ';'
+CHR_PREFIX = re.compile(r'^chr', re.IGNORECASE)
+
+
+def normalize_chr(chr: str) -> str:
+    """'chr11', 'Chr11' and '11' are the same chromosome."""
+    return CHR_PREFIX.sub('', chr.strip())
+
+
+def read_panel(path: Path) -> FrozenSet[str]:
+    """Gene names of a panel file, separated by newlines, commas, tabs or spaces; '#' starts a comment."""
+    genes = set()
+
+    for line in iter_lines(path):
+        genes.update(x for x in re.split(r'[\s,]+', line.split('#', 1)[0]) if x)
+
+    return frozenset(genes)
+
+
+def read_bed(path: Path) -> Iterable[Tuple[str, int, int]]:
+    """(chromosome, start, end) of every region of a BED file, 0-based and end exclusive."""
+    for line in iter_lines(path):
+        fields = line.split()
+
+        if len(fields) < 3 or fields[0] in ('track', 'browser') or fields[0].startswith('#'):
+            continue
+
+        yield normalize_chr(fields[0]), int(fields[1]), int(fields[2])
+
+
+def merge_intervals(starts: np.ndarray, ends: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """Sorted, disjoint intervals covering the same positions as the given ones."""
+    order = np.argsort(starts, kind='stable')
+    starts, ends = starts[order], np.maximum.accumulate(ends[order])
+
+    # A new interval begins where a start lies past every earlier end.
+    first = np.ones(len(starts), dtype=bool)
+    first[1:] = starts[1:] > ends[:-1]
+    last = np.append(first[1:], True)
+
+    return starts[first], ends[last]
+
+
+class RegionFilter():
+    """A gene panel and a set of target regions, the rows of a chunk outside both are pruned while reading.
+
+    The panel is a set of gene names matched against `Gene.refGene`, the
+    regions are merged into sorted disjoint intervals per chromosome, so a row
+    is checked with a hash lookup and a binary search however large the panel
+    or the BED file is. A row is kept when it is on a panel gene or overlaps a
+    target region.
+    """
+
+    def __init__(self, genes: Union[FrozenSet[str], None] = None, intervals: Union[Dict[str, Tuple[np.ndarray, np.ndarray]], None] = None):
+        self.genes = genes
+        self.intervals = intervals
+
+    @classmethod
+    def from_files(cls, panel: Union[Path, None] = None, bed: Union[Path, None] = None) -> 'RegionFilter':
+        intervals = None
+
+        if bed is not None:
+            regions = pd.DataFrame(read_bed(bed), columns=['Chr', 'Start', 'End'])
+            intervals = {chr: merge_intervals(group['Start'].to_numpy(dtype=np.int64), group['End'].to_numpy(dtype=np.int64))
+                         for chr, group in regions.groupby('Chr', sort=False)}
+
+        return cls(read_panel(panel) if panel is not None else None, intervals)
+
+    def gene_mask(self, df: pd.DataFrame) -> np.ndarray:
+        if 'Gene.refGene' not in df.columns:
+            return np.zeros(len(df), dtype=bool)
+
+        genes = df['Gene.refGene'].astype(object)
+        mask = genes.isin(self.genes).to_numpy()
+        several = np.flatnonzero(genes.str.contains(GENE_SEPARATOR, regex=False).fillna(False).to_numpy(dtype=bool) & ~mask)
+
+        if len(several):
+            split = genes.iloc[several].str.split(GENE_SEPARATOR).explode()
+            mask[several] = split.isin(self.genes).groupby(level=0, sort=False).any().reindex(genes.index[several]).to_numpy()
+
+        return mask
+
+    def region_mask(self, df: pd.DataFrame) -> np.ndarray:
+        mask = np.zeros(len(df), dtype=bool)
+        chrs = df['Chr'].astype(str).str.replace(CHR_PREFIX, '', regex=True).to_numpy()
+        # ANNOVAR positions are 1-based and inclusive, BED regions 0-based and end exclusive.
+        start = pd.to_numeric(df['Start'], errors='coerce').to_numpy(dtype=np.float64, na_value=np.nan)
+        end = pd.to_numeric(df['End'], errors='coerce').to_numpy(dtype=np.float64, na_value=np.nan)
+
+        for chr in pd.unique(chrs):
+            if chr not in self.intervals:
+                continue
+
+            rows = np.flatnonzero((chrs == chr) & ~np.isnan(start) & ~np.isnan(end))
+            starts, ends = self.intervals[chr]
+            # The last region starting before the variant ends is the only one that can overlap it.
+            candidate = np.searchsorted(starts, end[rows], side='left') - 1
+            mask[rows] = (candidate >= 0) & (ends[np.maximum(candidate, 0)] >= start[rows])
+
+        return mask
+
+    def mask(self, df: pd.DataFrame) -> np.ndarray:
+        mask = np.zeros(len(df), dtype=bool)
+
+        if self.genes is not None:
+            mask |= self.gene_mask(df)
+
+        if self.intervals is not None:
+            mask |= self.region_mask(df)
+
+        return mask
+
+
+@lru_cache(maxsize=4)
+def open_regions(panel: Union[str, None], bed: Union[str, None]) -> RegionFilter:
+    """One compiled filter per panel and BED file and process."""
+    return RegionFilter.from_files(panel, bed)
@@ -0,0 +1,101 @@
+import hashlib
+import json
+import os
+import pathlib
+import time
+
+import pandas as pd
+
+from typing import Any, Dict, Union
+
+Path = Union[str, pathlib.Path]
+
+# Bumped whenever a change to the filters or report sections makes stored results stale.
+STORE_VERSION = 3
+BLOCK_SIZE = 1 << 20
+
+
+def file_hash(path: Path, block_size: int = BLOCK_SIZE) -> str:
+    digest = hashlib.sha256()
+
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(block_size), b''):
+            digest.update(block)
+
+    return digest.hexdigest()
+
+
+def hash_key(*parts: Any) -> str:
+    """Hashes the dependencies of a stored result into its key."""
+    data = json.dumps([STORE_VERSION, *parts], sort_keys=True, default=str)
+    return hashlib.sha256(data.encode()).hexdigest()
+
+
+class RunStore():
+    """Keeps the intermediate results of family analyses between runs.
+
+    Every result is stored per family under a name together with the key of its
+    dependencies; a result is only returned while the key still matches. When
+    the store grows over `max_size` MB the least recently used results are
+    evicted.
+    """
+
+    def __init__(self, root: Path, max_size: Union[int, None] = None):
+        self.root = pathlib.Path(root)
+        self.root.mkdir(parents=True, exist_ok=True)
+        self.max_size = None if max_size is None else max_size * 1024 * 1024
+        self.index_path = self.root / 'index.json'
+        self.index: Dict[str, Dict[str, Any]] = {}
+
+        if self.index_path.exists():
+            with open(self.index_path) as f:
+                self.index = json.load(f)
+
+    def path(self, family: str, name: str) -> pathlib.Path:
+        return self.root / family / f'{name}.pkl'
+
+    def get(self, family: str, name: str, key: str) -> Any:
+        entry = self.index.get(f'{family}/{name}')
+
+        if entry is None or entry['key'] != key:
+            return None
+
+        path = self.path(family, name)
+
+        if not path.exists():
+            del self.index[f'{family}/{name}']
+            return None
+
+        entry['used'] = time.time()
+        return pd.read_pickle(path)
+
+    def put(self, family: str, name: str, key: str, value: Any):
+        path = self.path(family, name)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        pd.to_pickle(value, path)
+
+        self.index[f'{family}/{name}'] = {'key': key, 'size': path.stat().st_size, 'used': time.time()}
+        self.evict()
+
+    def evict(self):
+        if self.max_size is None:
+            return
+
+        total = sum(entry['size'] for entry in self.index.values())
+
+        for name, entry in sorted(self.index.items(), key=lambda x: x[1]['used']):
+            if total <= self.max_size:
+                break
+
+            family, _, result = name.partition('/')
+            self.path(family, result).unlink(missing_ok=True)
+            total -= entry['size']
+            del self.index[name]
+
+    def flush(self):
+        temporary = self.index_path.with_suffix('.tmp')
+
+        with open(temporary, 'w') as f:
+            json.dump(self.index, f)
+
+        os.replace(temporary, self.index_path)
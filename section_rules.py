@@ -0,0 +1,216 @@
+import numpy as np
+import pandas as pd
+
+from typing import Any, Callable, Dict, Hashable, List, NamedTuple, Tuple, Union
+
+from compound_het import CompoundHet
+from genotype_matrix import GenotypeMatrix, zygosity_flag
+from group_index import GroupIndex
+from variant_key import duplicated, joint_keys
+
+Section = Tuple[pd.DataFrame, str]
+
+FUNCTION_COLUMNS = ['ExonicFunc.refGene', 'ExonicFunc.ensGene', 'ExonicFunc.knownGene', 'Func.refGene', 'Function_description']
+
+
+class SectionRule(NamedTuple):
+    """A report section described as data.
+
+    The rule runs on every frame of `sources` ('normal' and/or 'path') and the
+    rows kept from several sources are combined. Rows are first grouped on `key`
+    ('variant', 'site' which is variant without Zygosity, 'gene' or 'row') and
+    the whole group is kept when every group condition holds, then the row
+    conditions are applied to the rows of the kept groups.
+    """
+    name: str
+    label: str
+    sources: Tuple[str, ...] = ('normal',)
+    key: Union[str, None] = None
+
+    # Group conditions.
+    present: Tuple[str, ...] = ()                 # parents that all have a row in the group
+    present_any: Tuple[str, ...] = ()             # parents of which at least one has a row in the group
+    absent: Tuple[str, ...] = ()                  # parents without a row in the group
+    genotypes: Tuple[Tuple[str, str], ...] = ()   # the group is exactly one row per (parent, zygosity), parents are distinct
+    size: Union[int, None] = None                 # number of rows in the group, of `size_of` parents if given
+    size_of: Tuple[str, ...] = ()
+    test: Union[str, None] = None                 # one of TESTS
+
+    # Row conditions.
+    parents: Tuple[str, ...] = ()                 # rows of these parents only
+    zygosity: Union[str, None] = None
+    omim: Union[str, None] = None                 # 'AD', 'AR' or 'zygosity' for het in AD and hom in AR genes
+    exceptions: bool = False                      # only variants whose function is one of gene_exceptions
+    exclude_intronic: bool = False
+    exclude_rows_of: Tuple[str, ...] = ()         # leave out rows equal in every column to rows of these sections
+    distinct: Tuple[str, ...] = ()                # drop duplicate rows on these columns
+
+
+def compound_gene(index: GroupIndex, columns: List[str], keys: Dict[str, List[str]]) -> np.ndarray:
+    """Groups in which the father and the mother both carry a variant the other parent does not carry."""
+    groups = index.groups(columns)
+    engine = CompoundHet(groups.codes, groups.count, joint_keys([index.df], keys['allele'])[0])
+
+    return engine.compound(index.equals('Parent', 'father'), index.equals('Parent', 'mother'))
+
+
+def phased_compound(index: GroupIndex, columns: List[str], keys: Dict[str, List[str]]) -> np.ndarray:
+    """Groups in which the child is het for a variant of the father only and for another of the mother only."""
+    groups = index.groups(columns)
+    engine = CompoundHet(groups.codes, groups.count, joint_keys([index.df], keys['allele'])[0])
+    child = index.equals('Parent', 'child') & index.equals('Zygosity', 'het')
+
+    return engine.phased(child, index.equals('Parent', 'father'), index.equals('Parent', 'mother'))
+
+
+def hom_then_het(index: GroupIndex, columns: List[str], keys: Dict[str, List[str]]) -> np.ndarray:
+    """Groups whose first row is hom and second row is het, with the rows ordered by parent."""
+    groups = index.groups(columns)
+    parents, _ = index.column('Parent')
+    first_hom, first = groups.nth(index.equals('Zygosity', 'hom'), 0, parents)
+    second_het, second = groups.nth(index.equals('Zygosity', 'het'), 1, parents)
+
+    return first & second & first_hom & second_het
+
+
+TESTS: Dict[str, Callable[[GroupIndex, List[str], Dict[str, List[str]]], np.ndarray]] = {
+    'compound': compound_gene,
+    'phased_compound': phased_compound,
+    'hom_then_het': hom_then_het,
+}
+
+
+def group_conditions(rule: SectionRule) -> Tuple:
+    return (rule.key, rule.present, rule.present_any, rule.absent, rule.genotypes, rule.size, rule.size_of, rule.test)
+
+
+def uses_omim(rule: SectionRule, rules: Dict[str, SectionRule]) -> bool:
+    return rule.omim is not None or any(uses_omim(rules[x], rules) for x in rule.exclude_rows_of)
+
+
+class RulePlanner():
+    """Evaluates a rule set in one pass over the grouped frames.
+
+    Every frame is indexed once and every subexpression (parent and zygosity
+    masks, the genotype matrix of a grouping key, OMIM modes, the rows of a rule)
+    is computed once and shared by all rules that use it. The group conditions
+    are comparisons across the member columns of the genotype matrix.
+    """
+
+    def __init__(self, rules: List[SectionRule], frames: Dict[str, pd.DataFrame], keys: Dict[str, List[str]],
+                 members: List[str], gene_exceptions: List[str], concat: Callable[[List[pd.DataFrame]], pd.DataFrame],
+                 omim: Union[Dict[str, str], None] = None):
+        self.rules = {rule.name: rule for rule in rules}
+        self.frames = frames
+        self.members = list(members)
+        self.indexes = {name: GroupIndex(df) for name, df in frames.items()}
+        self.keys = dict(keys)
+        self.gene_exceptions = gene_exceptions
+        self.concat = concat
+        self.omim = omim
+        self.memo: Dict[Hashable, Any] = {}
+
+    def memoized(self, key: Hashable, compute: Callable[[], Any]) -> Any:
+        if key not in self.memo:
+            self.memo[key] = compute()
+
+        return self.memo[key]
+
+    def columns(self, source: str, key: str) -> List[str]:
+        return list(self.frames[source].columns) if key == 'row' else self.keys[key]
+
+    def matrix(self, source: str, key: str) -> GenotypeMatrix:
+        return self.memoized(('matrix', source, key), lambda: GenotypeMatrix(self.indexes[source], self.columns(source, key), self.members))
+
+    def omim_modes(self, source: str) -> np.ndarray:
+        if self.omim is None:
+            raise ValueError('the rule set needs the OMIM inheritance modes')
+
+        return self.memoized(('omim', source), lambda: self.frames[source]['Gene.refGene'].map(self.omim).fillna('AR').to_numpy(dtype=object))
+
+    def text(self, source: str, column: str, value: str) -> np.ndarray:
+        return self.indexes[source].equals(column, value)
+
+    def exception_rows(self, source: str) -> np.ndarray:
+        df = self.frames[source]
+        return self.memoized(('exceptions', source), lambda: np.logical_or.reduce([df[x].isin(self.gene_exceptions).to_numpy(dtype=bool) for x in FUNCTION_COLUMNS]))
+
+    def kept_groups(self, rule: SectionRule, source: str) -> np.ndarray:
+        index = self.indexes[source]
+        columns = self.columns(source, rule.key)
+        matrix = self.matrix(source, rule.key)
+        keep = np.ones(len(matrix.sizes), dtype=bool)
+
+        if rule.present:
+            keep &= matrix.has(*rule.present)
+
+        if rule.present_any:
+            keep &= matrix.has_any(*rule.present_any)
+
+        if rule.absent:
+            keep &= ~matrix.has_any(*rule.absent)
+
+        if rule.genotypes:
+            keep &= matrix.sizes == len(rule.genotypes)
+
+            for parent, zygosity in rule.genotypes:
+                keep &= matrix.genotype(parent, zygosity_flag(zygosity))
+
+        if rule.size is not None:
+            if rule.size_of:
+                keep &= sum(matrix.count(parent) for parent in rule.size_of) == rule.size
+            else:
+                keep &= matrix.sizes == rule.size
+
+        if rule.test is not None:
+            keep &= self.memoized(('test', source, rule.key, rule.test), lambda: TESTS[rule.test](index, columns, self.keys))
+
+        return matrix.groups.rows(keep)
+
+    def rows(self, rule: SectionRule, source: str) -> np.ndarray:
+        """The rows of `source` kept by `rule`."""
+        def compute():
+            mask = np.ones(len(self.frames[source]), dtype=bool)
+
+            if rule.key is not None:
+                mask &= self.memoized(('groups', source, group_conditions(rule)), lambda: self.kept_groups(rule, source))
+
+            if rule.parents:
+                mask &= np.logical_or.reduce([self.text(source, 'Parent', parent) for parent in rule.parents])
+
+            if rule.zygosity is not None:
+                mask &= self.text(source, 'Zygosity', rule.zygosity)
+
+            if rule.omim == 'zygosity':
+                modes = self.omim_modes(source)
+                mask &= (self.text(source, 'Zygosity', 'het') & (modes == 'AD')) | (self.text(source, 'Zygosity', 'hom') & (modes == 'AR'))
+            elif rule.omim is not None:
+                mask &= self.omim_modes(source) == rule.omim
+
+            if rule.exceptions:
+                mask &= self.exception_rows(source)
+
+            if rule.exclude_intronic:
+                mask &= ~self.text(source, 'Func.refGene', 'intronic')
+
+            if rule.exclude_rows_of:
+                groups = self.indexes[source].groups(self.columns(source, 'row'))
+                excluded = np.logical_or.reduce([self.rows(self.rules[x], source) for x in rule.exclude_rows_of])
+                mask &= ~groups.rows(groups.has(excluded))
+
+            return mask
+
+        return self.memoized(('rows', rule.name, source), compute)
+
+    def section(self, rule: SectionRule) -> pd.DataFrame:
+        parts = [self.frames[source][self.rows(rule, source)] for source in rule.sources]
+        df = parts[0] if len(parts) == 1 else self.concat(parts)
+
+        if rule.distinct:
+            df = df[~duplicated(joint_keys([df], rule.distinct)[0])]
+
+        return df
+
+    def evaluate(self, names: Union[List[str], None] = None) -> Dict[str, Section]:
+        names = list(self.rules) if names is None else names
+        return {name: (self.section(self.rules[name]), self.rules[name].label) for name in names}
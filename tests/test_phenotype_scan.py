@@ -0,0 +1,63 @@
+import json
+import pathlib
+
+import pytest
+
+from chr_scan import ChromosomeFiles
+from filter_meta_data import MetaDataParser, findVariants
+from phenotype_scan import ScanTable
+from query_service import computeFrequencies
+
+PHENOTYPES = ['Asthma', 'Cancer']
+METADATA = [
+    ('S1', 'Asthma'),
+    ('S2', 'Cancer'),
+    ('S16', 'Asthma;Cancer'),
+    ('S4', 'asthma'),
+]
+# chr, pos, ref, alts, zygosities, ids; samples listed twice on a line keep their last zygosity.
+CHROMOSOMES = [
+    ('chr11', '1000', 'A', 'G', '2/2;0/2;', 'S16;S16;'),
+    ('chr11', '1100', 'A', 'G', '0/1;1/1;0/1;', 'S1;S1;S2;'),
+    ('chr11', '1200', 'C', 'T,G', '0/1;1/1;0/2;', 'S16;S4;S16;'),
+    ('chr11', '1200', 'C', 'T', '1/1;1/1;', 'S2;S2;'),
+    ('chr11', '1300', 'G', 'A', '0/1;0/1;', 'S1;S4;'),
+]
+DATA = pathlib.Path(__file__).parent / 'data'
+VARIANTS = [('chr11', '1000', 'A', 'G'), ('chr11', '1100', 'A', 'G'), ('chr11', '1200', 'C', 'T'),
+            ('chr11', '1200', 'C', 'G'), ('chr11', '1300', 'G', 'A')]
+
+
+@pytest.fixture
+def inputs(tmp_path):
+    metaFile, chrFile = tmp_path / 'meta.txt', tmp_path / 'chr11.txt'
+    metaFile.write_text(''.join(f'{pid}\tx\ty\t{phenotypes}\n' for pid, phenotypes in METADATA))
+    chrFile.write_text(''.join('\t'.join(line) + '\n' for line in CHROMOSOMES))
+
+    return metaFile, chrFile
+
+
+@pytest.mark.parametrize('variant', VARIANTS)
+def test_counts_match_compute_frequencies(inputs, tmp_path, variant):
+    metaFile, chrFile = inputs
+    table = ScanTable.build(metaFile, chrFile, 'chr11', PHENOTYPES, tmp_path / 'table')
+
+    found = findVariants(ChromosomeFiles(chrFile), [variant])[0]
+    expected = computeFrequencies(MetaDataParser(metaFile, PHENOTYPES).run(), found)
+    result = table.query(*variant, PHENOTYPES)
+
+    for phenotype in PHENOTYPES:
+        assert result[phenotype][:3] == pytest.approx(expected[phenotype][:3])
+
+
+def test_counts_match_the_original_counts(tmp_path):
+    # (freq, nHet, nHom) of every variant of tests/data/scan, as filter_meta_data.py computed them before the scan.
+    expected = json.loads((DATA / 'baseline' / 'scan.json').read_text())
+    phenotypes = list(expected[0][1])
+    table = ScanTable.build(DATA / 'scan' / 'meta.txt', DATA / 'scan' / 'chr11.txt', 'chr11', phenotypes, tmp_path / 'table')
+
+    for variant, counts in expected:
+        result = table.query(*variant, phenotypes)
+
+        for phenotype in phenotypes:
+            assert result[phenotype][:3] == pytest.approx(counts[phenotype])
@@ -0,0 +1,109 @@
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from chr_scan import ChromosomeFiles
+from filter_meta_data import MetaDataParser, findVariants
+from query_service import QueryClient, QueryService, VariantIndex, computeFrequencies
+
+CLIENTS = 16
+# A small cohort: sample, two unused columns, phenotypes.
+METADATA = [
+    ('S1', 'Asthma;Diabetes'),
+    ('S2', 'Cancer'),
+    ('S3', 'Asthma'),
+    ('S4', 'Obesity;Cancer'),
+    ('S5', 'asthma;Cancer'),
+]
+# chr, pos, ref, alts, zygosities, ids; the second line of 1000 lists more carriers of the same site.
+CHROMOSOMES = [
+    ('chr11', '1000', 'A', 'G,T', '0/1;1/1;0/2;', 'S1;S2;S3;'),
+    ('chr11', '1000', 'A', 'G', '1/1;', 'S5;'),
+    ('chr11', '2000', 'C', 'T', '0/1;0/1;', 'S4;S1;'),
+]
+QUERIES = [
+    ('chr11', '1000', 'A', 'G', ['Asthma', 'Cancer']),
+    ('chr11', '1000', 'A', 'T', ['Asthma']),
+    ('chr11', '2000', 'C', 'T', ['Asthma', 'Cancer', 'Obesity']),
+    ('chr11', '3000', 'C', 'T', ['Asthma']),
+    ('chr11', '2000', 'C', 'T', ['Unknown']),
+]
+
+
+@pytest.fixture
+def inputs(tmp_path):
+    metaFile, chrFile = tmp_path / 'meta.txt', tmp_path / 'chr11.txt'
+    metaFile.write_text(''.join(f'{pid}\tx\ty\t{phenotypes}\n' for pid, phenotypes in METADATA))
+    chrFile.write_text(''.join('\t'.join(line) + '\n' for line in CHROMOSOMES))
+
+    return metaFile, chrFile
+
+
+@pytest.fixture
+def index(inputs):
+    metaFile, chrFile = inputs
+    index = VariantIndex(metaFile, [chrFile]).load()
+    yield index
+    index.close()
+
+
+def expected_results(metaFile, chrFile) -> list:
+    """The frequencies of every query, from a search of the files as `filter_meta_data.py` does it."""
+    results = []
+
+    for chr, pos, ref, alt, phenotypes in QUERIES:
+        found = findVariants(ChromosomeFiles(chrFile), [(chr, pos, ref, alt)])[0]
+        result = computeFrequencies(MetaDataParser(metaFile, phenotypes).run(), found)
+        # The tuples of computeFrequencies come back from JSON as lists.
+        results.append({phenotype: list(items) for phenotype, items in result.items()})
+
+    return results
+
+
+def answers(client: QueryClient, query) -> dict:
+    chr, pos, ref, alt, phenotypes = query
+    result = client.query(chr, pos, ref, alt, ','.join(phenotypes))
+
+    return {phenotype: list(result[phenotype]) for phenotype in phenotypes}
+
+
+@pytest.mark.parametrize('address', ['tcp', 'unix'])
+def test_service_answers_like_a_search_of_the_files(inputs, index, tmp_path, address):
+    if address == 'tcp':
+        service = QueryService(index, port=0).start()
+    else:
+        service = QueryService(index, unixSocket=tmp_path / 'service.sock').start()
+
+    expected = expected_results(*inputs)
+    client = QueryClient(service.address, timeout=10)
+
+    try:
+        health = client.health()
+        assert (health['samples'], health['variants']) == (len(METADATA), index.sites)
+        assert [answers(client, query) for query in QUERIES] == expected
+
+        # The same queries from many clients at once must give the same answers.
+        with ThreadPoolExecutor(max_workers=CLIENTS) as executor:
+            assert list(executor.map(lambda query: answers(client, query), QUERIES * CLIENTS)) == expected * CLIENTS
+    finally:
+        service.stop()
+
+    assert not service.thread.is_alive()
+
+    with pytest.raises(OSError):
+        QueryClient(service.address, timeout=2).health()
+
+
+def test_busy_port_fails_to_start(index):
+    busy = QueryService(index, port=0).start()
+
+    try:
+        with pytest.raises(OSError):
+            QueryService(index, port=busy.port).start(timeout=10)
+    finally:
+        busy.stop()
+
+
+def test_only_loopback_hosts(index):
+    with pytest.raises(ValueError):
+        QueryService(index, host='0.0.0.0')
@@ -0,0 +1,155 @@
+import json
+import math
+import pathlib
+
+import pandas as pd
+import pytest
+
+from family_api import analyse_family
+from filter_all import FatherMotherChildParser, FatherMotherParser, MotherChildParser
+
+# Columns the family analyses read; the synthetic members carry nothing else.
+COLUMNS = ['Chr', 'Start', 'End', 'Ref', 'Alt', 'Func.refGene', 'Gene.refGene', 'ExonicFunc.refGene', 'Func.ensGene',
+           'ExonicFunc.ensGene', 'ExonicFunc.knownGene', 'Function_description', 'Het Iranome', 'Hom Iranome', 'Het Our DB',
+           'CLNSIG', 'Zygosity', 'ValueInfo2']
+CHILD_COMPOUND = 'موارد کامپوند در فرزند'
+COMPOUND_GENE = 'ژن مشترک برای احتمال کامپوند'
+
+DATA = pathlib.Path(__file__).parent / 'data'
+# Parser and input files of every mode, tests/data/family holds the synthetic members.
+MODES = {
+    'father_mother': (FatherMotherParser, ['mother_gene', 'father_gene', 'mother_path', 'father_path']),
+    'mother_child': (MotherChildParser, ['mother_gene', 'child_gene', 'mother_path', 'child_path']),
+    'father_mother_child': (FatherMotherChildParser, ['mother_gene', 'father_gene', 'child_gene', 'mother_path', 'father_path', 'child_path']),
+}
+# The ways of reading and evaluating the inputs that must not change the report.
+OPTIONS = {
+    'default': {},
+    'chunks': {'chunksize': 7},
+    'eager_columns': {'lazy_columns': False},
+    'out_of_core': {'out_of_core': True},
+    'partitions': {'out_of_core': True, 'memory_budget': 0},
+    'jobs': {'jobs': 2},
+    'out_of_core_jobs': {'out_of_core': True, 'jobs': 2},
+}
+REPORT_KEY = ['Parent', 'Chr', 'Start', 'End', 'Ref', 'Alt', 'Gene.refGene']
+ORDER_KEY = ['Gene.refGene', 'Ref', 'Alt']
+
+
+def variant(start: int, gene: str = 'GENE1', zygosity: str = 'het') -> list:
+    """A rare exonic variant that passes the filters of both views."""
+    return ['1', start, start, 'A', 'G', 'exonic', gene, 'nonsynonymous SNV', 'exonic', 'nonsynonymous SNV', '.', '.',
+            '.', '0', '.', 'Pathogenic', zygosity, '0/1:10,10:20:99:0,0,0']
+
+
+def phased_trio() -> dict:
+    """A child het for a variant of the father only and for another of the mother only."""
+    return {'father': pd.DataFrame([variant(100)], columns=COLUMNS),
+            'mother': pd.DataFrame([variant(200)], columns=COLUMNS),
+            'child': pd.DataFrame([variant(100), variant(200)], columns=COLUMNS)}
+
+
+def trio_sections(**options) -> dict:
+    return {label: df for df, label in analyse_family('father_mother_child', phased_trio(), {'GENE1': 'AR'}, **options)}
+
+
+def rows(section: pd.DataFrame) -> list:
+    return section[['Parent', 'Start', 'Gene.refGene']].values.tolist()
+
+
+def test_child_compound_is_off_by_default():
+    sections = trio_sections()
+
+    assert CHILD_COMPOUND not in sections
+    assert rows(sections[COMPOUND_GENE]) == [['father', 100, 'GENE1'], ['mother', 200, 'GENE1'],
+                                             ['child', 100, 'GENE1'], ['child', 200, 'GENE1']]
+
+
+def test_child_compound_section():
+    sections = trio_sections(child_compound=True)
+    labels = list(sections)
+
+    # The gene rows are reported once, in the child compound section that comes first, from both views.
+    assert labels.index(CHILD_COMPOUND) == labels.index(COMPOUND_GENE) - 1
+    assert rows(sections[CHILD_COMPOUND]) == [['father', 100, 'GENE1'], ['mother', 200, 'GENE1'],
+                                              ['child', 100, 'GENE1'], ['child', 200, 'GENE1']] * 2
+    assert sections[COMPOUND_GENE].empty
+
+
+def cell(value) -> str:
+    """A cell as the report shows it, the same for a typed value and its text."""
+    if value is None or value is pd.NA or (isinstance(value, float) and math.isnan(value)):
+        return ''
+
+    try:
+        number = float(value)
+    except (TypeError, ValueError):
+        return str(value)
+
+    return str(int(number)) if number.is_integer() else str(value)
+
+
+def written_report(monkeypatch, tmp_path, mode: str, **options) -> list:
+    """The header and the rows of every section, as save_xlsx writes them."""
+    written = []
+
+    def to_excel(df, writer, sheet_name, header, index, startrow):
+        written.append([str(x) for x in df.columns] if header else [[cell(x) for x in row] for row in df.itertuples(index=False)])
+
+    monkeypatch.setattr(pd.DataFrame, 'to_excel', to_excel)
+    parser, inputs = MODES[mode]
+    files = [DATA / 'family' / f'{name}.csv' for name in inputs]
+    parser(*files, DATA / 'family' / 'omim.txt', tmp_path / 'report.xlsx').configure(**options).run()
+
+    return written
+
+
+def listed_once(report: list) -> list:
+    """The report with every variant in its first section only.
+
+    The original report listed some variants again when two sections held
+    Start as numbers and as text, the typed columns list them once.
+    """
+    header, *sections = report
+    key = [header.index(x) for x in REPORT_KEY]
+    seen = set()
+    listed = [header]
+
+    for rows in sections:
+        listed.append([row for row in rows if tuple(row[x] for x in key) not in seen])
+        seen.update(tuple(row[x] for x in key) for row in rows)
+
+    return listed
+
+
+def same_report(report: list, expected: list) -> bool:
+    """Whether the reports list the same rows in the same order of gene, ref and alt.
+
+    The original report sorted every section with an unstable sort, the order
+    of rows with the same gene, ref and alt is not compared.
+    """
+    header = expected[0]
+    order = [header.index(x) for x in ORDER_KEY]
+
+    return report[0] == header and len(report) == len(expected) and all(
+        sorted(rows) == sorted(expected_rows) and [[row[x] for x in order] for row in rows] == [[row[x] for x in order] for row in expected_rows]
+        for rows, expected_rows in zip(report[1:], expected[1:]))
+
+
+@pytest.mark.parametrize('options', OPTIONS.values(), ids=OPTIONS.keys())
+@pytest.mark.parametrize('mode', MODES)
+def test_report_matches_the_original_report(monkeypatch, tmp_path, mode, options):
+    # Written for the synthetic members by the code before the chunked reads, the section rules, the compound
+    # engine and the out-of-core and parallel modes. The parents of a gene either both carry a variant the other
+    # does not, or they do not share the gene, so the compound rule of either version gives the same genes.
+    expected = json.loads((DATA / 'baseline' / f'{mode}.json').read_text(encoding='utf-8'))
+    report = written_report(monkeypatch, tmp_path, mode, **options)
+
+    assert same_report(listed_once(report), listed_once(expected))
+
+
+@pytest.mark.parametrize('options', [x for name, x in OPTIONS.items() if name != 'default'], ids=[x for x in OPTIONS if x != 'default'])
+@pytest.mark.parametrize('mode', MODES)
+def test_report_order_does_not_depend_on_the_options(monkeypatch, tmp_path, mode, options):
+    # Gene G0 has variants on chr1 and chr2, out of core it is evaluated in the partition of the spanning genes.
+    assert written_report(monkeypatch, tmp_path, mode, **options) == written_report(monkeypatch, tmp_path, mode)
@@ -0,0 +1,55 @@
+import pandas as pd
+import pytest
+
+from variant_schema import parse_genotypes
+from vcf_reader import VcfReader
+
+HEADER = ['##fileformat=VCFv4.2', '##INFO=<ID=Gene.refGene,Number=.,Type=String,Description="">',
+          '#CHROM\tPOS\tID\tREF\tALT\tQUAL\tFILTER\tINFO\tFORMAT\tS1\tS2']
+RECORDS = [
+    # Phased het and hom calls.
+    ('1', '100', 'A', 'G', 'GT:AD:DP', '0|1:7,9:16', '1|1:0,12:12'),
+    # A multi-allelic call, with the fields in another order than GT:AD:DP.
+    ('1', '200', 'C', 'T,G', 'DP:GT:GQ:AD', '30:1/2:99:2,10,18', '25:0/2:99:15,0,10'),
+]
+
+
+@pytest.fixture
+def vcf(tmp_path):
+    path = tmp_path / 'trio.vcf'
+    lines = ['\t'.join([chr, pos, '.', ref, alt, '50', 'PASS', 'Gene.refGene=GENE1', fmt, *samples])
+             for chr, pos, ref, alt, fmt, *samples in RECORDS]
+    path.write_text('\n'.join(HEADER + lines) + '\n')
+
+    return path
+
+
+def genotypes(path, sample):
+    reader = VcfReader(path, sample)
+    columns = reader.columns
+    records = [dict(zip(columns, record)) for record in reader.records()]
+
+    return [(x['Start'], x['Alt'], x['Zygosity'], x['ValueInfo2']) for x in records]
+
+
+def test_phased_and_multi_allelic_calls(vcf):
+    assert genotypes(vcf, 0) == [('100', 'G', 'het', '0/1:7,9:16'), ('200', 'T', 'het', '0/1:2,10:30'),
+                                 ('200', 'G', 'het', '0/1:2,18:30')]
+
+
+def test_sample_by_name(vcf):
+    assert genotypes(vcf, 'S2') == [('100', 'G', 'hom', '1/1:0,12:12'), ('200', 'G', 'het', '0/1:15,10:25')]
+
+
+def test_parse_genotypes_reads_the_allele_depths(vcf):
+    fields = parse_genotypes(pd.Series([x[3] for x in genotypes(vcf, 0)]))
+
+    assert fields['ValueInfo2.GT'].tolist() == ['0/1', '0/1', '0/1']
+    assert fields['ValueInfo2.AD_ALT'].tolist() == [9, 10, 18]
+    assert fields['ValueInfo2.DP'].tolist() == [16, 30, 30]
+
+
+def test_phased_csv_genotypes_are_unphased():
+    fields = parse_genotypes(pd.Series(['0|1:3,4:7', '1|0:3,4:7', '1|1:0,8:8']))
+
+    assert fields['ValueInfo2.GT'].tolist() == ['0/1', '0/1', '1/1']
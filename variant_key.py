@@ -0,0 +1,76 @@
+import numpy as np
+import pandas as pd
+
+from typing import List, Sequence
+
+from group_index import GroupIndex
+
+# Column holding the 64-bit hash of the allele of every row, added once when an input is read.
+KEY = '_variant'
+ALLELE_COLUMNS = ['Chr', 'Start', 'End', 'Ref', 'Alt']
+
+MULTIPLIER = np.uint64(0x9E3779B97F4A7C15)
+
+
+def hash_columns(df: pd.DataFrame, columns: Sequence[str]) -> np.ndarray:
+    return pd.util.hash_pandas_object(df[list(columns)], index=False).to_numpy(dtype=np.uint64)
+
+
+def with_variant_key(df: pd.DataFrame) -> pd.DataFrame:
+    if KEY in df.columns:
+        return df
+
+    return df.assign(**{KEY: hash_columns(df, ALLELE_COLUMNS)})
+
+
+def variant_keys(df: pd.DataFrame, columns: Sequence[str] = ALLELE_COLUMNS) -> np.ndarray:
+    """64-bit keys of `columns`, reusing the allele hash of the input when `columns` cover the allele."""
+    if KEY not in df.columns or not all(x in columns for x in ALLELE_COLUMNS):
+        return hash_columns(df, columns)
+
+    keys = df[KEY].to_numpy(dtype=np.uint64)
+
+    with np.errstate(over='ignore'):
+        for column in columns:
+            if column not in ALLELE_COLUMNS:
+                keys = keys * MULTIPLIER ^ pd.util.hash_pandas_object(df[column], index=False).to_numpy(dtype=np.uint64)
+
+    return keys
+
+
+def has_collision(frames: List[pd.DataFrame], keys: List[np.ndarray], columns: Sequence[str]) -> bool:
+    """Whether two different values of `columns` got the same key, only the repeated keys are checked."""
+    keys = np.concatenate(keys) if keys else np.empty(0, dtype=np.uint64)
+    repeated = pd.Series(keys).duplicated(keep=False).to_numpy()
+
+    if not repeated.any():
+        return False
+
+    values = pd.concat([df[list(columns)] for df in frames], ignore_index=True)[repeated]
+    return values.assign(_key=keys[repeated]).drop_duplicates()['_key'].duplicated().any()
+
+
+def joint_keys(frames: List[pd.DataFrame], columns: Sequence[str] = ALLELE_COLUMNS) -> List[np.ndarray]:
+    """Keys of the rows of several frames, comparable between the frames.
+
+    Equal keys always mean equal values: when two values share a hash the keys
+    fall back to exact codes over all frames.
+    """
+    keys = [variant_keys(df, columns) for df in frames]
+
+    if not has_collision(frames, keys, columns):
+        return keys
+
+    union = GroupIndex(pd.concat([df[list(columns)] for df in frames], ignore_index=True))
+    codes = union.codes(columns)[0].astype(np.uint64)
+    bounds = np.cumsum([0] + [len(df) for df in frames])
+
+    return [codes[start:end] for start, end in zip(bounds[:-1], bounds[1:])]
+
+
+def isin(keys: np.ndarray, other: np.ndarray) -> np.ndarray:
+    return pd.Series(keys).isin(other).to_numpy()
+
+
+def duplicated(keys: np.ndarray) -> np.ndarray:
+    return pd.Series(keys).duplicated().to_numpy()
@@ -0,0 +1,114 @@
+import re
+import pandas as pd
+
+from typing import Dict, NamedTuple
+
+from variant_key import KEY
+
+MISSING = '.'
+
+class Column(NamedTuple):
+    dtype: str
+    missing: str = MISSING
+
+    @property
+    def numeric(self) -> bool:
+        return self.dtype in ('Int64', 'Float64')
+
+
+# The ANNOVAR-style columns the filters and report sections work with. Numeric
+# columns use nullable dtypes, the missing-value token becomes <NA> on read and
+# is written back only when the report is generated.
+SCHEMA: Dict[str, Column] = {
+    'Chr':                  Column('string'),
+    'Start':                Column('Int64'),
+    'End':                  Column('Int64'),
+    'Ref':                  Column('string'),
+    'Alt':                  Column('string'),
+    'Func.refGene':         Column('string'),
+    'Gene.refGene':         Column('string'),
+    'ExonicFunc.refGene':   Column('string'),
+    'ExonicFunc.ensGene':   Column('string'),
+    'ExonicFunc.knownGene': Column('string'),
+    'Function_description': Column('string'),
+    'Het Iranome':          Column('Float64'),
+    'Hom Iranome':          Column('Float64'),
+    'Het Our DB':           Column('Float64'),
+    'CLNSIG':               Column('string'),
+    'Zygosity':             Column('string'),
+    'ValueInfo2':           Column('string'),
+}
+
+
+# FORMAT-style genotype fields of ValueInfo2 (GT:AD:DP:...), parsed once and kept
+# next to the raw column. They are derived data and never written to the report.
+GENOTYPE_FIELDS: Dict[str, str] = {
+    'ValueInfo2.GT':     'string',
+    'ValueInfo2.AD_REF': 'Int32',
+    'ValueInfo2.AD_ALT': 'Int32',
+    'ValueInfo2.DP':     'Int32',
+}
+
+GENOTYPE_PATTERN = re.compile(r'^(?P<GT>[^:]*)(?::(?:(?P<AD_REF>\d+),(?P<AD_ALT>\d+)[^:]*|[^:]*))?(?::(?P<DP>\d+))?')
+
+
+def parse_genotypes(values: pd.Series) -> pd.DataFrame:
+    """Extracts GT, the ref/alt allele depths and DP from `GT:AD:DP` strings in one pass."""
+    fields = values.astype('string').str.extract(GENOTYPE_PATTERN)
+    fields.columns = list(GENOTYPE_FIELDS)
+    # Phased calls are matched as unphased ones, '1|0' as '0/1'.
+    fields['ValueInfo2.GT'] = fields['ValueInfo2.GT'].str.replace('|', '/', regex=False).str.replace(r'^([^/]+)/0$', r'0/\1', regex=True)
+
+    for name, dtype in GENOTYPE_FIELDS.items():
+        if dtype != 'string':
+            fields[name] = pd.to_numeric(fields[name]).astype(dtype)
+
+    return fields
+
+
+def with_genotypes(df: pd.DataFrame, column: str = 'ValueInfo2') -> pd.DataFrame:
+    if all(x in df.columns for x in GENOTYPE_FIELDS):
+        return df
+
+    return pd.concat([df, parse_genotypes(df[column])], axis=1)
+
+
+def apply_schema(df: pd.DataFrame, schema: Dict[str, Column] = SCHEMA) -> pd.DataFrame:
+    """Converts the known columns of a text frame to their schema dtypes."""
+    df = df.copy()
+
+    for name, column in schema.items():
+        if name not in df.columns or df[name].dtype == column.dtype:
+            continue
+
+        if column.numeric:
+            values = pd.to_numeric(df[name].where(df[name] != column.missing), errors='coerce')
+            df[name] = values.astype(column.dtype)
+        else:
+            df[name] = df[name].fillna(column.missing).astype(column.dtype)
+
+    return df
+
+
+def format_number(value) -> str:
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+
+    return str(value)
+
+
+def to_text(df: pd.DataFrame, schema: Dict[str, Column] = SCHEMA) -> pd.DataFrame:
+    """Turns the typed columns back into the text written to the report."""
+    df = df.drop(columns=[x for x in [*GENOTYPE_FIELDS, KEY] if x in df.columns])
+
+    for name, column in schema.items():
+        if name not in df.columns:
+            continue
+
+        if column.numeric:
+            values = df[name].astype(object)
+            df[name] = [column.missing if pd.isna(x) else format_number(x) for x in values]
+        else:
+            df[name] = df[name].astype(object).where(df[name].notna(), column.missing)
+
+    return df
@@ -0,0 +1,181 @@
+import pathlib
+from contextlib import closing
+
+from typing import Dict, Iterator, List, Tuple, Union
+
+from compressed_io import iter_lines
+
+Path = Union[str, pathlib.Path]
+
+MISSING = '.'
+VCF_SUFFIXES = ('.vcf', '.vcf.gz', '.vcf.bgz')
+
+BASE_COLUMNS = ['Chr', 'Start', 'End', 'Ref', 'Alt']
+SAMPLE_COLUMNS = ['Zygosity', 'ValueInfo1', 'ValueInfo2']
+# ValueInfo1 of every record, ValueInfo2 holds these fields of the sample for the allele of the record.
+GENOTYPE_FORMAT = 'GT:AD:DP'
+
+# Annotation columns the filters and report sections rely on. They are filled
+# with the missing-value token when the VCF was annotated without them.
+REQUIRED_COLUMNS = ['Func.refGene', 'Gene.refGene', 'ExonicFunc.refGene', 'ExonicFunc.ensGene', 'ExonicFunc.knownGene',
+                    'Function_description', 'Het Iranome', 'Hom Iranome', 'Het Our DB', 'CLNSIG']
+
+# table_annovar.pl -vcfoutput brackets every allele's annotations with these keys
+# and escapes characters that are not allowed in INFO values.
+ANNOVAR_MARKERS = ('ANNOVAR_DATE', 'ALLELE_END')
+ANNOVAR_ESCAPES = (('\\x3b', ';'), ('\\x3d', '='), ('\\x2c', ','))
+
+
+def is_vcf(path: Path) -> bool:
+    return str(path).lower().endswith(VCF_SUFFIXES)
+
+
+def annovar_alleles(pos: int, ref: str, alt: str) -> Tuple[int, int, str, str]:
+    """Converts VCF coordinates to the Start/End/Ref/Alt convention of ANNOVAR."""
+    shared = 0
+
+    while shared < min(len(ref), len(alt)) and ref[shared] == alt[shared]:
+        shared += 1
+
+    ref, alt = ref[shared:], alt[shared:]
+    start = pos + shared
+
+    if not ref:
+        return start - 1, start - 1, '-', alt
+
+    return start, start + len(ref) - 1, ref, alt or '-'
+
+
+def unescape(key: str, value: str) -> str:
+    for escaped, character in ANNOVAR_ESCAPES:
+        value = value.replace(escaped, character)
+
+    if key.startswith(('Func.', 'ExonicFunc.')):
+        value = value.replace('_', ' ')
+
+    return value
+
+
+def zygosity(gt: str, allele: int) -> Union[str, None]:
+    alleles = [x for x in gt.replace('|', '/').split('/') if x != MISSING]
+
+    if str(allele) not in alleles:
+        return None
+
+    return 'hom' if all(x == str(allele) for x in alleles) else 'het'
+
+
+def allele_genotype(gt: str, allele: int) -> str:
+    """GT seen from one alt: the alt is 1, the reference and the other alts are 0, as `bcftools norm -m-` splits calls.
+
+    Phased calls are written unphased, so '1|2' is '0/1' for the first alt and
+    for the second one.
+    """
+    alleles = [x if x == MISSING else '1' if x == str(allele) else '0' for x in gt.replace('|', '/').split('/')]
+    return '/'.join(sorted(alleles))
+
+
+def sample_genotype(fmt: str, sample: str, allele: int) -> str:
+    """GT, the reference and `allele` depths of AD and DP of a sample, in GENOTYPE_FORMAT whatever the FORMAT order."""
+    values = dict(zip(fmt.split(':'), sample.split(':')))
+    depths = values.get('AD', MISSING).split(',')
+    ad = f'{depths[0]},{depths[allele]}' if len(depths) > allele and MISSING not in (depths[0], depths[allele]) else MISSING
+
+    return f"{allele_genotype(values.get('GT', MISSING), allele)}:{ad}:{values.get('DP', MISSING)}"
+
+
+class VcfReader():
+    """Streams a (bgzip compressed) single or multi sample VCF in the annotated CSV column model."""
+
+    def __init__(self, path: Path, sample: Union[str, int] = 0):
+        self.path = path
+        self.sample = sample
+        self.info_keys: List[str] = []
+        self.samples: List[str] = []
+        self.read_header()
+
+    def read_header(self):
+        with closing(iter_lines(self.path)) as lines:
+            for line in lines:
+                if line.startswith('##INFO=<ID='):
+                    key = line[len('##INFO=<ID='):].split(',', 1)[0]
+
+                    if key not in ANNOVAR_MARKERS and key not in self.info_keys:
+                        self.info_keys.append(key)
+                elif line.startswith('#CHROM'):
+                    self.samples = line.split('\t')[9:]
+                    break
+                elif not line.startswith('##'):
+                    raise ValueError(f'{self.path} is missing the #CHROM header line')
+
+        if not self.samples:
+            raise ValueError(f'{self.path} contains no samples')
+
+        if isinstance(self.sample, str):
+            self.sample_index = self.samples.index(self.sample)
+        else:
+            self.sample_index = self.sample
+
+    @property
+    def columns(self) -> List[str]:
+        annotations = self.info_keys + [x for x in REQUIRED_COLUMNS if x not in self.info_keys]
+        return BASE_COLUMNS + annotations + SAMPLE_COLUMNS
+
+    def parse_info(self, info: str) -> List[Dict[str, str]]:
+        alleles = [{}]
+
+        for field in info.split(';'):
+            key, _, value = field.partition('=')
+
+            if key == 'ALLELE_END':
+                alleles.append({})
+            elif key and key not in ANNOVAR_MARKERS:
+                alleles[-1][key] = unescape(key, value) if value else MISSING
+
+        return [x for x in alleles if x] or [{}]
+
+    def records(self) -> Iterator[List[str]]:
+        annotations = self.columns[len(BASE_COLUMNS):-len(SAMPLE_COLUMNS)]
+
+        for line in iter_lines(self.path):
+            if not line or line.startswith('#'):
+                continue
+
+            data = line.split('\t')
+            fmt = data[8]
+            sample = data[9 + self.sample_index]
+            gt = dict(zip(fmt.split(':'), sample.split(':'))).get('GT', MISSING)
+            info = self.parse_info(data[7])
+
+            for index, alt in enumerate(data[4].split(','), 1):
+                zyg = zygosity(gt, index)
+
+                if zyg is None or alt in ('*', MISSING):
+                    continue
+
+                start, end, ref, alt = annovar_alleles(int(data[1]), data[3], alt)
+                values = info[index - 1] if index <= len(info) else info[0]
+
+                yield ([data[0], str(start), str(end), ref, alt] + [values.get(x, MISSING) for x in annotations]
+                       + [zyg, GENOTYPE_FORMAT, sample_genotype(fmt, sample, index)])
+
+    def chunks(self, chunksize: int, columns: Union[List[str], None] = None):
+        """Yields DataFrames of at most `chunksize` records holding `columns` (all by default)."""
+        import pandas as pd
+
+        names = self.columns
+        wanted = names if columns is None else [x for x in names if x in columns]
+        positions = [names.index(x) for x in wanted]
+        offset = 0
+        buffer = []
+
+        for record in self.records():
+            buffer.append([record[x] for x in positions])
+
+            if len(buffer) >= chunksize:
+                yield pd.DataFrame(buffer, columns=wanted, index=range(offset, offset + len(buffer)), dtype=str)
+                offset += len(buffer)
+                buffer = []
+
+        if buffer or not offset:
+            yield pd.DataFrame(buffer, columns=wanted, index=range(offset, offset + len(buffer)), dtype=str)